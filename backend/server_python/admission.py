@@ -0,0 +1,148 @@
+"""Controllo di ammissione per le chiamate ai tool MCP.
+
+Tre livelli di semafori, acquisiti sempre nello stesso ordine: limite per
+tool (i tool costosi come `compare_enrich` o `recipe_parse` ne hanno uno
+basso), limite per progetto e tetto globale di chiamate in corso. Chi non trova
+posto attende in una coda limitata; a coda piena o dopo `queue_timeout`
+secondi la chiamata viene rifiutata subito con `Overloaded`, così sotto carico
+la latenza resta limitata invece di accumulare connessioni e query.
+
+Tool e progetto arrivano dal client: fuori da `tools`/`projects` contano tutti
+sotto la stessa chiave `unknown`, così semafori e contatori restano limitati.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import time
+from typing import AsyncIterator, Dict, Iterable
+
+UNKNOWN = "unknown"
+
+
+class Overloaded(Exception):
+    """Nessuno slot libero: coda piena o attesa oltre il limite."""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_limits(value: str | None) -> Dict[str, int]:
+    """`"compare_enrich=4,recipe_parse=4"` -> {"compare_enrich": 4, "recipe_parse": 4}."""
+    limits: Dict[str, int] = {}
+    for part in (value or "").split(","):
+        name, _, raw = part.partition("=")
+        if name.strip() and raw.strip().isdigit() and int(raw) > 0:
+            limits[name.strip()] = int(raw)
+    return limits
+
+
+class AdmissionController:
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queue: int,
+        queue_timeout: float,
+        tool_limits: Dict[str, int] | None = None,
+        project_limit: int | None = None,
+        tools: Iterable[str] = (),
+        projects: Iterable[str] = (),
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.tool_limits = dict(tool_limits or {})
+        self.project_limit = project_limit
+        self.tools = frozenset(tools)
+        self.projects = frozenset(projects)
+        self._global = asyncio.Semaphore(max_in_flight)
+        self._per_tool: Dict[str, asyncio.Semaphore] = {}
+        self._per_project: Dict[str, asyncio.Semaphore] = {}
+        self._in_flight = 0
+        self._waiting = 0
+        self._in_flight_by_tool: Dict[str, int] = {}
+        self.stats: Dict[str, int] = {"admitted": 0, "queued": 0, "rejected_queue_full": 0, "rejected_timeout": 0}
+
+    def _key(self, name: str | None, known: frozenset) -> str | None:
+        if name is None or name in known:
+            return name
+        return UNKNOWN
+
+    def _tool_semaphore(self, tool: str) -> asyncio.Semaphore | None:
+        limit = self.tool_limits.get(tool)
+        if limit is None:
+            return None
+        if tool not in self._per_tool:
+            self._per_tool[tool] = asyncio.Semaphore(limit)
+        return self._per_tool[tool]
+
+    def _project_semaphore(self, project: str | None) -> asyncio.Semaphore | None:
+        if not self.project_limit or not project:
+            return None
+        if project not in self._per_project:
+            self._per_project[project] = asyncio.Semaphore(self.project_limit)
+        return self._per_project[project]
+
+    async def _acquire(self, semaphore: asyncio.Semaphore, deadline: float, what: str) -> None:
+        if not semaphore.locked():
+            await semaphore.acquire()  # slot libero: nessuna attesa
+            return
+        if self._waiting >= self.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            raise Overloaded(f"Queue full ({what}).")
+        self._waiting += 1
+        self.stats["queued"] += 1
+        try:
+            await asyncio.wait_for(semaphore.acquire(), timeout=max(0.0, deadline - time.monotonic()))
+        except asyncio.TimeoutError:
+            self.stats["rejected_timeout"] += 1
+            raise Overloaded(f"Timed out waiting for a slot ({what}).") from None
+        finally:
+            self._waiting -= 1
+
+    @contextlib.asynccontextmanager
+    async def admit(self, tool: str, project: str | None = None) -> AsyncIterator[None]:
+        """Occupa gli slot globale/tool/progetto per la durata del blocco o solleva `Overloaded`."""
+        tool = self._key(tool, self.tools) or UNKNOWN
+        project = self._key(project or None, self.projects)
+        deadline = time.monotonic() + self.queue_timeout
+        acquired = []
+        try:
+            for semaphore, what in (
+                # Prima i limiti stretti: chi aspetta un tool saturo non occupa slot globali.
+                (self._tool_semaphore(tool), f"tool {tool}"),
+                (self._project_semaphore(project), f"project {project}"),
+                (self._global, "global"),
+            ):
+                if semaphore is None:
+                    continue
+                await self._acquire(semaphore, deadline, what)
+                acquired.append(semaphore)
+        except BaseException:
+            for semaphore in reversed(acquired):
+                semaphore.release()
+            raise
+        self.stats["admitted"] += 1
+        self._in_flight += 1
+        self._in_flight_by_tool[tool] = self._in_flight_by_tool.get(tool, 0) + 1
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._in_flight_by_tool[tool] -= 1
+            if not self._in_flight_by_tool[tool]:
+                del self._in_flight_by_tool[tool]
+            for semaphore in reversed(acquired):
+                semaphore.release()
+
+    def snapshot(self) -> Dict[str, object]:
+        return {
+            "in_flight": self._in_flight,
+            "waiting": self._waiting,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight_by_tool": dict(self._in_flight_by_tool),
+            **self.stats,
+        }
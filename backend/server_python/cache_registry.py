@@ -0,0 +1,252 @@
+"""Registro delle cache in memoria del processo con un unico budget di memoria.
+
+Ogni cache si registra con un nome, una priorità e una funzione che stima la
+dimensione in byte di una voce (indici NumPy, righe prodotto, payload JSON...).
+Il registro tiene il totale di tutte le cache: quando una scrittura supera il
+budget si sfrattano voci anche da altre cache con GreedyDual: ogni voce ha un
+credito pari all'"orologio" del registro più la priorità della sua cache,
+rinnovato a ogni lettura; si sfratta la voce col credito più basso e
+l'orologio sale al suo credito. Le voci a priorità bassa escono per prime, ma
+una voce che nessuno legge invecchia e prima o poi esce anche da una cache a
+priorità alta. La voce appena scritta non sfratta se stessa; una voce più
+grande dell'intero budget non viene memorizzata. `snapshot()` espone
+l'occupazione per cache.
+
+Il budget conta le voci, non la memoria residente: dopo uno sfratto il
+processo resta grande se l'allocatore non restituisce le pagine. Per questo
+`make_room` libera lo spazio di una voce prima di costruirla (il picco resta
+nel budget invece di sommarsi) e `tune_allocator` / `release_memory` fanno
+restituire a glibc i buffer grandi (matrici NumPy, righe DuckDB) liberati.
+
+Le cache sono sicure tra thread: gli indici si costruiscono con
+`asyncio.to_thread` e si leggono dall'event loop.
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import sys
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Set, Tuple
+
+# Elementi campionati per stimare liste e dict grandi (il resto si proietta).
+_SAMPLE_ITEMS = 64
+# Allocazioni glibc oltre questa soglia vanno in mmap e tornano al sistema alla free.
+_MMAP_THRESHOLD_BYTES = 128 * 1024
+# Sfratti di almeno questi byte chiedono a glibc di restituire le pagine libere.
+_TRIM_AFTER_BYTES = 4 * 2**20
+_M_MMAP_THRESHOLD = -3  # mallopt(3)
+
+
+def _load_libc() -> Any:
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6")
+        libc.mallopt, libc.malloc_trim  # glibc: musl e altre libc non li hanno
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+_libc = _load_libc()
+
+
+def tune_allocator() -> bool:
+    """Soglia mmap fissa: glibc la alza dopo ogni free di un buffer grande (fino a 32 MB), e i
+    buffer successivi finirebbero nell'heap senza tornare al sistema. False fuori da glibc."""
+    return bool(_libc is not None and _libc.mallopt(_M_MMAP_THRESHOLD, _MMAP_THRESHOLD_BYTES))
+
+
+def release_memory() -> None:
+    """Restituisce al sistema le pagine libere dell'heap glibc (no-op fuori da glibc)."""
+    if _libc is not None:
+        _libc.malloc_trim(0)
+
+
+def estimate_size(value: Any) -> int:
+    """Stima dei byte occupati da `value` senza visitare tutto: oggetti condivisi contati una volta."""
+    return _estimate(value, set(), 0)
+
+
+def _estimate(value: Any, seen: Set[int], depth: int) -> int:
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    nbytes = getattr(value, "nbytes", None)
+    if isinstance(nbytes, int):  # array NumPy
+        return nbytes + 112
+    size = sys.getsizeof(value, 64)
+    if depth > 6 or isinstance(value, (str, bytes, bytearray, int, float, bool)) or value is None:
+        return size
+    if isinstance(value, dict):
+        items: List[Any] = list(value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value)
+    else:
+        fields = getattr(value, "__dict__", None)
+        if fields is None and hasattr(value, "__slots__"):
+            fields = {name: getattr(value, name, None) for name in value.__slots__}
+        return size + (_estimate(fields, seen, depth + 1) if fields else 0)
+    if not items:
+        return size
+    # Campione a passo fisso, proiettato sul totale.
+    step = max(len(items) // _SAMPLE_ITEMS, 1)
+    sample = items[::step]
+    if isinstance(value, dict):
+        inner = sum(_estimate(k, seen, depth + 1) + _estimate(v, seen, depth + 1) for k, v in sample)
+    else:
+        inner = sum(_estimate(item, seen, depth + 1) for item in sample)
+    return size + inner * len(items) // len(sample)
+
+
+class BoundedCache:
+    """Mappa LRU i cui byte contano nel budget del registro (si crea con `CacheRegistry.register`)."""
+
+    def __init__(self, registry: "CacheRegistry", name: str, priority: int, sizeof: Callable[[Any], int]):
+        self.registry = registry
+        self.name = name
+        self.priority = priority
+        self.sizeof = sizeof
+        # chiave -> (valore, byte, credito GreedyDual), dalla meno recente: l'orologio non
+        # scende mai, quindi la prima voce ha anche il credito più basso della cache.
+        self._entries: "OrderedDict[Hashable, Tuple[Any, int, float]]" = OrderedDict()
+        self.bytes = 0
+        self.largest = 0  # voce più grande vista, per `make_room`
+        self.stats: Dict[str, int] = {"hits": 0, "misses": 0, "evictions": 0, "rejected": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __iter__(self) -> Iterator[Hashable]:
+        with self.registry._lock:
+            return iter(list(self._entries))
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self.registry._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return default
+            self._entries[key] = (entry[0], entry[1], self.registry._clock + self.priority)
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[0]
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Come `get`, senza aggiornare recenza e statistiche (per scansioni di manutenzione)."""
+        with self.registry._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def set(self, key: Hashable, value: Any) -> bool:
+        """Memorizza la voce; False se non entra nel budget (il chiamante la usa comunque)."""
+        size = max(int(self.sizeof(value)), 1)
+        with self.registry._lock:
+            self._discard(key)
+            if size > self.registry.budget_bytes:
+                self.stats["rejected"] += 1
+                print(
+                    f"Cache {self.name}: entry of {size / 2**20:.1f} MB exceeds the "
+                    f"{self.registry.budget_bytes / 2**20:.0f} MB budget, not cached"
+                )
+                return False
+            self._entries[key] = (value, size, self.registry._clock + self.priority)
+            self.bytes += size
+            self.largest = max(self.largest, size)
+            self.registry._used += size
+            self.registry._enforce(protect=(self, key))
+            return True
+
+    def make_room(self) -> None:
+        """Prima di costruire una voce: sfratta la dimensione della più grande vista finora.
+
+        Senza, la nuova voce si costruisce con il budget ancora pieno e il picco del
+        processo è budget + voce; le pagine liberate dopo non sempre tornano al sistema.
+        """
+        with self.registry._lock:
+            self.registry._enforce(reserve=self.largest)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        with self.registry._lock:
+            entry = self._entries.get(key)
+            self._discard(key)
+            return default if entry is None else entry[0]
+
+    def clear(self) -> None:
+        with self.registry._lock:
+            self.registry._used -= self.bytes
+            self._entries.clear()
+            self.bytes = 0
+
+    def _discard(self, key: Hashable) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[1]
+            self.registry._used -= entry[1]
+
+    def _evict_oldest(self) -> Tuple[int, float]:
+        _, (_, size, credit) = self._entries.popitem(last=False)
+        self.bytes -= size
+        self.registry._used -= size
+        self.stats["evictions"] += 1
+        return size, credit
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"priority": self.priority, "entries": len(self._entries), "bytes": self.bytes, **self.stats}
+
+
+class CacheRegistry:
+    def __init__(self, budget_bytes: int):
+        self.budget_bytes = budget_bytes
+        self._lock = threading.RLock()
+        self._caches: Dict[str, BoundedCache] = {}
+        self._used = 0
+        self._clock = 0.0
+        self.evictions = 0
+
+    def register(self, name: str, priority: int = 0, sizeof: Callable[[Any], int] = estimate_size) -> BoundedCache:
+        """Nuova cache nel budget comune; priorità più alta = resta più a lungo senza letture."""
+        with self._lock:
+            if name in self._caches:
+                raise ValueError(f"Cache {name!r} already registered")
+            cache = self._caches[name] = BoundedCache(self, name, priority, sizeof)
+            return cache
+
+    @property
+    def used_bytes(self) -> int:
+        return self._used
+
+    def _enforce(self, reserve: int = 0, protect: Tuple[BoundedCache, Hashable] | None = None) -> None:
+        """Sfratta finché le voci più `reserve` byte stanno nel budget; `protect` non si tocca."""
+        freed = 0
+        while self._used + reserve > self.budget_bytes:
+            # Vittima: la voce col credito più basso, cioè la prima di una delle cache. La voce
+            # protetta è appena stata scritta (in coda): è la prima solo se è l'unica.
+            victims = [
+                c for c in self._caches.values()
+                if c._entries and (protect is None or protect != (c, next(iter(c._entries))))
+            ]
+            if not victims:
+                break
+            victim = min(victims, key=lambda c: next(iter(c._entries.values()))[2])
+            size, credit = victim._evict_oldest()
+            self._clock = max(self._clock, credit)
+            self.evictions += 1
+            freed += size
+        if freed >= _TRIM_AFTER_BYTES:
+            release_memory()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "budget_bytes": self.budget_bytes,
+                "used_bytes": self._used,
+                "evictions": self.evictions,
+                "caches": {name: cache.snapshot() for name, cache in sorted(self._caches.items())},
+            }
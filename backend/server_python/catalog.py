@@ -0,0 +1,453 @@
+"""Motore del catalogo prodotti, comune a tutti i progetti.
+
+I progetti (`projects/<nome>/database.py`) forniscono solo lo schema del tool e
+le poche differenze di ricerca (`CatalogConfig`); query SQL, mappatura in
+`Product` e connessione stanno qui. La sorgente dati si sceglie per progetto
+con `CATALOG_URI_<PROGETTO>` (es. `CATALOG_URI_GDO`), altrimenti `CATALOG_URI`:
+
+- `md:<database>` (default `md:<progetto>_demo`): MotherDuck, serve `motherduck_token`
+- `duckdb:/percorso/catalogo.duckdb`: file DuckDB locale, aperto in sola lettura
+- `parquet:/percorso/cartella`: tutti i `*.parquet` della cartella
+
+In `CATALOG_URI` il segnaposto `{project}` viene sostituito col nome del progetto.
+
+Ogni backend espone la stessa tabella `main.products`, così la stessa query
+gira su MotherDuck in produzione e su file locali per load test ed edge.
+"""
+
+from __future__ import annotations
+
+import abc
+import contextlib
+import os
+import threading
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Sequence, Tuple
+
+if TYPE_CHECKING:
+    import duckdb
+
+PRODUCT_COLUMNS = ("id", "name", "brand", "categories", "price", "rate", "description", "image")
+# Servono sempre: filtri per categoria, ordinamento per prezzo e paginazione per id
+_REQUIRED_COLUMNS = ("id", "categories", "price")
+
+# Tipi interi della colonna `id`: gli id richiesti si convertono in int prima della query.
+_INTEGER_TYPES = frozenset(
+    ("TINYINT", "SMALLINT", "INTEGER", "BIGINT", "HUGEINT", "UTINYINT", "USMALLINT", "UINTEGER", "UBIGINT", "UHUGEINT")
+)
+
+# Query dopo le quali la connessione base dei cataloghi locali (DuckDB, Parquet) si riapre
+# (0 = mai). DuckDB trattiene memoria a ogni query con ORDER BY ... LIMIT su colonne testo (la
+# paginazione del carousel) e la rilascia solo alla chiusura del database: senza, l'RSS del
+# processo cresce fuori dal budget delle cache. MotherDuck non si ricicla: riconnettersi costa.
+RECYCLE_AFTER_QUERIES = int(os.getenv("CATALOG_RECYCLE_QUERIES", "1000"))
+
+# Strategie di match sul parametro `category`.
+MATCH_ILIKE = "ilike"  # categories ILIKE termine (match esatto case-insensitive)
+MATCH_IN_OR_DESCRIPTION = "in_or_description"  # categories IN (...) oppure termine nella descrizione
+
+
+@dataclass
+class Product:
+    id: int
+    name: str
+    brand: str
+    categories: str
+    price: float
+    rate: float
+    description: str
+    image: str
+
+
+@dataclass(frozen=True)
+class CatalogConfig:
+    """Differenze di ricerca tra progetti."""
+
+    project: str
+    database: str
+    category_match: str = MATCH_ILIKE
+    name_filter: bool = False
+    # True: `additional_information()` restituisce l'elenco categorie per il prompt di `min`.
+    expose_categories: bool = False
+    # True: categorie normalizzate col glossario alimentare en->it e le stopword da ricetta.
+    food_vocabulary: bool = False
+
+
+def map_product_record(record: dict) -> Product:
+    # .get(): con la proiezione per widget non tutte le colonne sono presenti
+    return Product(
+        id=record["id"],
+        name=record.get("name") or "",
+        brand=record.get("brand") or "",
+        categories=record.get("categories") or "",
+        price=float(record["price"]) if record.get("price") is not None else None,
+        rate=float(record["rate"]) if record.get("rate") is not None else None,
+        description=record.get("description") or "",
+        image=record.get("image") or "",
+    )
+
+
+# Cursore in uso per thread: `interrupt_thread` ferma la query di una chiamata scaduta.
+_active_cursors: Dict[int, Any] = {}
+_active_lock = threading.Lock()
+
+
+def interrupt_thread(thread_id: int) -> None:
+    """Interrompe la query in corso nel thread dato (hook `interrupt` del breaker del catalogo)."""
+    with _active_lock:
+        cur = _active_cursors.get(thread_id)
+    if cur is not None:
+        cur.interrupt()
+
+
+def _quote(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _is_connection_error(exc: BaseException) -> bool:
+    """True se l'errore riguarda la connessione (caduta, invalidata, I/O) e non la singola query."""
+    import duckdb  # già caricato: c'è una connessione aperta
+
+    # InterruptException (query scaduta, vedi interrupt_thread) ed errori SQL: connessione ancora valida.
+    return isinstance(
+        exc, (duckdb.ConnectionException, duckdb.FatalException, duckdb.InternalException, duckdb.IOException)
+    )
+
+
+class CatalogBackend(abc.ABC):
+    """Sorgente DuckDB: una connessione base per processo, un cursore per query."""
+
+    # Riapertura ogni RECYCLE_AFTER_QUERIES query: solo dove aprire il database costa poco.
+    recycle_connection = False
+
+    def __init__(self) -> None:
+        self._connection: duckdb.DuckDBPyConnection | None = None
+        self._lock = threading.Lock()
+        # Un solo thread apre la connessione; gli altri non aspettano dentro `_lock`.
+        self._connect_lock = threading.Lock()
+        self._queries = 0
+        self.recycle_after = RECYCLE_AFTER_QUERIES if self.recycle_connection else 0
+
+    @abc.abstractmethod
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        """Apre la connessione base, con la tabella `main.products` visibile."""
+
+    @abc.abstractmethod
+    def describe(self) -> str:
+        """URI della sorgente, per i log."""
+
+    def _base(self) -> duckdb.DuckDBPyConnection:
+        """Connessione base corrente; la apre (o la sostituisce, se da riciclare) fuori da `_lock`."""
+        with self._lock:
+            base = self._connection
+            if base is not None and not (self.recycle_after and self._queries >= self.recycle_after):
+                self._queries += 1
+                return base
+        if base is not None and not self._connect_lock.acquire(blocking=False):
+            # Un altro thread sta aprendo la sostituta: intanto si usa quella attuale.
+            with self._lock:
+                self._queries += 1
+            return base
+        if base is None:
+            self._connect_lock.acquire()
+        try:
+            with self._lock:
+                current = self._connection
+                if current is not None and current is not base:
+                    self._queries += 1
+                    return current  # aperta da un altro thread mentre si aspettava
+            try:
+                fresh = self._connect()
+            except Exception as exc:
+                if base is None:
+                    raise
+                # Riapertura fallita: la connessione attuale funziona ancora, si riprova più avanti.
+                print(f"Error reopening catalog {self.describe()}: {exc!r}")
+                with self._lock:
+                    self._queries = 1
+                return base
+            with self._lock:
+                # Il database vecchio si chiude con l'ultimo cursore aperto (i cursori lo
+                # tengono vivo, non la connessione base).
+                self._connection = fresh
+                self._queries = 1
+            return fresh
+        finally:
+            self._connect_lock.release()
+
+    @contextlib.contextmanager
+    def cursor(self) -> Iterator[duckdb.DuckDBPyConnection]:
+        base = self._base()
+        # cursor() duplica la connessione: sicuro da usare in parallelo da più thread.
+        cur = base.cursor()
+        thread_id = threading.get_ident()
+        with _active_lock:
+            _active_cursors[thread_id] = cur
+        try:
+            yield cur
+        except Exception as exc:
+            if _is_connection_error(exc):
+                # Connessione caduta (es. MotherDuck): la prossima query ne apre una nuova.
+                with self._lock:
+                    if self._connection is base:
+                        self._connection = None
+            raise
+        finally:
+            with _active_lock:
+                _active_cursors.pop(thread_id, None)
+            cur.close()
+
+
+class MotherDuckBackend(CatalogBackend):
+
+    def __init__(self, database: str):
+        super().__init__()
+        self.database = database
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        import duckdb  # import pesante: solo alla prima query, non all'avvio del server
+
+        md_token = os.getenv("motherduck_token")
+        if not md_token:
+            raise ValueError("motherduck_token non trovato nelle variabili d'ambiente")
+        connection = duckdb.connect(f"md:{self.database}?motherduck_token={md_token}")
+        print("Connected to MotherDuck")
+        return connection
+
+    def describe(self) -> str:
+        return f"md:{self.database}"
+
+
+class DuckDBFileBackend(CatalogBackend):
+    recycle_connection = True
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        import duckdb
+
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"Catalog database {self.path} not found")
+        connection = duckdb.connect(self.path, read_only=True)
+        print(f"Opened catalog {self.path}")
+        return connection
+
+    def describe(self) -> str:
+        return f"duckdb:{self.path}"
+
+
+class ParquetBackend(CatalogBackend):
+    recycle_connection = True
+
+    def __init__(self, directory: str):
+        super().__init__()
+        self.directory = directory
+
+    def _connect(self) -> duckdb.DuckDBPyConnection:
+        import duckdb
+
+        if not os.path.isdir(self.directory):
+            raise FileNotFoundError(f"Catalog directory {self.directory} not found")
+        pattern = os.path.join(self.directory, "*.parquet")
+        connection = duckdb.connect()
+        # Vista sui file: DuckDB legge solo colonne e row group che servono alla query.
+        connection.execute(
+            f"CREATE VIEW main.products AS SELECT * FROM read_parquet({_quote(pattern)}, union_by_name = true)"
+        )
+        print(f"Opened catalog {pattern}")
+        return connection
+
+    def describe(self) -> str:
+        return f"parquet:{self.directory}"
+
+
+def create_backend(uri: str) -> CatalogBackend:
+    """`md:<database>`, `duckdb:<file>` oppure `parquet:<cartella>`."""
+    scheme, _, target = uri.strip().partition(":")
+    if not target:
+        raise ValueError(f"Invalid catalog URI {uri!r}: expected md:, duckdb: or parquet:")
+    if scheme == "md":
+        return MotherDuckBackend(target)
+    if scheme == "duckdb":
+        return DuckDBFileBackend(target)
+    if scheme == "parquet":
+        return ParquetBackend(target)
+    raise ValueError(f"Unknown catalog backend {scheme!r} in {uri!r}")
+
+
+def _projection(columns: Sequence[str] | None, description_chars: int | None) -> str:
+    description = "description"
+    if description_chars is not None and description_chars > 0:
+        n = int(description_chars)
+        description = (
+            f"CASE WHEN length(description) > {n} "
+            f"THEN left(description, {n}) || '…' ELSE description END AS description"
+        )
+    if not columns:
+        return "*" if description == "description" else f"* REPLACE ({description})"
+    selected = [c for c in PRODUCT_COLUMNS if c in columns or c in _REQUIRED_COLUMNS]
+    return ", ".join(description if c == "description" else c for c in selected)
+
+
+class Catalog:
+    """Ricerca, categorie, top-N per categoria e lookup per id su un backend."""
+
+    def __init__(self, config: CatalogConfig, backend: CatalogBackend):
+        self.config = config
+        self.backend = backend
+        self._id_type: str | None = None
+
+    def id_type(self) -> str:
+        """Tipo SQL della colonna `id` (es. INTEGER, VARCHAR), letto una volta dallo schema."""
+        if self._id_type is None:
+            with self.backend.cursor() as cur:
+                row = cur.execute(
+                    "SELECT data_type FROM information_schema.columns "
+                    "WHERE table_schema = 'main' AND table_name = 'products' AND column_name = 'id'"
+                ).fetchone()
+            self._id_type = str(row[0]) if row else "VARCHAR"
+        return self._id_type
+
+    def _conditions(self, arguments: dict) -> Tuple[List[str], List[Any]]:
+        conditions: List[str] = []
+        params: List[Any] = []
+        name = arguments.get("name")
+        if self.config.name_filter and name and str(name).strip():
+            conditions.append("(name ILIKE ? OR description ILIKE ?)")
+            params += [f"%{str(name).strip()}%"] * 2
+        terms = [str(c).strip() for c in arguments.get("category") or [] if str(c).strip()]
+        if terms and self.config.category_match == MATCH_IN_OR_DESCRIPTION:
+            # categories IN lista oppure descrizione che contiene almeno un termine (case-insensitive)
+            placeholders = ", ".join("?" for _ in terms)
+            description = " OR ".join("description ILIKE ?" for _ in terms)
+            conditions.append(f"(categories COLLATE \"NOCASE\" IN ({placeholders}) OR ({description}))")
+            params += terms + [f"% {t} %" for t in terms]
+        elif terms:
+            # ILIKE = match case-insensitive (es. "Pancetta" e "pancetta" matchano uguale)
+            conditions.append("(" + " OR ".join("categories ILIKE ?" for _ in terms) + ")")
+            params += terms
+        brand = arguments.get("brand")
+        if brand:
+            conditions.append("brand = ? COLLATE \"NOCASE\"")
+            params.append(str(brand))
+        if arguments.get("min_price") is not None:
+            conditions.append("price >= ?")
+            params.append(float(arguments["min_price"]))
+        if arguments.get("max_price") is not None:
+            conditions.append("price <= ?")
+            params.append(float(arguments["max_price"]))
+        return conditions, params
+
+    def _fetch(self, query: str, params: Sequence[Any] = ()) -> List[Product]:
+        print(query)
+        with self.backend.cursor() as cur:
+            cursor = cur.execute(query, list(params))
+            # fetchall + nomi colonna: nessuna conversione pandas/numpy per poche righe
+            names = [column[0] for column in cursor.description]
+            return [map_product_record(dict(zip(names, row))) for row in cursor.fetchall()]
+
+    def search(
+        self,
+        arguments: dict,
+        limit_per_category: int | None = None,
+        limit: int | None = None,
+        after_id: Any = None,
+        columns: Sequence[str] | None = None,
+        description_chars: int | None = None,
+    ) -> List[Product]:
+        query = "SELECT " + _projection(columns, description_chars) + " FROM main.products"
+        conditions, params = self._conditions(arguments or {})
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        if limit_per_category is not None and limit_per_category > 0:
+            # Al massimo N risultati per valore di categories (ordinati per price)
+            query = (
+                "SELECT * EXCLUDE (rn) FROM ("
+                "SELECT *, ROW_NUMBER() OVER (PARTITION BY categories ORDER BY price) AS rn FROM ("
+                + query
+                + ") subq) WHERE rn <= " + str(int(limit_per_category))
+            )
+        if after_id is not None:
+            # Keyset pagination: riparte dopo l'ultimo id della pagina precedente
+            query = "SELECT * FROM (" + query + ") page WHERE id > ?"
+            params.append(after_id)
+        if limit is not None and limit > 0:
+            # LIMIT in SQL: non trasferiamo righe che poi verrebbero scartate
+            query += " ORDER BY id LIMIT " + str(int(limit))
+        return self._fetch(query, params)
+
+    def top_per_category(self, arguments: dict, n: int, **kwargs: Any) -> List[Product]:
+        """I primi `n` prodotti (per prezzo) di ogni categoria che soddisfa i filtri."""
+        return self.search(arguments, limit_per_category=n, **kwargs)
+
+    def products_by_ids(
+        self,
+        ids: Sequence[Any],
+        columns: Sequence[str] | None = None,
+        description_chars: int | None = None,
+    ) -> List[Product]:
+        """Prodotti con gli id dati, nell'ordine richiesto; gli id sconosciuti sono omessi."""
+        # Dal JSON gli id arrivano come stringhe o numeri: si convertono i parametri al tipo
+        # della colonna, mai la colonna, così DuckDB pota row group e file con le statistiche su id.
+        id_type = self.id_type()
+        params: List[Any] = []
+        for raw in ids:
+            value = str(raw)
+            if id_type in _INTEGER_TYPES:
+                # Solo la forma canonica ("42", non "042"): il chiamante ritrova i prodotti per str(id).
+                if not value.lstrip("-").isdigit() or str(int(value)) != value:
+                    continue
+                params.append(int(value))
+            else:
+                params.append(value)
+        params = list(dict.fromkeys(params))
+        if not params:
+            return []
+        placeholders = ", ".join(f"TRY_CAST(? AS {id_type})" for _ in params)
+        query = (
+            "SELECT " + _projection(columns, description_chars)
+            + f" FROM main.products WHERE id IN ({placeholders})"
+        )
+        by_id = {str(p.id): p for p in self._fetch(query, params)}
+        return [by_id[str(i)] for i in params if str(i) in by_id]
+
+    def categories(self) -> List[str]:
+        with self.backend.cursor() as cur:
+            rows = cur.execute(
+                "SELECT DISTINCT categories FROM main.products "
+                "WHERE categories IS NOT NULL AND TRIM(categories) != '' ORDER BY categories"
+            ).fetchall()
+        return [str(row[0]) for row in rows]
+
+    def facet_rows(self) -> List[Tuple[str, str, int, int]]:
+        """(categoria, brand, prezzo in centesimi, prodotti): base precalcolata delle faccette."""
+        with self.backend.cursor() as cur:
+            rows = cur.execute(
+                "SELECT coalesce(categories, ''), coalesce(brand, ''), CAST(round(price * 100) AS BIGINT), count(*) "
+                "FROM main.products WHERE price IS NOT NULL GROUP BY ALL"
+            ).fetchall()
+        return [(str(c), str(b), int(p), int(n)) for c, b, p, n in rows]
+
+    def additional_information(self) -> Any:
+        """Contesto extra per il prompt di `min`: elenco categorie o stringa vuota."""
+        return self.categories() if self.config.expose_categories else ""
+
+
+def catalog_uri(project: str, database: str | None = None) -> str:
+    """URI del catalogo di un progetto: `CATALOG_URI_<PROGETTO>`, `CATALOG_URI` o `md:<database>`."""
+    uri = (
+        os.getenv(f"CATALOG_URI_{project.upper()}")
+        or os.getenv("CATALOG_URI")
+        or f"md:{database or project + '_demo'}"
+    )
+    # `{project}` permette un solo CATALOG_URI per tutti, es. parquet:/data/catalog/{project}
+    return uri.replace("{project}", project)
+
+
+def create_catalog(config: CatalogConfig) -> Catalog:
+    """Catalogo del progetto con il backend scelto da `CATALOG_URI_<PROGETTO>` / `CATALOG_URI`."""
+    backend = create_backend(catalog_uri(config.project, config.database))
+    print(f"Catalog {config.project}: {backend.describe()}")
+    return Catalog(config, backend)
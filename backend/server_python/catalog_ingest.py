@@ -0,0 +1,381 @@
+"""Ingest del catalogo prodotti da CSV verso il backend di un progetto.
+
+    python catalog_ingest.py prodotti.csv --project electronics
+    python catalog_ingest.py prodotti.csv --target parquet:/data/catalog/gdo --dry-run
+    python catalog_ingest.py prodotti.csv --project electronics \\
+        --ts-out ../../frontend/py/new_initial_cart_items.ts
+
+Il CSV viene letto da DuckDB (`read_csv`, parallelo, a blocchi: mai tutto in
+liste Python), normalizzato e validato in SQL in una tabella di staging. Poi si
+calcola il diff con il catalogo attuale (aggiunti, modificati e, solo con
+`--delete-missing`, rimossi) e lo si applica in blocco: su DuckDB/MotherDuck con
+UPDATE/DELETE/INSERT ... SELECT in una transazione, su Parquet riscrivendo il
+file con COPY e sostituendolo in modo atomico. Un CSV parziale aggiorna solo le
+colonne che contiene: le altre restano quelle del catalogo. Con `--ts-out` scrive anche il fixture `INITIAL_CART_ITEMS` del
+frontend (sostituisce `frontend/py/generate_cart_items.py`).
+
+La destinazione segue le stesse regole del server (vedi catalog.py):
+`--target`, altrimenti `CATALOG_URI_<PROGETTO>`, `CATALOG_URI` o `md:<progetto>_demo`.
+"""
+
+from __future__ import annotations
+
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Sequence, Tuple
+
+try:
+    from .catalog import PRODUCT_COLUMNS, catalog_uri
+except ImportError:
+    from catalog import PRODUCT_COLUMNS, catalog_uri
+
+if TYPE_CHECKING:
+    import duckdb
+
+# Nomi accettati nell'intestazione del CSV per ogni colonna (senza distinzione maiuscole).
+SOURCE_COLUMNS: Dict[str, Tuple[str, ...]] = {
+    "id": ("id", "sku", "product_id"),
+    "name": ("name", "title", "nome"),
+    "brand": ("brand", "marca"),
+    "categories": ("categories", "category", "categoria"),
+    "price": ("price", "prezzo"),
+    "rate": ("rate", "rating"),
+    "description": ("description", "descrizione_prodotto", "descrizione"),
+    "image": ("image", "imageURLs", "image_url"),
+    # Solo per il fixture TS
+    "weight": ("weight", "peso"),
+    "highlights": ("pro", "highlights"),
+}
+
+_NUMERIC = ("price", "rate")
+_VALID = "id IS NOT NULL AND name IS NOT NULL AND price IS NOT NULL AND price >= 0"
+_FIXTURE_BATCH = 10_000
+
+
+def _ident(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+
+def _literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+
+def _text(expr: str) -> str:
+    # Spazi, tab e a capo compressi in uno spazio; stringa vuota -> NULL
+    return f"nullif(trim(regexp_replace({expr}, '\\s+', ' ', 'g')), '')"
+
+
+def _number(expr: str) -> str:
+    value = f"trim({expr})"
+    return f"round(coalesce(TRY_CAST({value} AS DOUBLE), TRY_CAST(replace({value}, ',', '.') AS DOUBLE)), 2)"
+
+
+def _source_expressions(header: Sequence[str], overrides: Dict[str, str]) -> Tuple[List[str], List[str]]:
+    """Espressioni SELECT per ogni colonna e colonne effettivamente presenti nel CSV."""
+    by_lower = {column.lower(): column for column in header}
+    expressions = []
+    present = []
+    for target, aliases in SOURCE_COLUMNS.items():
+        candidates = [overrides[target]] if target in overrides else aliases
+        source = next((by_lower[c.lower()] for c in candidates if c.lower() in by_lower), None)
+        if source is None:
+            if target in ("id", "name", "price"):
+                raise SystemExit(f"Missing required column {target!r} in CSV header {list(header)}")
+            expressions.append(f"NULL::{'DOUBLE' if target in _NUMERIC else 'VARCHAR'} AS {target}")
+            continue
+        present.append(target)
+        column = _ident(source)
+        if target in _NUMERIC:
+            expression = _number(column)
+        elif target == "image":
+            # Più URL separati da virgola: si tiene il primo
+            expression = _text(f"split_part({column}, ',', 1)")
+        else:
+            expression = _text(column)
+        expressions.append(f"{expression} AS {target}")
+    return expressions, present
+
+
+def _stage(
+    con: duckdb.DuckDBPyConnection, inputs: Sequence[str], overrides: Dict[str, str]
+) -> Tuple[Dict[str, int], List[str]]:
+    """Carica il CSV in `staged`; restituisce i conteggi e le colonne presenti nel CSV."""
+    source = "read_csv([" + ", ".join(_literal(p) for p in inputs) + "], header = true, all_varchar = true)"
+    header = [row[0] for row in con.execute(f"DESCRIBE SELECT * FROM {source}").fetchall()]
+    expressions, present = _source_expressions(header, overrides)
+    con.execute(
+        "CREATE TEMP VIEW parsed AS SELECT "
+        + ", ".join(expressions)
+        + f", row_number() OVER () AS _row FROM {source}"
+    )
+    # Id duplicati: vince la prima riga del file
+    con.execute(
+        f"CREATE TABLE staged AS SELECT * FROM parsed WHERE {_VALID} "
+        "QUALIFY row_number() OVER (PARTITION BY id ORDER BY _row) = 1"
+    )
+    total, rejected = con.execute(f"SELECT count(*), count(*) FILTER (WHERE NOT ({_VALID})) FROM parsed").fetchone()
+    staged = con.execute("SELECT count(*) FROM staged").fetchone()[0]
+    counts = {"rows": total, "rejected": rejected, "duplicates": total - rejected - staged, "staged": staged}
+    return counts, present
+
+
+class _Target:
+    """Catalogo di destinazione: tabella DuckDB/MotherDuck o cartella Parquet."""
+
+    def __init__(self, con: duckdb.DuckDBPyConnection, uri: str):
+        self.con = con
+        self.uri = uri
+        self.scheme, _, self.location = uri.partition(":")
+        if self.scheme == "parquet":
+            os.makedirs(self.location, exist_ok=True)
+            self.files = sorted(glob.glob(os.path.join(self.location, "*.parquet")))
+            pattern = _literal(os.path.join(self.location, "*.parquet"))
+            self.relation = f"read_parquet({pattern}, union_by_name = true)"
+            self.exists = bool(self.files)
+        elif self.scheme in ("duckdb", "md"):
+            if self.scheme == "md":
+                if not os.getenv("motherduck_token"):
+                    raise SystemExit("motherduck_token is required to write to MotherDuck")
+                con.execute(f"ATTACH {_literal('md:' + self.location)}")
+                database = self.location
+            else:
+                con.execute(f"ATTACH {_literal(self.location)} AS catalog_target")
+                database = "catalog_target"
+            self.relation = f"{_ident(database)}.main.products"
+            self.exists = con.execute(
+                "SELECT count(*) FROM duckdb_tables() "
+                "WHERE database_name = ? AND schema_name = 'main' AND table_name = 'products'",
+                [database],
+            ).fetchone()[0] > 0
+        else:
+            raise SystemExit(f"Unknown catalog target {uri!r}: expected md:, duckdb: or parquet:")
+
+    def columns(self) -> List[str]:
+        if not self.exists:
+            return list(PRODUCT_COLUMNS)
+        current = {row[0] for row in self.con.execute(f"DESCRIBE SELECT * FROM {self.relation}").fetchall()}
+        return [c for c in PRODUCT_COLUMNS if c in current]
+
+    def id_type(self) -> str:
+        """Tipo della colonna `id` del catalogo; per un catalogo nuovo BIGINT se tutti gli id sono interi."""
+        if not self.exists:
+            # "007" resta VARCHAR: come intero perderebbe gli zeri iniziali dello SKU.
+            integers = self.con.execute(
+                "SELECT coalesce(bool_and(CAST(TRY_CAST(id AS BIGINT) AS VARCHAR) IS NOT DISTINCT FROM id), false) "
+                "FROM staged"
+            ).fetchone()[0]
+            return "BIGINT" if integers else "VARCHAR"
+        for name, column_type, *_ in self.con.execute(f"DESCRIBE SELECT id FROM {self.relation}").fetchall():
+            if name == "id":
+                return column_type
+        return "VARCHAR"
+
+    def stage_ids(self) -> int:
+        """Vista `incoming`: righe in staging con l'id nel tipo del catalogo; restituisce gli id scartati."""
+        id_type = self.id_type()
+        # Si converte l'id in arrivo, non quello del catalogo: join e filtri usano la colonna così com'è.
+        self.con.execute(
+            f"CREATE TEMP VIEW incoming AS SELECT * REPLACE (TRY_CAST(id AS {id_type}) AS id) FROM staged "
+            f"WHERE TRY_CAST(id AS {id_type}) IS NOT NULL "
+            # "7" e "07" diventano lo stesso id intero: vince ancora la prima riga del file
+            f"QUALIFY row_number() OVER (PARTITION BY TRY_CAST(staged.id AS {id_type}) ORDER BY _row) = 1"
+        )
+        return self.con.execute(
+            f"SELECT count(*) FROM staged WHERE TRY_CAST(id AS {id_type}) IS NULL"
+        ).fetchone()[0]
+
+    def diff(self, columns: Sequence[str], present: Sequence[str], delete_missing: bool = False) -> Dict[str, int]:
+        """Tabella `diff` (id, change). Si confrontano solo le colonne presenti nel CSV."""
+        if not self.exists:
+            self.con.execute("CREATE TEMP TABLE diff AS SELECT id, 'added' AS change FROM incoming")
+        else:
+            def comparable(alias: str, column: str) -> str:
+                if column in _NUMERIC:
+                    return f"round(CAST({alias}.{column} AS DOUBLE), 2)"
+                return f"CAST({alias}.{column} AS VARCHAR)"
+
+            changed = " OR ".join(
+                f"{comparable('s', c)} IS DISTINCT FROM {comparable('c', c)}"
+                for c in columns
+                if c != "id" and c in present
+            )
+            # Senza --delete-missing il CSV può essere parziale: i prodotti che non contiene restano.
+            join = "FULL OUTER JOIN" if delete_missing else "LEFT JOIN"
+            self.con.execute(
+                "CREATE TEMP TABLE diff AS SELECT coalesce(s.id, c.id) AS id, "
+                "CASE WHEN c.id IS NULL THEN 'added' WHEN s.id IS NULL THEN 'removed' ELSE 'changed' END AS change "
+                f"FROM incoming s {join} {self.relation} c "
+                f"ON s.id = c.id WHERE s.id IS NULL OR c.id IS NULL OR {changed or 'false'}"
+            )
+        counts = dict(self.con.execute("SELECT change, count(*) FROM diff GROUP BY change").fetchall())
+        return {change: counts.get(change, 0) for change in ("added", "changed", "removed")}
+
+    def apply(self, columns: Sequence[str], present: Sequence[str]) -> None:
+        # Colonne assenti dal CSV: valore attuale del catalogo (NULL per i prodotti nuovi).
+        updated = [c for c in columns if c == "id" or c in present]
+        if self.scheme == "parquet":
+            merged = ", ".join(f"s.{c}" if c in updated or not self.exists else f"c.{c}" for c in columns)
+            query = f"SELECT {merged} FROM incoming s JOIN diff d ON s.id = d.id "
+            if self.exists:
+                query = (
+                    f"SELECT {', '.join(columns)} FROM {self.relation} WHERE id NOT IN (SELECT id FROM diff) "
+                    f"UNION ALL BY NAME {query}LEFT JOIN {self.relation} c ON s.id = c.id "
+                )
+            query += "WHERE d.change <> 'removed'"
+            # File temporaneo fuori dal glob *.parquet: il server non vede mai un file a metà.
+            final = os.path.join(self.location, "products.parquet")
+            tmp = os.path.join(self.location, f".products-{os.getpid()}.tmp")
+            self.con.execute(
+                f"COPY (SELECT * FROM ({query}) ORDER BY id) TO {_literal(tmp)} (FORMAT PARQUET, COMPRESSION ZSTD)"
+            )
+            os.replace(tmp, final)
+            for path in self.files:
+                if os.path.abspath(path) != os.path.abspath(final):
+                    os.remove(path)
+            return
+        if not self.exists:
+            projection = ", ".join(f"s.{c}" for c in columns)
+            self.con.execute(f"CREATE TABLE {self.relation} AS SELECT {projection} FROM incoming s ORDER BY s.id")
+            return
+        assignments = ", ".join(f"{c} = s.{c}" for c in updated if c != "id")
+        self.con.execute("BEGIN TRANSACTION")
+        try:
+            self.con.execute(f"DELETE FROM {self.relation} WHERE id IN (SELECT id FROM diff WHERE change = 'removed')")
+            if assignments:
+                self.con.execute(
+                    f"UPDATE {self.relation} AS c SET {assignments} FROM incoming s "
+                    "WHERE c.id = s.id AND s.id IN (SELECT id FROM diff WHERE change = 'changed')"
+                )
+            self.con.execute(
+                f"INSERT INTO {self.relation} BY NAME SELECT {', '.join(f's.{c}' for c in updated)} "
+                "FROM incoming s JOIN diff d ON s.id = d.id WHERE d.change = 'added'"
+            )
+            self.con.execute("COMMIT")
+        except BaseException:
+            self.con.execute("ROLLBACK")
+            raise
+
+
+def _ts_value(value: Any) -> str:
+    # Stesso formato del vecchio script: json.dumps con indentazione, rientrato nell'oggetto
+    return json.dumps(value, indent=2).replace("\n", "\n  ")
+
+
+def _split(value: str | None, lower: bool = False) -> List[str]:
+    parts = [part.strip() for part in (value or "").split(",")]
+    return [part.lower() if lower else part for part in parts if part]
+
+
+def write_fixture(con: duckdb.DuckDBPyConnection, path: str, types_import: str, limit: int | None) -> int:
+    """Scrive `INITIAL_CART_ITEMS` a blocchi, nell'ordine del CSV."""
+    query = "SELECT id, name, price, description, weight, highlights, categories, image FROM staged ORDER BY _row"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    cursor = con.execute(query)
+    tmp = path + ".tmp"
+    written = 0
+    with open(tmp, "w", encoding="utf-8") as out:
+        out.write(f'import type {{ CartItem }} from "{types_import}";\n\n')
+        out.write("export const INITIAL_CART_ITEMS: CartItem[] = [\n")
+        while True:
+            rows = cursor.fetchmany(_FIXTURE_BATCH)
+            if not rows:
+                break
+            for product_id, name, price, description, weight, highlights, categories, image in rows:
+                item = {
+                    "id": product_id,
+                    "name": name,
+                    "price": price,
+                    "description": description or "",
+                    "shortDescription": name,
+                    "detailSummary": weight or "",
+                    "nutritionFacts": [],
+                    "highlights": _split(highlights),
+                    "tags": _split(categories, lower=True),
+                    "quantity": 1,
+                    "image": image or "",
+                }
+                fields = ",\n".join(f"  {key}: {_ts_value(value)}" for key, value in item.items())
+                out.write("{\n" + fields + "\n},\n")
+                written += 1
+        out.write("];\n")
+    os.replace(tmp, path)
+    return written
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Load a product CSV into a project catalog.")
+    parser.add_argument("inputs", nargs="+", help="CSV files or globs (also .csv.gz)")
+    parser.add_argument("--project", help="Project whose catalog is updated (electronics, gdo, bricofer)")
+    parser.add_argument("--target", help="Catalog URI (md:<db>, duckdb:<file>, parquet:<dir>); overrides --project")
+    parser.add_argument("--map", action="append", default=[], metavar="COLUMN=CSV_HEADER",
+                        help="Read a catalog column from a differently named CSV column")
+    parser.add_argument("--delete-missing", action="store_true",
+                        help="Remove catalog products missing from the CSV (the CSV is a full snapshot)")
+    parser.add_argument("--dry-run", action="store_true", help="Only report the diff, do not write the catalog")
+    parser.add_argument("--diff-out", help="Write the changed ids (id, change) to this CSV")
+    parser.add_argument("--rejects-out", help="Write rows that failed validation to this CSV")
+    parser.add_argument("--ts-out", help="Also write the INITIAL_CART_ITEMS TypeScript fixture here")
+    parser.add_argument("--ts-types-import", default="../src/types", help="Import path of CartItem in the fixture")
+    parser.add_argument("--ts-limit", type=int, help="Maximum products in the fixture (default: all)")
+    parser.add_argument("--memory-limit", help="DuckDB memory limit, e.g. 2GB (larger inputs spill to disk)")
+    args = parser.parse_args(argv)
+
+    if not args.target and not args.project:
+        parser.error("pass --project or --target")
+    overrides = dict(item.split("=", 1) for item in args.map if "=" in item)
+    inputs = [path for pattern in args.inputs for path in sorted(glob.glob(pattern))]
+    if not inputs:
+        parser.error(f"no input files match {args.inputs}")
+
+    import duckdb  # import pesante: solo quando si esegue davvero l'ingest
+
+    started = time.perf_counter()
+    con = duckdb.connect()
+    if args.memory_limit:
+        con.execute(f"SET memory_limit = {_literal(args.memory_limit)}")
+    counts, present = _stage(con, inputs, overrides)
+    print(
+        f"Read {counts['rows']} rows from {len(inputs)} file(s): {counts['staged']} valid, "
+        f"{counts['rejected']} rejected, {counts['duplicates']} duplicate ids"
+    )
+    if args.rejects_out:
+        con.execute(
+            f"COPY (SELECT * EXCLUDE (_row) FROM parsed WHERE NOT ({_VALID}) ORDER BY _row) "
+            f"TO {_literal(args.rejects_out)} (HEADER)"
+        )
+
+    target = _Target(con, args.target or catalog_uri(args.project))
+    columns = target.columns()
+    skipped = target.stage_ids()
+    if skipped:
+        print(f"Skipped {skipped} rows whose id is not a valid {target.id_type()}")
+    missing = [c for c in columns if c not in present]
+    if missing and target.exists:
+        print(f"Columns not in the CSV, left unchanged: {', '.join(missing)}")
+    diff = target.diff(columns, present, args.delete_missing)
+    print(f"Diff vs {target.uri}: +{diff['added']} added, ~{diff['changed']} changed, -{diff['removed']} removed")
+    if args.diff_out:
+        con.execute(f"COPY (SELECT * FROM diff ORDER BY change, id) TO {_literal(args.diff_out)} (HEADER)")
+
+    if args.dry_run:
+        print("Dry run: catalog not modified")
+    elif not any(diff.values()):
+        print("Catalog already up to date")
+    else:
+        target.apply(columns, present)
+        print(f"Updated {target.uri}")
+
+    if args.ts_out:
+        written = write_fixture(con, args.ts_out, args.ts_types_import, args.ts_limit)
+        print(f"Wrote {written} items to {args.ts_out}")
+    print(f"Done in {time.perf_counter() - started:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,331 @@
+"""Matcher locale ingrediente -> categoria del catalogo (italiano e inglese).
+
+L'indice viene costruito una volta sola sull'elenco di categorie restituito da
+`CATALOG.additional_information()`: ogni categoria è normalizzata (minuscole,
+senza accenti, senza stopword), ridotta a radici con uno stemming leggero e
+indicizzata per token e per trigrammi. Una ricerca tocca solo le categorie che
+condividono almeno un token o un trigramma con l'ingrediente.
+
+`CategoryNormalizer` è la versione senza fuzzy per l'argomento `category` dei
+widget: riconduce ogni termine (italiano o inglese, maiuscole e plurali
+compresi) alla categoria del catalogo con la stessa chiave normalizzata o a un
+alias curato, e restituisce a parte i termini che non corrispondono a nulla.
+Glossario alimentare e stopword da ricetta ("small", "fresh", "red") valgono
+solo con `food_vocabulary=True` (gdo): negli altri cataloghi distinguono
+categorie vere come "Small Appliances" e "Large Appliances".
+"""
+
+from __future__ import annotations
+
+import json
+import re
+import unicodedata
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, Set, Tuple
+
+# Punteggio minimo sotto il quale l'ingrediente resta senza categoria.
+DEFAULT_MIN_SCORE = 0.45
+
+# Parole grammaticali: ignorate in ogni catalogo.
+FUNCTION_WORDS = {
+    # italiano
+    "di", "del", "della", "dello", "dei", "degli", "delle", "da", "dal", "dalla",
+    "con", "e", "ed", "al", "alla", "allo", "ai", "agli", "alle", "il", "lo", "la",
+    "i", "gli", "le", "un", "uno", "una", "in", "per",
+    # inglese
+    "of", "the", "and", "a", "an", "to", "for",
+}
+
+# Stopword da ricetta (freschezza, taglio, taglia): solo col vocabolario alimentare.
+_STOPWORDS = FUNCTION_WORDS | {
+    "fresco", "fresca", "freschi", "fresche", "q", "b", "qb", "tritato", "tritata",
+    "grattugiato", "grattugiata",
+    "fresh", "chopped", "minced", "grated", "sliced", "diced", "large", "small", "medium",
+    "whole", "ground", "taste",
+}
+
+# Glossario inglese -> italiano per gli ingredienti più comuni (TheMealDB è in inglese).
+_EN_IT = {
+    "egg": "uova", "eggs": "uova", "yolk": "uova", "yolks": "uova", "mince": "macinata",
+    "flour": "farina", "sugar": "zucchero", "salt": "sale", "pepper": "pepe",
+    "butter": "burro", "milk": "latte", "cream": "panna", "cheese": "formaggio",
+    "parmesan": "parmigiano", "pecorino": "pecorino", "mozzarella": "mozzarella",
+    "ricotta": "ricotta", "oil": "olio", "olive": "olive", "garlic": "aglio",
+    "onion": "cipolla", "onions": "cipolle", "shallot": "scalogno", "leek": "porro",
+    "tomato": "pomodoro", "tomatoes": "pomodori", "potato": "patate", "potatoes": "patate",
+    "carrot": "carote", "carrots": "carote", "celery": "sedano", "lemon": "limone",
+    "lemons": "limoni", "orange": "arance", "apple": "mele", "apples": "mele",
+    "banana": "banane", "strawberries": "fragole", "basil": "basilico",
+    "parsley": "prezzemolo", "rosemary": "rosmarino", "sage": "salvia", "thyme": "timo",
+    "oregano": "origano", "mint": "menta", "chicken": "pollo", "beef": "manzo",
+    "pork": "maiale", "veal": "vitello", "lamb": "agnello", "turkey": "tacchino",
+    "bacon": "pancetta", "ham": "prosciutto", "sausage": "salsiccia",
+    "sausages": "salsicce", "fish": "pesce", "salmon": "salmone", "tuna": "tonno",
+    "shrimp": "gamberi", "prawns": "gamberi", "mussels": "cozze", "clams": "vongole",
+    "rice": "riso", "pasta": "pasta", "bread": "pane", "breadcrumbs": "pangrattato",
+    "yeast": "lievito", "water": "acqua", "wine": "vino", "vinegar": "aceto",
+    "honey": "miele", "chocolate": "cioccolato", "cocoa": "cacao", "coffee": "caffe",
+    "beans": "fagioli", "chickpeas": "ceci", "lentils": "lenticchie", "peas": "piselli",
+    "mushrooms": "funghi", "mushroom": "funghi", "zucchini": "zucchine",
+    "courgette": "zucchine", "courgettes": "zucchine", "eggplant": "melanzane",
+    "aubergine": "melanzane", "spinach": "spinaci", "lettuce": "lattuga",
+    "peppers": "peperoni", "pepperoni": "salame", "corn": "mais", "nuts": "noci",
+    "walnuts": "noci", "almonds": "mandorle", "hazelnuts": "nocciole",
+    "pine": "pinoli", "stock": "brodo", "broth": "brodo", "black": "nero",
+    "white": "bianco", "red": "rosso", "green": "verde", "extra": "extra",
+    "virgin": "vergine", "sunflower": "semi", "spaghetti": "spaghetti",
+    "penne": "penne", "rigatoni": "rigatoni", "lasagne": "lasagne",
+    "yogurt": "yogurt", "mascarpone": "mascarpone", "gorgonzola": "gorgonzola",
+    "guanciale": "guanciale", "pancetta": "pancetta",
+}
+
+# Sinonimi italiani ricondotti alla voce più probabile in catalogo.
+_IT_SYNONYMS = {
+    "tuorlo": "uova", "tuorli": "uova", "albume": "uova", "albumi": "uova",
+    "spicchio": "aglio", "spicchi": "aglio", "macinato": "macinata",
+}
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def _strip_accents(text: str) -> str:
+    return "".join(
+        ch for ch in unicodedata.normalize("NFKD", text) if not unicodedata.combining(ch)
+    )
+
+
+def normalize_text(text: str) -> str:
+    """Minuscole, senza accenti e punteggiatura, spazi compattati."""
+    return " ".join(_WORD_RE.findall(_strip_accents(str(text)).lower()))
+
+
+def stem(token: str) -> str:
+    """Stemming leggero italiano/inglese: riduce singolare/plurale alla stessa radice."""
+    if len(token) <= 3 or token.isdigit():
+        return token
+    for suffix, repl in (("ies", "y"), ("oes", "o"), ("ches", "ch"), ("shes", "sh")):
+        if token.endswith(suffix):
+            return token[: -len(suffix)] + repl
+    if token.endswith("s") and not token.endswith("ss"):
+        token = token[:-1]
+    # formaggio/formaggi -> formagg, gnocco/gnocchi -> gnocc, uovo/uova -> uov
+    for _ in range(2):
+        if len(token) > 3 and token[-1] in "aeiou":
+            token = token[:-1]
+    if token.endswith(("ch", "gh")):
+        token = token[:-1]
+    return token
+
+
+def _analyze(text: str, food_vocabulary: bool = True) -> Tuple[List[str], str | None]:
+    """Token normalizzati + token "testa" del sintagma.
+
+    In inglese la testa è l'ultima parola ("chicken stock" -> stock), in italiano
+    la prima ("brodo di pollo" -> brodo).
+    """
+    out: List[str] = []
+    english = False
+    for word in normalize_text(text).split():
+        if not food_vocabulary:
+            if word not in FUNCTION_WORDS:
+                out.append(stem(word))
+            continue
+        if word in _STOPWORDS:
+            continue
+        if word in _EN_IT and _EN_IT[word] != word:
+            english = True
+        word = _EN_IT.get(word) or _IT_SYNONYMS.get(word, word)
+        out.append(stem(word))
+    if not out:
+        return out, None
+    return out, out[-1] if english else out[0]
+
+
+def _tokens(text: str, food_vocabulary: bool = True) -> List[str]:
+    return _analyze(text, food_vocabulary)[0]
+
+
+def _plain(text: str, food_vocabulary: bool = True) -> str:
+    """Come la chiave di `_analyze` ma senza stemming: distingue Pasta/Paste e Latte/Latta."""
+    if not food_vocabulary:
+        return " ".join(w for w in normalize_text(text).split() if w not in FUNCTION_WORDS)
+    words = (w for w in normalize_text(text).split() if w not in _STOPWORDS)
+    return " ".join(_EN_IT.get(w) or _IT_SYNONYMS.get(w, w) for w in words)
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def _dice(a: Set[str], b: Set[str]) -> float:
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+@dataclass(frozen=True)
+class _Entry:
+    category: str
+    key: str
+    tokens: Tuple[str, ...]
+    trigrams: frozenset
+    plain: str
+    plain_trigrams: frozenset
+
+
+class CategoryMatcher:
+    """Indice precomputato sulle categorie del catalogo."""
+
+    def __init__(self, categories: Iterable[str], min_score: float = DEFAULT_MIN_SCORE):
+        self.min_score = min_score
+        self._entries: List[_Entry] = []
+        # Più categorie possono avere la stessa radice ("Pasta"/"Paste" -> "past").
+        self._by_key: Dict[str, List[int]] = {}
+        self._token_index: Dict[str, Set[int]] = {}
+        self._trigram_index: Dict[str, Set[int]] = {}
+        for category in categories:
+            category = str(category).strip()
+            if not category:
+                continue
+            tokens = tuple(_tokens(category))
+            key = " ".join(tokens)
+            plain = _plain(category)
+            same_key = self._by_key.get(key, [])
+            if not key or any(self._entries[i].plain == plain for i in same_key):
+                continue
+            idx = len(self._entries)
+            entry = _Entry(category, key, tokens, frozenset(_trigrams(key)), plain, frozenset(_trigrams(plain)))
+            self._entries.append(entry)
+            self._by_key.setdefault(key, []).append(idx)
+            for token in tokens:
+                self._token_index.setdefault(token, set()).add(idx)
+            for gram in entry.trigrams:
+                self._trigram_index.setdefault(gram, set()).add(idx)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def match(self, ingredient: str) -> Tuple[str | None, float]:
+        """Restituisce (categoria, confidenza 0..1); categoria None sotto soglia."""
+        tokens, head = _analyze(ingredient)
+        key = " ".join(tokens)
+        if not key:
+            return None, 0.0
+        plain = _plain(ingredient)
+        plain_grams = _trigrams(plain)
+        exact = self._by_key.get(key)
+        if exact:
+            # Radici uguali: vince la forma non ridotta più simile.
+            best_idx = max(exact, key=lambda i: (self._entries[i].plain == plain, _dice(plain_grams, self._entries[i].plain_trigrams)))
+            return self._entries[best_idx].category, 1.0
+
+        grams = _trigrams(key)
+        candidates: Set[int] = set()
+        for token in tokens:
+            candidates |= self._token_index.get(token, set())
+        if not candidates:
+            for gram in grams:
+                candidates |= self._trigram_index.get(gram, set())
+
+        best: Tuple[str | None, float] = (None, 0.0)
+        best_rank: Tuple[float, float, int] = (0.0, 0.0, 0)
+        token_set = set(tokens)
+        for idx in candidates:
+            entry = self._entries[idx]
+            shared = len(token_set.intersection(entry.tokens))
+            token_score = 2 * shared / (len(token_set) + len(entry.tokens))
+            # Una categoria interamente contenuta nell'ingrediente ("Pancetta" per
+            # "pancetta affumicata") batte una generica che condivide solo trigrammi.
+            if shared == len(entry.tokens):
+                token_score = max(token_score, 0.6 + 0.4 * token_score)
+            if head in entry.tokens and len(token_set) > 1:
+                token_score = min(1.0, token_score + 0.05)
+            score = max(token_score, _dice(grams, entry.trigrams))
+            # A pari punteggio: forma non ridotta più simile, poi categoria più corta.
+            rank = (score, _dice(plain_grams, entry.plain_trigrams), -len(entry.category))
+            if best[0] is None or rank > best_rank:
+                best, best_rank = (entry.category, score), rank
+        if best[1] < self.min_score:
+            return None, round(best[1], 3)
+        return best[0], round(best[1], 3)
+
+    def resolve(self, ingredients: List[Dict[str, object]]) -> List[Dict[str, object]]:
+        """Aggiunge `category` e `confidence` a ogni ingrediente (stessa lista, nuovi dict)."""
+        resolved: List[Dict[str, object]] = []
+        for item in ingredients:
+            if not isinstance(item, dict):
+                continue
+            category, confidence = self.match(str(item.get("name") or ""))
+            resolved.append({**item, "category": category, "confidence": confidence})
+        return resolved
+
+
+def load_aliases(path: Path) -> Dict[str, List[str]]:
+    """Alias curati `{"categoria del catalogo": ["alias", ...]}`; dict vuoto se il file non c'è."""
+    try:
+        data = json.loads(path.read_text(encoding="utf8"))
+    except FileNotFoundError:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError(f"{path}: expected an object mapping categories to alias lists")
+    return {str(k): [str(a) for a in v] for k, v in data.items() if isinstance(v, list)}
+
+
+class CategoryNormalizer:
+    """Termine -> categorie canoniche del catalogo, solo per chiave esatta o alias."""
+
+    def __init__(
+        self,
+        categories: Iterable[str],
+        aliases: Mapping[str, Iterable[str]] | None = None,
+        food_vocabulary: bool = False,
+    ):
+        self.food_vocabulary = food_vocabulary
+        # Più categorie possono avere la stessa chiave ("Latte", "Latte fresco"): si tengono tutte,
+        # altrimenti il filtro ILIKE perderebbe prodotti.
+        self._by_key: Dict[str, List[str]] = {}
+        # Forma non ridotta per categoria: tra "Pasta" e "Paste" (stessa radice) vince quella esatta.
+        self._plain: Dict[str, str] = {}
+        for category in categories:
+            category = str(category).strip()
+            key = " ".join(_tokens(category, food_vocabulary))
+            if key and category not in self._by_key.setdefault(key, []):
+                self._by_key[key].append(category)
+                self._plain[category] = _plain(category, food_vocabulary)
+        self.categories = sum(len(v) for v in self._by_key.values())
+        # Alias verso categorie assenti dal catalogo: ignorati (il catalogo può cambiare).
+        self.unknown_aliases: List[str] = []
+        for canonical, names in (aliases or {}).items():
+            targets = self._by_key.get(" ".join(_tokens(canonical, food_vocabulary)))
+            if targets is None:
+                self.unknown_aliases.append(canonical)
+                continue
+            for name in names:
+                key = " ".join(_tokens(name, food_vocabulary))
+                if key:
+                    self._by_key.setdefault(key, targets)
+
+    def __len__(self) -> int:
+        return self.categories
+
+    def normalize(self, terms: Iterable[object]) -> Tuple[List[str], List[str]]:
+        """(categorie canoniche, termini senza corrispondenza), entrambe senza duplicati e in ordine."""
+        canonical: Dict[str, None] = {}
+        unmatched: Dict[str, str] = {}
+        for term in terms:
+            term = str(term).strip()
+            key = " ".join(_tokens(term, self.food_vocabulary))
+            if not key:
+                continue
+            categories = self._by_key.get(key)
+            if categories is not None and len(categories) > 1:
+                # Stessa radice, categorie diverse: solo quella scritta come il termine, se c'è.
+                plain = _plain(term, self.food_vocabulary)
+                categories = [c for c in categories if self._plain.get(c) == plain] or categories
+            if categories is not None:
+                canonical.update(dict.fromkeys(categories))
+            else:
+                unmatched.setdefault(key, term)
+        return list(canonical), list(unmatched.values())
@@ -0,0 +1,269 @@
+"""Indice di prodotti complementari per il tool `cross_sell_recommendations`.
+
+L'indice si costruisce per progetto dal catalogo (nome, marca, categoria, prezzo)
+al caricamento del catalogo, si ricostruisce a ogni `CATALOG_CACHE_SECONDS` e
+risponde in memoria: nessuna query SQL per chiamata. Non ci sono parole chiave
+di settore, quindi vale per ogni progetto. Il punteggio di un candidato combina:
+
+- affinità di parole chiave con gli articoli nel carrello, pesata per rarità (IDF);
+- affinità tra la sua categoria e quelle del carrello, calcolata dai profili di
+  parole (nomi e marche) di ogni categoria;
+- fascia di prezzo rispetto al prodotto principale, come moltiplicatore: chi
+  costa meno sale, chi costa molto di più scende o resta fuori.
+
+Le categorie già nel carrello sono escluse: lì ci sono alternative, non complementi.
+"""
+
+from __future__ import annotations
+
+import bisect
+import functools
+import heapq
+import math
+import time
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+try:
+    from .category_matcher import FUNCTION_WORDS, normalize_text, stem
+except ImportError:  # avvio come script (python main.py)
+    from category_matcher import FUNCTION_WORDS, normalize_text, stem
+
+# Token presenti in più di questa frazione del catalogo non portano informazione.
+_MAX_DOCUMENT_FREQUENCY = 0.2
+# Suggerimenti massimi per singola categoria, per variare la proposta.
+_MAX_PER_CATEGORY = 2
+# Token più pesanti tenuti nel profilo di una categoria.
+_PROFILE_TOKENS = 40
+# Categorie affini tenute per ogni categoria.
+_RELATED_CATEGORIES = 6
+# Candidati presi da ogni categoria affine, attorno al prezzo obiettivo.
+_CANDIDATES_PER_CATEGORY = 4
+# Prezzo obiettivo di un complementare, in frazione del prodotto principale.
+_TARGET_PRICE_RATIO = 0.3
+_KEYWORD_WEIGHT = 1.0
+_CATEGORY_WEIGHT = 1.0
+
+
+# Nomi, marche e categorie ripetono le stesse parole: lo stemming si calcola una volta.
+_stem = functools.lru_cache(maxsize=1 << 16)(stem)
+
+
+def _stems(text: str) -> Set[str]:
+    return {_stem(word) for word in normalize_text(text).split() if len(word) > 1 and word not in FUNCTION_WORDS}
+
+
+def _price_band(price: float, reference_price: float) -> float:
+    """Moltiplicatore per fascia di prezzo: in spesa un sugo costa più della pasta, ma non dieci volte."""
+    ratio = price / reference_price
+    if ratio <= 0.3:
+        return 1.3
+    if ratio <= 0.6:
+        return 1.15
+    if ratio <= 1:
+        return 1.0
+    return 0.5 if ratio <= 3 else 0.0 if ratio > 10 else 0.2
+
+
+@dataclass(frozen=True)
+class _Entry:
+    id: str
+    name: str
+    category: str
+    price: float | None
+    image: str
+    tokens: frozenset
+
+
+class CrossSellIndex:
+    """Indice invertito token -> prodotti, prezzi per categoria e categorie affini."""
+
+    def __init__(self, products: Iterable[Any]):
+        self.built_at = time.monotonic()
+        self._entries: List[_Entry] = []
+        self._by_id: Dict[str, int] = {}
+        postings: Dict[str, List[int]] = defaultdict(list)
+        for product in products:
+            name = str(getattr(product, "name", "") or "")
+            brand = str(getattr(product, "brand", "") or "")
+            category = str(getattr(product, "categories", "") or "")
+            price = getattr(product, "price", None)
+            entry = _Entry(
+                id=str(getattr(product, "id")),
+                name=name,
+                category=category.strip().lower(),
+                price=float(price) if isinstance(price, (int, float)) and not math.isnan(price) else None,
+                image=str(getattr(product, "image", "") or ""),
+                tokens=frozenset(_stems(f"{name} {brand} {category}")),
+            )
+            idx = len(self._entries)
+            self._entries.append(entry)
+            self._by_id[entry.id] = idx
+            for token in entry.tokens:
+                postings[token].append(idx)
+
+        total = max(len(self._entries), 1)
+        self._idf: Dict[str, float] = {}
+        self._postings: Dict[str, List[int]] = {}
+        for token, indices in postings.items():
+            if len(indices) / total > _MAX_DOCUMENT_FREQUENCY and total > 20:
+                continue
+            self._postings[token] = indices
+            self._idf[token] = math.log(1 + total / len(indices))
+
+        # Prodotti di ogni categoria ordinati per prezzo: i candidati si scelgono con bisect.
+        members: Dict[str, List[Tuple[float, int]]] = defaultdict(list)
+        for idx, entry in enumerate(self._entries):
+            if entry.price is not None:
+                members[entry.category].append((entry.price, idx))
+        self._prices: Dict[str, List[float]] = {}
+        self._members: Dict[str, List[int]] = {}
+        for category, rows in members.items():
+            rows.sort()
+            self._prices[category] = [price for price, _ in rows]
+            self._members[category] = [idx for _, idx in rows]
+        self._related = self._related_categories()
+        # Ripiego quando il carrello non dice nulla: il più economico delle categorie più grandi.
+        largest = sorted(self._members, key=lambda c: -len(self._members[c]))
+        self._fallback = [self._members[category][0] for category in largest]
+
+    def _related_categories(self) -> Dict[str, List[Tuple[str, float]]]:
+        """Per ogni categoria, le più affini per coseno tra profili di parole pesati per IDF."""
+        counts: Dict[str, Counter] = defaultdict(Counter)
+        for token, indices in self._postings.items():
+            for idx in indices:
+                counts[self._entries[idx].category][token] += 1
+        categories = len(counts)
+        if categories < 2:
+            return {}
+        spread = Counter(token for tokens in counts.values() for token in tokens)
+        sizes = Counter(entry.category for entry in self._entries)
+        inverted: Dict[str, List[Tuple[str, float]]] = defaultdict(list)
+        for category, tokens in counts.items():
+            weights = {
+                token: count / sizes[category] * math.log(1 + categories / spread[token]) for token, count in tokens.items()
+            }
+            top = heapq.nlargest(_PROFILE_TOKENS, weights.items(), key=lambda item: item[1])
+            norm = math.sqrt(sum(weight * weight for _, weight in top)) or 1.0
+            for token, weight in top:
+                inverted[token].append((category, weight / norm))
+
+        similarity: Dict[str, Dict[str, float]] = defaultdict(lambda: defaultdict(float))
+        for rows in inverted.values():
+            # Un token presente in metà delle categorie le renderebbe tutte affini tra loro.
+            if len(rows) < 2 or (len(rows) > categories / 2 and categories > 4):
+                continue
+            for left, left_weight in rows:
+                for right, right_weight in rows:
+                    if left != right:
+                        similarity[left][right] += left_weight * right_weight
+        return {
+            category: heapq.nlargest(_RELATED_CATEGORIES, others.items(), key=lambda item: item[1])
+            for category, others in similarity.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _keyword_scores(self, tokens: Dict[str, float]) -> Dict[int, float]:
+        scores: Dict[int, float] = defaultdict(float)
+        for token, weight in tokens.items():
+            for idx in self._postings.get(token, ()):
+                scores[idx] += weight
+        return scores
+
+    def _infer_category(self, tokens: Dict[str, float]) -> str | None:
+        """Categoria di un articolo fuori catalogo: quella dei prodotti più simili per parole."""
+        by_category: Dict[str, float] = defaultdict(float)
+        for idx, score in self._keyword_scores(tokens).items():
+            by_category[self._entries[idx].category] += score
+        return max(by_category, key=by_category.__getitem__) if by_category else None
+
+    def recommend(self, cart_items: List[Dict[str, Any]], max_results: int = 8) -> List[Dict[str, Any]]:
+        cart_ids: Set[str] = set()
+        cart_categories: Set[str] = set()
+        cart_tokens: Dict[str, float] = {}
+        reference_price = 0.0
+        for item in cart_items:
+            if not isinstance(item, dict):
+                continue
+            item_id = str(item.get("id") or "")
+            cart_ids.add(item_id)
+            tags = item.get("tags") if isinstance(item.get("tags"), list) else []
+            text = " ".join(
+                str(part)
+                for part in (item.get("name"), item.get("shortDescription"), item.get("detailSummary"), *tags)
+                if part
+            )
+            # Della descrizione bastano le prime righe: il resto è rumore per l'affinità.
+            text += " " + str(item.get("description") or "")[:300]
+            item_tokens = {token: self._idf[token] for token in _stems(text) if token in self._idf}
+            cart_tokens.update(item_tokens)
+            known = self._by_id.get(item_id)
+            if known is not None:
+                entry = self._entries[known]
+                cart_categories.add(entry.category)
+                reference_price = max(reference_price, entry.price or 0.0)
+                continue
+            category = self._infer_category(item_tokens)
+            if category is not None:
+                cart_categories.add(category)
+            price = item.get("price")
+            if isinstance(price, (int, float)) and price > 0:
+                reference_price = max(reference_price, float(price))
+
+        keyword = self._keyword_scores(cart_tokens)
+        affinity: Dict[str, float] = defaultdict(float)
+        for category in cart_categories:
+            for other, similarity in self._related.get(category, ()):
+                affinity[other] = max(affinity[other], similarity)
+
+        candidates: Set[int] = set(keyword)
+        target = reference_price * _TARGET_PRICE_RATIO
+        for category in affinity:
+            prices, members = self._prices[category], self._members[category]
+            start = max(bisect.bisect_left(prices, target) - _CANDIDATES_PER_CATEGORY // 2, 0)
+            candidates.update(members[start : start + _CANDIDATES_PER_CATEGORY])
+        fallback = not candidates
+        if fallback:
+            candidates.update(self._fallback[: max_results * 2])
+
+        top_keyword = max(keyword.values(), default=0.0) or 1.0
+        ranked = []
+        for idx in candidates:
+            entry = self._entries[idx]
+            if entry.id in cart_ids or entry.category in cart_categories or entry.price is None:
+                continue
+            score = _KEYWORD_WEIGHT * keyword.get(idx, 0.0) / top_keyword
+            score += _CATEGORY_WEIGHT * affinity.get(entry.category, 0.0)
+            if reference_price:
+                score *= _price_band(entry.price, reference_price)
+            if score <= 0 and not fallback:
+                continue  # molto più caro del prodotto principale: non è un complementare
+            ranked.append((score, -entry.price, idx))
+        ranked.sort(reverse=True)
+
+        suggestions: List[Dict[str, Any]] = []
+        per_category: Dict[str, int] = defaultdict(int)
+        top_score = ranked[0][0] if ranked and ranked[0][0] > 0 else 1.0
+        for score, _, idx in ranked:
+            entry = self._entries[idx]
+            if per_category[entry.category] >= _MAX_PER_CATEGORY:
+                continue
+            per_category[entry.category] += 1
+            suggestions.append(
+                {
+                    "id": entry.id,
+                    "sku": entry.id,
+                    "name": entry.name,
+                    "price": entry.price,
+                    "imageUrl": entry.image,
+                    "tags": ["recommended"],
+                    "compatibleWith": [],
+                    "priority": max(0, min(100, round(100 * score / top_score))),
+                }
+            )
+            if len(suggestions) >= max_results:
+                break
+        return suggestions
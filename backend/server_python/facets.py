@@ -0,0 +1,99 @@
+"""Faccette (brand, categorie, fasce di prezzo) per il blocco `facets` del carousel.
+
+La base è un aggregato precalcolato per progetto, (categoria, brand, prezzo in
+centesimi) -> numero di prodotti, letto con una sola GROUP BY quando il
+catalogo viene (ri)caricato. Per ogni ricerca le faccette si calcolano in
+memoria con maschere NumPy e `bincount` su quell'aggregato: nessuna query in
+più per chiamata.
+
+Ogni faccetta ignora il proprio filtro (i brand si contano senza il filtro
+brand, ecc.), così il modello vede le alternative per raffinare la ricerca.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Estremi delle fasce di prezzo (euro); l'ultima fascia è aperta.
+PRICE_EDGES = (0, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000)
+TOP_VALUES = 10
+
+
+def _cents(euros: Any) -> int:
+    # Centesimi interi: €10,50 resta sopra max_price=10, come nel filtro SQL `price <= ?`.
+    return int(round(float(euros) * 100))
+
+
+def _encode(values: Sequence[str]) -> Tuple[np.ndarray, List[str], Dict[str, int]]:
+    """Codici interi per valore (senza distinzione maiuscole) + etichetta della prima occorrenza."""
+    codes = np.empty(len(values), dtype=np.int64)
+    labels: List[str] = []
+    by_key: Dict[str, int] = {}
+    for i, value in enumerate(values):
+        key = value.strip().casefold()
+        code = by_key.get(key)
+        if code is None:
+            code = by_key[key] = len(labels)
+            labels.append(value.strip())
+        codes[i] = code
+    return codes, labels, by_key
+
+
+class FacetIndex:
+    def __init__(self, rows: Sequence[Tuple[str, str, int, int]]):
+        self.built_at = time.monotonic()
+        categories, brands, prices, counts = zip(*rows) if rows else ((), (), (), ())
+        self._category_codes, self._category_labels, self._category_keys = _encode(categories)
+        self._brand_codes, self._brand_labels, self._brand_keys = _encode(brands)
+        self._prices = np.array(prices, dtype=np.int64)  # centesimi
+        self._counts = np.array(counts, dtype=np.int64)
+        edges = np.array(PRICE_EDGES, dtype=np.int64) * 100
+        self._price_bins = np.maximum(np.searchsorted(edges, self._prices, side="right") - 1, 0)
+
+    def __len__(self) -> int:
+        return len(self._counts)
+
+    def _top(self, codes: np.ndarray, mask: np.ndarray, labels: List[str]) -> List[Dict[str, Any]]:
+        totals = np.bincount(codes[mask], weights=self._counts[mask], minlength=len(labels))
+        order = np.argsort(-totals, kind="stable")[:TOP_VALUES]
+        return [{"value": labels[i], "count": int(totals[i])} for i in order if totals[i] > 0 and labels[i]]
+
+    def compute(self, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        everything = np.ones(len(self._counts), dtype=bool)
+        terms = [str(c).strip().casefold() for c in arguments.get("category") or [] if str(c).strip()]
+        category_mask = everything
+        if terms:
+            codes = [self._category_keys[t] for t in terms if t in self._category_keys]
+            category_mask = np.isin(self._category_codes, codes)
+        brand_mask = everything
+        if arguments.get("brand"):
+            code = self._brand_keys.get(str(arguments["brand"]).strip().casefold(), -1)
+            brand_mask = self._brand_codes == code
+        price_mask = everything
+        if arguments.get("min_price") is not None:
+            price_mask = price_mask & (self._prices >= _cents(arguments["min_price"]))
+        if arguments.get("max_price") is not None:
+            price_mask = price_mask & (self._prices <= _cents(arguments["max_price"]))
+
+        histogram = np.bincount(
+            self._price_bins[category_mask & brand_mask],
+            weights=self._counts[category_mask & brand_mask],
+            minlength=len(PRICE_EDGES),
+        )
+        price = [
+            {
+                "min": PRICE_EDGES[i],
+                "max": PRICE_EDGES[i + 1] if i + 1 < len(PRICE_EDGES) else None,
+                "count": int(histogram[i]),
+            }
+            for i in np.flatnonzero(histogram)  # solo fasce non vuote: meno token per il modello
+        ]
+        return {
+            "total": int(self._counts[category_mask & brand_mask & price_mask].sum()),
+            "brands": self._top(self._brand_codes, category_mask & price_mask, self._brand_labels),
+            "categories": self._top(self._category_codes, brand_mask & price_mask, self._category_labels),
+            "price": price,
+        }
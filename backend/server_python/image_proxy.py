@@ -0,0 +1,335 @@
+"""Proxy immagini con cache su disco per la route `/proxy-image`.
+
+`SafeImage.jsx` ripiega su `/proxy-image?url=...` quando l'immagine del
+retailer non si carica (ORB/CORS). Le immagini scaricate finiscono in una cache
+LRU su disco limitata in byte, con rivalidazione ETag/Last-Modified alla
+scadenza, varianti ridimensionate per le card (se Pillow è installato) e
+coalescing dei download concorrenti della stessa immagine.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Callable, Dict, Tuple
+from urllib.parse import urljoin
+
+import httpx
+
+# Larghezze ammesse per le miniature (card carousel/list/cross-sell): la richiesta
+# viene arrotondata alla più vicina per non moltiplicare le varianti in cache.
+THUMBNAIL_WIDTHS = (96, 160, 320, 640)
+MAX_REDIRECTS = 3
+# Formati raster serviti dalla nostra origine. Niente SVG: può contenere script (XSS).
+ALLOWED_CONTENT_TYPES = frozenset({"image/jpeg", "image/png", "image/webp", "image/gif", "image/avif"})
+_CONTENT_TYPE_ALIASES = {"image/jpg": "image/jpeg", "image/pjpeg": "image/jpeg"}
+
+
+class ImageProxyError(Exception):
+    """Errore lato upstream (URL non ammesso, non immagine, troppo grande...)."""
+
+    def __init__(self, message: str, status_code: int = 502):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+@dataclass
+class CachedImage:
+    path: Path
+    content_type: str
+    etag: str
+    last_modified: str | None
+    upstream_etag: str | None
+    fetched_at: float
+
+
+class ImageDiskCache:
+    """Cache LRU su disco: `<key>.bin` con il contenuto e `<key>.json` con i metadati."""
+
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._total = sum(p.stat().st_size for p in self.directory.glob("*.bin"))
+        # I metodi girano nei thread del pool (asyncio.to_thread): _total e l'LRU sotto lock.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url: str, width: int | None = None) -> str:
+        return hashlib.sha256(f"{url}|{width or ''}".encode()).hexdigest()
+
+    def get(self, key: str) -> CachedImage | None:
+        data_path = self.directory / f"{key}.bin"
+        meta_path = self.directory / f"{key}.json"
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf8"))
+            os.utime(data_path)  # mtime = ultimo accesso, usato per l'LRU
+        except (OSError, ValueError):
+            return None
+        content_type = meta.get("content_type")
+        if content_type not in ALLOWED_CONTENT_TYPES:
+            return None  # voce scritta prima dell'allowlist (es. SVG): si riscarica e si rifiuta
+        return CachedImage(
+            path=data_path,
+            content_type=content_type,
+            etag=meta.get("etag") or f'"{key[:16]}"',
+            last_modified=meta.get("last_modified"),
+            upstream_etag=meta.get("upstream_etag"),
+            fetched_at=float(meta.get("fetched_at") or 0),
+        )
+
+    def put(
+        self,
+        key: str,
+        data: bytes,
+        content_type: str,
+        upstream_etag: str | None = None,
+        last_modified: str | None = None,
+    ) -> CachedImage:
+        data_path = self.directory / f"{key}.bin"
+        meta_path = self.directory / f"{key}.json"
+        meta = {
+            "content_type": content_type,
+            "etag": '"' + hashlib.sha256(data).hexdigest()[:32] + '"',
+            "upstream_etag": upstream_etag,
+            "last_modified": last_modified,
+            "fetched_at": time.time(),
+        }
+        # Scrittura atomica: un lettore concorrente vede il file vecchio o quello nuovo.
+        # Nome temporaneo unico: più worker (o thread) possono scrivere la stessa chiave.
+        suffix = f".{os.getpid()}.{uuid.uuid4().hex}"
+        tmp = data_path.with_name(data_path.name + suffix + ".tmp")
+        tmp_meta = meta_path.with_name(meta_path.name + suffix + ".tmp")
+        try:
+            tmp.write_bytes(data)
+            tmp_meta.write_text(json.dumps(meta), encoding="utf8")
+            with self._lock:
+                previous = data_path.stat().st_size if data_path.exists() else 0
+                os.replace(tmp, data_path)
+                os.replace(tmp_meta, meta_path)
+                self._total += len(data) - previous
+                self._evict()
+        finally:
+            for leftover in (tmp, tmp_meta):
+                leftover.unlink(missing_ok=True)
+        return CachedImage(
+            path=data_path,
+            content_type=content_type,
+            etag=meta["etag"],
+            last_modified=last_modified,
+            upstream_etag=upstream_etag,
+            fetched_at=meta["fetched_at"],
+        )
+
+    def read(self, image: CachedImage) -> bytes | None:
+        """Contenuto dell'immagine; None se l'LRU l'ha appena rimossa."""
+        try:
+            return image.path.read_bytes()
+        except OSError:
+            return None
+
+    def touch(self, key: str) -> None:
+        """Segna come appena rivalidata (304 dall'upstream)."""
+        meta_path = self.directory / f"{key}.json"
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf8"))
+            meta["fetched_at"] = time.time()
+            tmp_meta = meta_path.with_name(f"{meta_path.name}.{os.getpid()}.{uuid.uuid4().hex}.tmp")
+            tmp_meta.write_text(json.dumps(meta), encoding="utf8")
+            os.replace(tmp_meta, meta_path)
+        except (OSError, ValueError):
+            pass
+
+    def _evict(self) -> None:
+        """Rimuove le voci meno usate oltre `max_bytes` (chiamato con `_lock`)."""
+        if self._total <= self.max_bytes:
+            return
+        entries = []
+        for path in self.directory.glob("*.bin"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        entries.sort()
+        self._total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self._total <= self.max_bytes:
+                break
+            for victim in (path, path.with_suffix(".json")):
+                try:
+                    victim.unlink()
+                except OSError:
+                    pass
+            self._total -= size
+
+
+def _snap_width(width: int | None) -> int | None:
+    if not width or width <= 0:
+        return None
+    for candidate in THUMBNAIL_WIDTHS:
+        if width <= candidate:
+            return candidate
+    return THUMBNAIL_WIDTHS[-1]
+
+
+def _make_thumbnail(source: Path, width: int) -> Tuple[bytes, str] | None:
+    """Ridimensiona con Pillow (dipendenza opzionale); None se non disponibile o non serve."""
+    try:
+        from PIL import Image
+    except ImportError:
+        return None
+    with Image.open(source) as image:
+        if image.width <= width:
+            return None
+        height = max(1, round(image.height * width / image.width))
+        resized = image.resize((width, height), Image.LANCZOS)
+        out = io.BytesIO()
+        if resized.mode in ("RGBA", "LA", "P"):
+            resized.save(out, format="PNG", optimize=True)
+            return out.getvalue(), "image/png"
+        resized.convert("RGB").save(out, format="JPEG", quality=82, optimize=True)
+        return out.getvalue(), "image/jpeg"
+
+
+class ImageProxy:
+    def __init__(
+        self,
+        client_factory: Callable[[], httpx.AsyncClient],
+        cache: ImageDiskCache,
+        is_safe_url: Callable[[str], bool],
+        max_image_bytes: int,
+        ttl_seconds: float,
+    ):
+        self._client_factory = client_factory
+        self._cache = cache
+        self._is_safe_url = is_safe_url
+        self._max_image_bytes = max_image_bytes
+        self._ttl = ttl_seconds
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def get(self, url: str, width: int | None = None) -> CachedImage:
+        """Immagine originale o variante ridimensionata, dalla cache se possibile."""
+        if not self._is_safe_url(url):
+            raise ImageProxyError("URL not allowed.", status_code=400)
+        original = await self._coalesced(self._cache.key(url), lambda: self._load_original(url))
+        width = _snap_width(width)
+        if width is None:
+            return original
+        # L'ETag dell'originale nella chiave: se l'immagine cambia, cambia anche la variante.
+        variant_key = self._cache.key(url + original.etag, width)
+        variant = await asyncio.to_thread(self._cache.get, variant_key)
+        if variant is not None:
+            return variant
+        return await self._coalesced(variant_key, lambda: self._build_variant(variant_key, original, width))
+
+    async def _coalesced(self, key: str, loader: Callable) -> CachedImage:
+        """Una sola operazione per chiave: le richieste concorrenti attendono lo stesso risultato."""
+        pending = self._inflight.get(key)
+        if pending is not None:
+            return await asyncio.shield(pending)
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await loader()
+            future.set_result(result)
+            return result
+        except BaseException as exc:
+            future.set_exception(exc)
+            future.exception()  # evita "exception was never retrieved" senza attese
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def _load_original(self, url: str) -> CachedImage:
+        key = self._cache.key(url)
+        cached = await asyncio.to_thread(self._cache.get, key)
+        if cached is not None and time.time() - cached.fetched_at < self._ttl:
+            return cached
+        headers = {"Accept": "image/*"}
+        if cached is not None:
+            if cached.upstream_etag:
+                headers["If-None-Match"] = cached.upstream_etag
+            if cached.last_modified:
+                headers["If-Modified-Since"] = cached.last_modified
+        try:
+            return await self._fetch(url, key, headers, cached)
+        except (httpx.HTTPError, ImageProxyError):
+            if cached is not None:
+                # Upstream giù o lento: meglio servire la copia scaduta che niente.
+                return cached
+            raise
+
+    async def _fetch(
+        self, url: str, key: str, headers: Dict[str, str], cached: CachedImage | None
+    ) -> CachedImage:
+        client = self._client_factory()
+        current = url
+        for _ in range(MAX_REDIRECTS + 1):
+            async with client.stream("GET", current, headers=headers) as response:
+                if response.is_redirect:
+                    location = response.headers.get("location")
+                    current = urljoin(current, location or "")
+                    # Ogni salto di redirect passa di nuovo dal controllo SSRF.
+                    if not location or not self._is_safe_url(current):
+                        raise ImageProxyError("Redirect not allowed.", status_code=400)
+                    continue
+                if response.status_code == 304 and cached is not None:
+                    await asyncio.to_thread(self._cache.touch, key)
+                    return await asyncio.to_thread(self._cache.get, key) or cached
+                if response.status_code >= 400:
+                    raise ImageProxyError(f"Upstream returned {response.status_code}.")
+                content_type = response.headers.get("content-type", "").split(";", 1)[0].strip().lower()
+                content_type = _CONTENT_TYPE_ALIASES.get(content_type, content_type)
+                if not content_type.startswith("image/"):
+                    raise ImageProxyError("Upstream response is not an image.")
+                if content_type not in ALLOWED_CONTENT_TYPES:
+                    raise ImageProxyError(f"Image type {content_type} not allowed.", status_code=415)
+                declared = response.headers.get("content-length")
+                if declared and declared.isdigit() and int(declared) > self._max_image_bytes:
+                    raise ImageProxyError("Image too large.")
+                chunks = []
+                received = 0
+                async for chunk in response.aiter_bytes():
+                    received += len(chunk)
+                    if received > self._max_image_bytes:
+                        raise ImageProxyError("Image too large.")
+                    chunks.append(chunk)
+                return await asyncio.to_thread(
+                    self._cache.put,
+                    key,
+                    b"".join(chunks),
+                    content_type,
+                    upstream_etag=response.headers.get("etag"),
+                    last_modified=response.headers.get("last-modified"),
+                )
+        raise ImageProxyError("Too many redirects.")
+
+    async def _build_variant(self, key: str, original: CachedImage, width: int) -> CachedImage:
+        try:
+            thumbnail = await asyncio.to_thread(_make_thumbnail, original.path, width)
+        except Exception as exc:  # immagine corrotta o formato non supportato da Pillow
+            print(f"Error resizing proxied image: {exc}")
+            thumbnail = None
+        if thumbnail is None:
+            return original
+        data, content_type = thumbnail
+        return await asyncio.to_thread(self._cache.put, key, data, content_type)
+
+    async def read(self, url: str, width: int | None, image: CachedImage) -> Tuple[CachedImage, bytes]:
+        """Contenuto da servire; se l'LRU ha appena rimosso il file, lo riscarica una volta."""
+        data = await asyncio.to_thread(self._cache.read, image)
+        if data is None:
+            image = await self.get(url, width)
+            data = await asyncio.to_thread(self._cache.read, image)
+        if data is None:
+            raise ImageProxyError("Image evicted from cache, retry.", status_code=503)
+        return image, data
@@ -13,24 +13,33 @@ MCP Protocol Version: 2024-11-05
 from __future__ import annotations
 
 from contextvars import ContextVar
+import asyncio
+import base64
+import contextlib
+import hashlib
+import hmac
 import ipaddress
 import re
 from dotenv import load_dotenv
-import duckdb
 import json
+import logging
 import os
-import stripe
+import tempfile
+import time
 import importlib
 from copy import deepcopy
-from dataclasses import dataclass
+from dataclasses import asdict, dataclass, is_dataclass, replace
 from functools import lru_cache
 from pathlib import Path
-from typing import TYPE_CHECKING, Any, Dict, List
+from typing import TYPE_CHECKING, Any, Dict, List, Tuple
 from urllib.parse import urlparse
 
 if TYPE_CHECKING:
+    import httpx
     from starlette.requests import Request
 
+logger = logging.getLogger(__name__)
+
 # Context var per la richiesta HTTP corrente (valorizzata dal middleware).
 # Consente di leggere query params / URL args nei handler MCP (es. _list_tools).
 _current_request: ContextVar["Request | None"] = ContextVar("current_http_request", default=None)
@@ -38,7 +47,13 @@ _current_request: ContextVar["Request | None"] = ContextVar("current_http_reques
 
 def get_current_request() -> "Request | None":
     """Restituisce la richiesta HTTP corrente se il handler è stato invocato via HTTP (es. streamable MCP)."""
-    return _current_request.get()
+    # In modalità stateful i handler girano nel task della sessione, nato con la prima richiesta:
+    # la richiesta giusta è quella del request context MCP, non la contextvar.
+    try:
+        request = mcp._mcp_server.request_context.request
+    except LookupError:
+        request = None
+    return request if request is not None else _current_request.get()
 
 
 def get_current_query_params() -> Dict[str, str]:
@@ -48,7 +63,6 @@ def get_current_query_params() -> Dict[str, str]:
         return {}
     return dict(req.query_params)
 
-import httpx
 import mcp.types as types
 from mcp.server.fastmcp import FastMCP
 from mcp.server.transport_security import TransportSecuritySettings
@@ -76,7 +90,217 @@ def get_object_by_project(project: str, className: str) -> Any:
         raise ValueError(f"Database class '{className}' not found in dbClass module.")
     return obj
 
-stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+
+# Progetti esistenti (`projects/<nome>/database.py`): `proj` arriva dal client e non va usato
+# come chiave di strutture che crescono (admission, rate limit) se non è tra questi.
+PROJECTS = frozenset(
+    path.name for path in (Path(__file__).resolve().parent / "projects").iterdir() if (path / "database.py").is_file()
+)
+
+
+def _import_local(module: str) -> Any:
+    """Importa un modulo accanto a main.py, sia con avvio come package (server_python.main) sia come script."""
+    _parent = __name__.rsplit(".", 1)[0] if "." in __name__ else None
+    if _parent is not None:
+        return importlib.import_module(f".{module}", package=_parent)
+    return importlib.import_module(module)
+
+recipe_extract = _import_local("recipe_extract")
+category_matcher = _import_local("category_matcher")
+cross_sell = _import_local("cross_sell")
+resilience = _import_local("resilience")
+admission = _import_local("admission")
+ratelimit = _import_local("ratelimit")
+shared_cache = _import_local("shared_cache")
+catalog = _import_local("catalog")
+widget_assets = _import_local("widget_assets")
+sessions = _import_local("sessions")
+cache_registry = _import_local("cache_registry")
+profiler = _import_local("profiler")
+traffic_capture = _import_local("traffic_capture")
+# stripe, httpx e duckdb (con image_proxy che usa httpx) si importano al primo uso:
+# all'avvio servono solo MCP e gli schemi dei tool.
+
+# Un breaker per upstream: dopo errori (o lentezze) consecutivi si ripiega subito
+# invece di attendere il timeout pieno; /metrics ne espone lo stato.
+_UPSTREAM_FAILURE_THRESHOLD = int(os.getenv("UPSTREAM_FAILURE_THRESHOLD", "3"))
+_UPSTREAM_RESET_SECONDS = float(os.getenv("UPSTREAM_RESET_SECONDS", "30"))
+OPENAI_BREAKER = resilience.breaker(
+    "openai",
+    failure_threshold=_UPSTREAM_FAILURE_THRESHOLD,
+    reset_seconds=_UPSTREAM_RESET_SECONDS,
+    slow_call_seconds=15,
+    min_timeout=4,
+    max_timeout=20,
+)
+MEALDB_BREAKER = resilience.breaker(
+    "themealdb",
+    failure_threshold=_UPSTREAM_FAILURE_THRESHOLD,
+    reset_seconds=_UPSTREAM_RESET_SECONDS,
+    slow_call_seconds=4,
+    min_timeout=1.5,
+    max_timeout=8,
+)
+CATALOG_BREAKER = resilience.breaker(
+    "catalog",
+    failure_threshold=_UPSTREAM_FAILURE_THRESHOLD,
+    reset_seconds=_UPSTREAM_RESET_SECONDS,
+    slow_call_seconds=8,
+    min_timeout=3,
+    max_timeout=15,
+    interrupt=catalog.interrupt_thread,  # query scaduta: fermata, non lasciata girare
+)
+# Letture dell'intero catalogo per gli indici (semantico, cross-sell, faccette): girano in
+# background e su cataloghi grandi superano slow_call_seconds senza che il catalogo stia
+# male. Breaker a parte, senza soglia di lentezza, così non aprono quello delle ricerche.
+CATALOG_BULK_BREAKER = resilience.breaker(
+    "catalog_bulk",
+    failure_threshold=_UPSTREAM_FAILURE_THRESHOLD,
+    reset_seconds=_UPSTREAM_RESET_SECONDS,
+)
+
+# Budget complessivo per tool (secondi): le chiamate upstream ne usano solo il residuo.
+TOOL_DEADLINE_SECONDS = float(os.getenv("TOOL_DEADLINE_SECONDS", "20"))
+_TOOL_DEADLINES = {
+    "recipe_search": 10.0,
+    "compare_enrich": 15.0,
+    "cross_sell_recommendations": 5.0,
+    "products_by_ids": 5.0,
+    "carousel": 12.0,
+    "list": 12.0,
+}
+
+# Admission control: tetto globale di tool in corso con coda limitata, più limiti per
+# tool costoso e per progetto. Oltre la coda si risponde subito con un errore ritentabile.
+ADMISSION = admission.AdmissionController(
+    max_in_flight=int(os.getenv("MCP_MAX_IN_FLIGHT", "32")),
+    max_queue=int(os.getenv("MCP_MAX_QUEUE", "64")),
+    queue_timeout=float(os.getenv("MCP_QUEUE_TIMEOUT_SECONDS", "5")),
+    tool_limits={
+        "compare_enrich": 4,
+        "recipe_parse": 4,
+        "recipe_bundle": 4,
+        "recipe_search": 8,
+        "create_payment_intent": 4,
+        **admission.parse_limits(os.getenv("MCP_TOOL_CONCURRENCY")),
+    },
+    project_limit=int(os.getenv("MCP_PROJECT_CONCURRENCY", "16")),
+    projects=PROJECTS,
+)
+
+# Modalità stateful (MCP_STATEFUL=1): sessioni MCP con progetto risolto, ultimi risultati e
+# carrello per sessione (vedi sessions.py). Le sessioni vivono nel worker che le ha create:
+# con più worker serve affinità sull'header mcp-session-id.
+MCP_STATEFUL = os.getenv("MCP_STATEFUL", "0").lower() in ("1", "true", "yes")
+SESSION_IDLE_SECONDS = float(os.getenv("SESSION_IDLE_SECONDS", "1800"))
+
+# Rate limiting token bucket per tool, prima del dispatcher (vedi ratelimit.py).
+# RATE_LIMITS sovrascrive i default tool per tool; "*" vale per tutti gli altri.
+# Senza RATE_LIMIT_KEY la chiave è la sessione MCP (stateful, una per conversazione). In
+# stateless una chiave per conversazione non c'è: dietro ChatGPT tutte le chiamate arrivano
+# dagli stessi IP di uscita e un bucket per IP renderebbe i limiti globali, quindi il
+# limitatore resta spento finché RATE_LIMIT_KEY non viene scelto esplicitamente.
+RATE_LIMIT_KEY = os.getenv("RATE_LIMIT_KEY", "session" if MCP_STATEFUL else "")
+RATE_LIMIT_ENABLED = bool(RATE_LIMIT_KEY) and os.getenv("RATE_LIMIT_ENABLED", "1").lower() not in ("0", "false", "no")
+RATE_LIMITER = ratelimit.RateLimiter(
+    store=ratelimit.create_store(os.getenv("RATE_LIMIT_STORE")),
+    limits={
+        **ratelimit.parse_limits(
+            "compare_enrich=10/60,recipe_parse=10/60,recipe_bundle=10/60,"
+            "recipe_search=30/60,create_payment_intent=5/60,*=120/60"
+        ),
+        **ratelimit.parse_limits(os.getenv("RATE_LIMITS")),
+    },
+    key_by=RATE_LIMIT_KEY or "ip",
+    # Proxy davanti al server (Render/ngrok: 1); 0 = IP del peer, X-Forwarded-For ignorato.
+    # Render imposta RENDER: lì il peer è sempre il proxy e con 0 tutti avrebbero un solo bucket.
+    trusted_proxies=int(os.getenv("RATE_LIMIT_TRUSTED_PROXIES", "1" if os.getenv("RENDER") else "0")),
+    sessions_validated=MCP_STATEFUL,
+    projects=PROJECTS,
+)
+
+# Profiler su richiesta (vedi profiler.py): senza PROFILER_SECRET route admin e header
+# X-Profile sono disattivati. Armato per worker; gli stack vanno in PROFILE_DIR.
+PROFILER_SECRET = os.getenv("PROFILER_SECRET", "")
+PROFILER = profiler.Profiler(
+    Path(os.getenv("PROFILE_DIR", str(Path(tempfile.gettempdir()) / "mcp-profiles"))),
+    interval=float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000,
+    max_active=int(os.getenv("PROFILE_MAX_CONCURRENT", "4")),
+)
+
+
+# Cattura del traffico MCP per traffic_replay.py (vedi traffic_capture.py): attiva solo
+# con CAPTURE_DIR; argomenti ripuliti da segreti e dati personali prima della scrittura.
+_capture_dir = os.getenv("CAPTURE_DIR", "")
+CAPTURE = (
+    traffic_capture.TrafficCapture(
+        Path(_capture_dir),
+        sample_rate=float(os.getenv("CAPTURE_SAMPLE_RATE", "1")),
+        max_bytes=int(float(os.getenv("CAPTURE_MAX_MB", "512")) * 2**20),
+    )
+    if _capture_dir
+    else None
+)
+
+# Upstream finti (vedi upstream_mocks.py) per rigiocare traffico catturato senza rete né costi.
+MOCK_UPSTREAMS = os.getenv("MOCK_UPSTREAMS", "0").lower() in ("1", "true", "yes")
+
+
+@lru_cache(maxsize=1)
+def _upstream_mocks() -> Any:
+    upstream_mocks = _import_local("upstream_mocks")
+    latencies = upstream_mocks.parse_latencies(os.getenv("MOCK_UPSTREAM_LATENCY_MS"))
+    logger.warning("MOCK_UPSTREAMS enabled: OpenAI, TheMealDB, recipe pages and Stripe are simulated (%s)", latencies)
+    return upstream_mocks, upstream_mocks.MockTransport(latencies)
+
+
+def _mock_transport() -> Any:
+    """Transport httpx degli upstream finti, None per quelli reali."""
+    return _upstream_mocks()[1] if MOCK_UPSTREAMS else None
+
+
+def _profiler_secret_ok(value: str | None) -> bool:
+    if not PROFILER_SECRET or not value:
+        return False
+    return hmac.compare_digest(value.encode(), PROFILER_SECRET.encode())
+
+
+def _admin_authorized(request: Request) -> bool:
+    """Route di servizio (`/admin/profile`, `/metrics`): `Authorization: Bearer <PROFILER_SECRET>`."""
+    auth = request.headers.get("authorization", "")
+    return _profiler_secret_ok(auth[7:] if auth[:7].lower() == "bearer " else None)
+
+
+# Un solo budget di memoria per tutte le cache in-process (vedi cache_registry.py): a budget
+# pieno si sfrattano prima le voci a priorità bassa (risultati), per ultimi gli indici piccoli
+# e costosi da ricostruire. Lo stato per cache è in /metrics.
+CACHES = cache_registry.CacheRegistry(int(float(os.getenv("CACHE_MEMORY_BUDGET_MB", "256")) * 2**20))
+# Indici e righe del catalogo liberati devono tornare al sistema, non restare nell'heap.
+cache_registry.tune_allocator()
+
+# Cache condivisa tra i worker (file SQLite locale): categorie, risultati prodotti,
+# ricette e risposte LLM calcolati da un worker servono anche agli altri. Con un solo
+# worker non c'è nessuno con cui condividere: di default resta in memoria.
+_shared_cache_path = os.getenv(
+    "SHARED_CACHE_PATH",
+    str(Path(tempfile.gettempdir()) / "mcp-shared-cache.sqlite3")
+    if int(os.getenv("WEB_CONCURRENCY", "1")) > 1
+    else "off",
+)
+SHARED_CACHE = shared_cache.SharedCache(
+    None if _shared_cache_path.lower() in ("", "off", "memory") else _shared_cache_path,
+    memory=CACHES.register("shared_cache", priority=10, sizeof=shared_cache.entry_size),
+)
+CATALOG_CACHE_SECONDS = float(os.getenv("CATALOG_CACHE_SECONDS", "300"))
+LLM_CACHE_SECONDS = float(os.getenv("LLM_CACHE_SECONDS", "86400"))
+
+# Lookup per id (`products_by_ids`, idratazione di `compare_enrich`): id massimi per chiamata
+# e colonne restituite se il chiamante non sceglie `fields`.
+PRODUCTS_BY_IDS_MAX = int(os.getenv("PRODUCTS_BY_IDS_MAX", "100"))
+_PRODUCTS_BY_IDS_FIELDS = ["id", "name", "brand", "categories", "price", "image"]
+
+# Tetto di download per le pagine ricetta di `recipe_parse` (byte).
+RECIPE_FETCH_MAX_BYTES = int(os.getenv("RECIPE_FETCH_MAX_BYTES", str(recipe_extract.DEFAULT_MAX_BYTES)))
 
 @dataclass(frozen=True)
 class Widget:
@@ -86,27 +310,16 @@ class Widget:
     template_uri: str
     invoking: str
     invoked: str
-    html: str
+    component: str
     response_text: str
 
+    @property
+    def html(self) -> str:
+        # Build corrente: l'indice lo aggiorna _handle_read_resource (in un thread) o il lifespan.
+        return WIDGET_ASSETS.get(self.component).html
 
-ASSETS_DIR = Path(__file__).resolve().parent.parent.parent / "frontend" / "assets"
-
-
-@lru_cache(maxsize=None)
-def _load_widget_html(component_name: str) -> str:
-    html_path = ASSETS_DIR / f"{component_name}.html"
-    if html_path.exists():
-        return html_path.read_text(encoding="utf8")
 
-    fallback_candidates = sorted(ASSETS_DIR.glob(f"{component_name}-*.html"))
-    if fallback_candidates:
-        return fallback_candidates[-1].read_text(encoding="utf8")
-
-    raise FileNotFoundError(
-        f'Widget HTML for "{component_name}" not found in {ASSETS_DIR}. '
-        "Run `pnpm run build` to generate the assets before starting the server."
-    )
+ASSETS_DIR = Path(__file__).resolve().parent.parent.parent / "frontend" / "assets"
 
 
 widgets: List[Widget] = [
@@ -117,7 +330,7 @@ widgets: List[Widget] = [
         template_uri="ui://widget/carousel.html",
         invoking="Carousel some spots",
         invoked="Served a fresh carousel",
-        html=_load_widget_html("carousel"),
+        component="carousel",
         response_text="Rendered a carousel!",
     ),
     Widget(
@@ -127,7 +340,7 @@ widgets: List[Widget] = [
         template_uri="ui://widget/list.html",
         invoking="List some spots",
         invoked="Show a list of products",
-        html=_load_widget_html("list"),
+        component="list",
         response_text="Showed a list of products!",
     ),
     Widget(
@@ -137,12 +350,21 @@ widgets: List[Widget] = [
         template_uri="ui://widget/shopping-cart.html",
         invoking="Open shopping cart",
         invoked="Opened shopping cart",
-        html=_load_widget_html("shopping-cart"),
+        component="shopping-cart",
         response_text="Rendered the shopping cart!",
     ),
 ]
 
 
+# Bundle HTML dei widget: indicizzati alla prima richiesta (o all'avvio del worker) e
+# ricaricati quando `pnpm run build` li riscrive, senza riavviare il server.
+WIDGET_ASSETS = widget_assets.WidgetAssets(
+    ASSETS_DIR,
+    components=[widget.component for widget in widgets],
+    poll_seconds=float(os.getenv("WIDGET_ASSETS_POLL_SECONDS", "2")),
+)
+
+
 MIME_TYPE = "text/html+skybridge"
 
 
@@ -173,9 +395,60 @@ def _transport_security_settings() -> TransportSecuritySettings:
 
 mcp = FastMCP(
     name="mcp-python",
-    stateless_http=True,
+    stateless_http=not MCP_STATEFUL,
     transport_security=_transport_security_settings(),
 )
+if hasattr(mcp.settings, "session_idle_timeout"):
+    mcp.settings.session_idle_timeout = SESSION_IDLE_SECONDS  # stessa scadenza per trasporto e contesto
+
+SESSIONS = sessions.SessionStore(
+    CACHES.register(
+        "sessions",
+        priority=90,
+        # Il modulo del progetto è condiviso: si contano solo i dati della sessione.
+        sizeof=lambda c: cache_registry.estimate_size((c.results, c.cart, c.tools, c.prompts)),
+    ),
+    idle_seconds=SESSION_IDLE_SECONDS,
+    max_results=int(os.getenv("SESSION_MAX_RESULTS", "8")),
+)
+
+
+def _session_context() -> Any:
+    """Contesto della sessione MCP corrente; None in modalità stateless o senza sessione."""
+    if not MCP_STATEFUL:
+        return None
+    request = get_current_request()
+    session_id = request.headers.get("mcp-session-id") if request is not None else None
+    if not session_id:
+        return None
+    return SESSIONS.get(
+        session_id, request.query_params.get("proj"), lambda project: get_object_by_project(project, "database")
+    )
+
+
+def _remember_result(session: Any, products: List[Any], structured: Dict[str, Any]) -> str:
+    """Con una sessione: memorizza i prodotti mostrati e aggiunge `result_id`; restituisce il testo per il modello."""
+    if session is None or not products:
+        return "Fetched products."
+    structured["result_id"] = session.add_result(products, SESSIONS.max_results)
+    SESSIONS.save(session)
+    return f"Fetched products (result_id {structured['result_id']}: pass it to compare_enrich or products_by_ids instead of ids)."
+
+
+def _session_tool_schemas(tools: List[types.Tool]) -> None:
+    """Argomenti in più in modalità stateful: `result_id` al posto degli id, carrello opzionale."""
+    result_id = {
+        "type": "string",
+        "description": "result_id returned by carousel or list in this session: uses the products of that result.",
+    }
+    for tool in tools:
+        schema = tool.inputSchema
+        if tool.name in ("compare_enrich", "products_by_ids"):
+            schema["properties"]["result_id"] = result_id
+            schema.pop("required", None)
+        elif tool.name == "cross_sell_recommendations":
+            schema["properties"]["cartItems"]["description"] = "Omit to reuse the last cart sent in this session."
+            schema.pop("required", None)
 
 
 def _resource_description(widget: Widget) -> str:
@@ -200,8 +473,14 @@ def _tool_invocation_meta(widget: Widget) -> Dict[str, Any]:
 
 # Tool custom: esposti solo per i progetti indicati (evita di confondere l'agente su proj diversi da gdo)
 PROJECT_EXTRA_TOOLS: Dict[str, List[str]] = {
-    "gdo": ["recipe_search", "recipe_parse"],
+    "gdo": ["recipe_search", "recipe_parse", "recipe_bundle"],
 }
+# Tool custom di ogni progetto: l'indice cross-sell si costruisce dal catalogo del progetto.
+COMMON_EXTRA_TOOLS: List[str] = ["cross_sell_recommendations"]
+
+
+def _project_extra_tools(project: str | None) -> List[str]:
+    return (COMMON_EXTRA_TOOLS if project in PROJECTS else []) + PROJECT_EXTRA_TOOLS.get(project, [])
 
 _TOOL_RECIPE_SEARCH = types.Tool(
     name="recipe_search",
@@ -243,24 +522,87 @@ _TOOL_RECIPE_PARSE = types.Tool(
         "readOnlyHint": True,
     },
 )
+_TOOL_RECIPE_BUNDLE = types.Tool(
+    name="recipe_bundle",
+    title="Recipe shopping bundle",
+    description="Trova la ricetta (per nome, testo o link), risolve gli ingredienti sulle categorie del catalogo e mostra nel widget lista il prodotto più economico per ogni ingrediente, in un'unica chiamata. Preferirlo alla sequenza recipe_search/recipe_parse + list.",
+    inputSchema={
+        "type": "object",
+        "properties": {
+            "query": {"type": "string", "description": "Nome ricetta o piatto"},
+            "text": {"type": "string", "description": "Testo ricetta"},
+            "url": {"type": "string", "description": "Link ricetta"},
+        },
+        "additionalProperties": False,
+    },
+    _meta=_tool_meta(WIDGETS_BY_ID["list"]),
+    annotations={
+        "destructiveHint": False,
+        "openWorldHint": True,
+        "readOnlyHint": True,
+    },
+)
+_TOOL_CROSS_SELL = types.Tool(
+    name="cross_sell_recommendations",
+    title="Cross-sell recommendations",
+    description="Suggests accessories and complementary catalog products for the items in the shopping cart. Used by the shopping-cart widget.",
+    inputSchema={
+        "type": "object",
+        "properties": {
+            "cartItems": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "id": {},
+                        "name": {"type": "string"},
+                        "description": {"type": "string"},
+                        "shortDescription": {"type": "string"},
+                        "detailSummary": {"type": "string"},
+                        "tags": {"type": "array", "items": {"type": "string"}},
+                    },
+                    "additionalProperties": True,
+                },
+            },
+            "maxResults": {"type": "integer", "minimum": 1, "maximum": 20},
+        },
+        "required": ["cartItems"],
+        "additionalProperties": False,
+    },
+    annotations={
+        "destructiveHint": False,
+        "openWorldHint": False,
+        "readOnlyHint": True,
+    },
+)
 _EXTRA_TOOLS_BY_NAME: Dict[str, types.Tool] = {
     "recipe_search": _TOOL_RECIPE_SEARCH,
     "recipe_parse": _TOOL_RECIPE_PARSE,
+    "recipe_bundle": _TOOL_RECIPE_BUNDLE,
+    "cross_sell_recommendations": _TOOL_CROSS_SELL,
 }
+# Tool registrati: gli altri nomi contano in admission e rate limit sotto "unknown" (e il
+# dispatch li rifiuta).
+ADMISSION.tools = RATE_LIMITER.tools = frozenset(
+    [*(widget.identifier for widget in widgets), "min", "create_payment_intent", "compare_enrich", "products_by_ids", *_EXTRA_TOOLS_BY_NAME]
+)
 
 
 @mcp._mcp_server.list_tools()
 async def _list_tools() -> List[types.Tool]:
+    session = _session_context()
+    if session is not None and session.tools is not None:
+        return session.tools
     query_params = get_current_query_params()
     project = query_params.get("proj")
-    db = get_object_by_project(project, "database")
+    db = session.db if session is not None else get_object_by_project(project, "database")
     base_tools: List[types.Tool] = [
         *[
             types.Tool(
                 name=widget.identifier,
                 title=widget.title,
                 description=f"{widget.description}",
-                inputSchema=deepcopy(db.TOOL_INPUT_SCHEMA),
+                inputSchema=_widget_input_schema(widget, db),
                 _meta=_tool_meta(widget),
                 annotations={
                     "destructiveHint": False,
@@ -294,6 +636,21 @@ async def _list_tools() -> List[types.Tool]:
                 "properties": {
                     "amount": {"type": "integer", "description": "Amount in cents"},
                     "currency": {"type": "string", "description": "Currency code (e.g. eur)"},
+                    "checkout_id": {
+                        "type": "string",
+                        "description": "Client-generated id, new for every payment attempt and reused only to retry an attempt whose outcome is unknown (timeout). Without it the payment is not idempotent.",
+                    },
+                    "cart": {
+                        "type": "array",
+                        "description": "Cart lines ({id, quantity}), part of the idempotency key with checkout_id",
+                        "items": {
+                            "type": "object",
+                            "properties": {
+                                "id": {"type": "string"},
+                                "quantity": {"type": "integer"},
+                            },
+                        },
+                    },
                 },
                 "required": ["amount"],
                 "additionalProperties": False,
@@ -307,10 +664,15 @@ async def _list_tools() -> List[types.Tool]:
         types.Tool(
             name="compare_enrich",
             title="Generate pro/contro",
-            description="Genera pro e contro per una lista di prodotti.",
+            description="Genera pro e contro per una lista di prodotti (bastano gli id: i dati vengono presi dal catalogo).",
             inputSchema={
                 "type": "object",
                 "properties": {
+                    "ids": {
+                        "type": "array",
+                        "items": {"type": ["string", "integer"]},
+                        "description": "Catalog ids of the products to compare.",
+                    },
                     "items": {
                         "type": "array",
                         "items": {
@@ -328,7 +690,6 @@ async def _list_tools() -> List[types.Tool]:
                         }
                     },
                 },
-                "required": ["items"],
                 "additionalProperties": False,
             },
             annotations={
@@ -337,9 +698,43 @@ async def _list_tools() -> List[types.Tool]:
                 "readOnlyHint": True,
             },
         ),
+        types.Tool(
+            name="products_by_ids",
+            title="Products by id",
+            description="Returns current name, price, brand, categories and image of catalog products by id, in one call. Use it to refresh cart or comparison items instead of passing whole product objects around.",
+            inputSchema={
+                "type": "object",
+                "properties": {
+                    "ids": {
+                        "type": "array",
+                        "items": {"type": ["string", "integer"]},
+                        "minItems": 1,
+                        "maxItems": PRODUCTS_BY_IDS_MAX,
+                    },
+                    "fields": {
+                        "type": "array",
+                        "items": {"type": "string", "enum": list(catalog.PRODUCT_COLUMNS)},
+                        "description": "Columns to return (id is always included). Default: id, name, brand, categories, price, image.",
+                    },
+                },
+                "required": ["ids"],
+                "additionalProperties": False,
+            },
+            annotations={
+                "destructiveHint": False,
+                "openWorldHint": False,
+                "readOnlyHint": True,
+            },
+        ),
     ]
-    extra_names = PROJECT_EXTRA_TOOLS.get(project, [])
+    extra_names = _project_extra_tools(project)
     extra_tools = [_EXTRA_TOOLS_BY_NAME[n] for n in extra_names if n in _EXTRA_TOOLS_BY_NAME]
+    if session is not None:
+        # I tool extra sono condivisi tra le richieste: lo schema di sessione va su una copia.
+        extra_tools = [tool.model_copy(deep=True) for tool in extra_tools]
+        _session_tool_schemas(base_tools + extra_tools)
+        session.tools = base_tools + extra_tools
+        SESSIONS.save(session)
     return base_tools + extra_tools
 
 @mcp._mcp_server.list_resources()
@@ -382,6 +777,8 @@ async def _handle_read_resource(req: types.ReadResourceRequest) -> types.ServerR
             )
         )
 
+    if WIDGET_ASSETS.due():
+        await asyncio.to_thread(WIDGET_ASSETS.refresh)
     contents = [
         types.TextResourceContents(
             uri=widget.template_uri,
@@ -394,11 +791,479 @@ async def _handle_read_resource(req: types.ReadResourceRequest) -> types.ServerR
     return types.ServerResult(types.ReadResourceResult(contents=contents))
 
 
+# Prodotti per risposta del carousel: default se manca `limit` e tetto massimo lato server.
+CAROUSEL_DEFAULT_PAGE_SIZE = 12
+CAROUSEL_MAX_PAGE_SIZE = int(os.getenv("MCP_MAX_PAGE_SIZE", "24"))
+
+
+# Proiezione per widget: colonne lette dal catalogo e lunghezza massima della descrizione
+# (None = completa). Il list widget usa la descrizione solo come testo per il carrello.
+WIDGET_PROJECTIONS: Dict[str, Dict[str, Any]] = {
+    "carousel": {"columns": None, "description_chars": None},
+    "list": {
+        "columns": ["id", "name", "brand", "categories", "price", "image", "description"],
+        "description_chars": 160,
+    },
+}
+# Lunghezza descrizione quando il modello chiede `compact: true`.
+COMPACT_DESCRIPTION_CHARS = 160
+
+
+def _projection_for(widget_id: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+    projection = dict(WIDGET_PROJECTIONS.get(widget_id, {}))
+    if arguments.get("compact"):
+        current = projection.get("description_chars")
+        projection["description_chars"] = min(current or COMPACT_DESCRIPTION_CHARS, COMPACT_DESCRIPTION_CHARS)
+    return projection
+
+
+def _log_payload_size(tool: str, structured: Dict[str, Any]) -> None:
+    """Logga (DEBUG) la dimensione di structuredContent (byte e stima token ~4 byte/token)."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return  # niente serializzazione extra a ogni chiamata
+    size = len(json.dumps(structured, default=lambda o: asdict(o) if is_dataclass(o) else str(o)).encode())
+    logger.debug("%s: structuredContent %d bytes (~%d tokens)", tool, size, size // 4)
+
+
+# Gli indici cross-sell si costruiscono all'avvio per ogni progetto e si rinnovano a ogni
+# CATALOG_CACHE_SECONDS. Se una chiamata trova l'indice mancante (build fallita o sfrattato
+# dalla cache) lo attende al massimo CROSS_SELL_BUDGET_SECONDS, poi risponde vuoto.
+CROSS_SELL_BUDGET_SECONDS = float(os.getenv("CROSS_SELL_BUDGET_SECONDS", "1.5"))
+_cross_sell_builds: Dict[str, "asyncio.Task[Any]"] = {}
+_cross_sell_indexes = CACHES.register("cross_sell_index", priority=60)
+
+
+def _products_from_cache(rows: List[Dict[str, Any]]) -> List[Any]:
+    return [catalog.Product(**row) for row in rows]
+
+
+async def _cached_products(project: str, db: Any, arguments: Dict[str, Any], *args: Any, **kwargs: Any) -> List[Any]:
+    """`CATALOG.search` del progetto passando dalla cache condivisa; query e accessi SQLite in un thread."""
+    key = shared_cache.make_key(project, arguments, args, kwargs)
+    rows = await SHARED_CACHE.aget("products", key)
+    if rows is not None:
+        return _products_from_cache(rows)
+    products = await CATALOG_BREAKER.run_in_thread(db.CATALOG.search, arguments, *args, **kwargs)
+    await SHARED_CACHE.aset("products", key, products, CATALOG_CACHE_SECONDS)
+    return products
+
+
+def _catalog_categories(project: str) -> Any:
+    """`CATALOG.additional_information()` del progetto, dalla cache condivisa se presente."""
+    cached = SHARED_CACHE.get("categories", project)
+    if cached is not None:
+        return cached
+    db = get_object_by_project(project, "database")
+    value = CATALOG_BREAKER.call_sync(db.CATALOG.additional_information)
+    SHARED_CACHE.set("categories", project, value, CATALOG_CACHE_SECONDS)
+    return value
+
+
+async def _products_by_ids(
+    project: str, db: Any, ids: List[Any], columns: List[str], description_chars: int | None = None
+) -> Dict[str, Dict[str, Any]]:
+    """Righe catalogo per id (chiave str(id)): cache condivisa per id, una sola query per i mancanti."""
+    keys = {
+        product_id: shared_cache.make_key(project, columns, description_chars, product_id)
+        for product_id in dict.fromkeys(str(i) for i in ids)
+    }
+    cached = await SHARED_CACHE.aget_many("product_by_id", keys.values())
+    found: Dict[str, Dict[str, Any]] = {
+        product_id: cached[key] for product_id, key in keys.items() if key in cached
+    }
+    missing = [product_id for product_id in keys if product_id not in found]
+    if missing:
+        products = await CATALOG_BREAKER.run_in_thread(
+            db.CATALOG.products_by_ids, missing, columns, description_chars
+        )
+        fresh = {}
+        for product in products:
+            row = {column: getattr(product, column) for column in columns}
+            found[str(product.id)] = row
+            fresh[keys[str(product.id)]] = row
+        await SHARED_CACHE.aset_many("product_by_id", fresh, CATALOG_CACHE_SECONDS)
+    return found
+
+
+def _build_cross_sell_index(project: str) -> Any:
+    db = get_object_by_project(project, "database")
+    _cross_sell_indexes.make_room()
+    started = time.perf_counter()
+    # Non dalla cache condivisa: l'intero catalogo sarebbe una sola voce enorme, letta da ogni worker.
+    products = CATALOG_BULK_BREAKER.call_sync(
+        db.CATALOG.search, {}, columns=["id", "name", "brand", "categories", "price", "image"]
+    )
+    index = cross_sell.CrossSellIndex(products)
+    print(f"Built cross-sell index for {project}: {len(index)} products in {time.perf_counter() - started:.2f}s")
+    return index
+
+
+# Ricerca semantica del carousel (argomento `query`): indice in memoria per progetto,
+# ricostruito in background quando è più vecchio di SEMANTIC_REFRESH_SECONDS.
+SEMANTIC_SEARCH_ENABLED = os.getenv("SEMANTIC_SEARCH", "1").lower() not in ("0", "false", "no")
+SEMANTIC_REFRESH_SECONDS = float(os.getenv("SEMANTIC_REFRESH_SECONDS", str(CATALOG_CACHE_SECONDS)))
+SEMANTIC_BUDGET_SECONDS = float(os.getenv("SEMANTIC_BUDGET_SECONDS", "2"))
+_semantic_indexes = CACHES.register("semantic_index", priority=60)
+_semantic_builds: Dict[str, "asyncio.Task[Any]"] = {}
+# Progetti senza ricerca semantica (indice fuori budget o dipendenze mancanti): fallback SQL.
+_semantic_disabled: Dict[str, str] = {}
+
+
+def _semantic_search_enabled(project: str) -> bool:
+    return SEMANTIC_SEARCH_ENABLED and project not in _semantic_disabled
+
+
+def _build_semantic_index(project: str) -> Any:
+    semantic_index = _import_local("semantic_index")  # numpy: solo se si usa la ricerca semantica
+    db = get_object_by_project(project, "database")
+    _semantic_indexes.make_room()
+    products = CATALOG_BULK_BREAKER.call_sync(
+        db.CATALOG.search, {}, description_chars=semantic_index.DESCRIPTION_CHARS
+    )
+    index = semantic_index.SemanticIndex(
+        products, dim=int(os.getenv("SEMANTIC_DIM", str(semantic_index.DEFAULT_DIM)))
+    )
+    print(f"Built semantic index for {project}: {len(index)} products in {index.build_seconds:.2f}s")
+    return index
+
+
+def _semantic_build_done(project: str, task: "asyncio.Task[Any]") -> None:
+    _semantic_builds.pop(project, None)
+    if task.cancelled():
+        return
+    exc = task.exception()
+    reason = None
+    if isinstance(exc, ImportError):
+        reason = str(exc)
+    elif exc is not None:
+        print(f"Error building semantic index for {project}: {exc!r}")
+    elif not _semantic_indexes.set(project, task.result()):
+        # Ricostruirlo a ogni ricerca costerebbe più del fallback SQL; gli altri progetti restano semantici.
+        reason = "index does not fit CACHE_MEMORY_BUDGET_MB"
+    if reason is not None:
+        _semantic_disabled[project] = reason
+        print(f"Semantic search disabled for {project}: {reason}")
+
+
+async def _get_semantic_index(project: str) -> Any:
+    """Indice del progetto; quello vecchio resta in uso finché il nuovo non è pronto."""
+    index = _semantic_indexes.get(project)
+    stale = index is None or time.monotonic() - index.built_at > SEMANTIC_REFRESH_SECONDS
+    task = _semantic_builds.get(project)
+    if stale and task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(_build_semantic_index, project))
+        task.add_done_callback(lambda t, p=project: _semantic_build_done(p, t))
+        _semantic_builds[project] = task
+    if index is not None or task is None:
+        return index
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout=SEMANTIC_BUDGET_SECONDS)
+    except Exception:
+        return None  # non pronto o fallito: il carousel ripiega sulla query SQL
+
+
+# Faccette del carousel (`facets: true`): aggregato per progetto, ricaricato come le altre
+# cache del catalogo; il calcolo per ricerca è in memoria (vedi facets.py).
+_facet_indexes = CACHES.register("facet_index", priority=60)
+
+
+def _facet_index(project: str) -> Any:
+    index = _facet_indexes.get(project)
+    if index is not None and time.monotonic() - index.built_at < CATALOG_CACHE_SECONDS:
+        return index
+    facets = _import_local("facets")
+    rows = SHARED_CACHE.get("facet_rows_cents", project)
+    if rows is None:
+        db = get_object_by_project(project, "database")
+        rows = CATALOG_BULK_BREAKER.call_sync(db.CATALOG.facet_rows)
+        SHARED_CACHE.set("facet_rows_cents", project, rows, CATALOG_CACHE_SECONDS)
+    index = facets.FacetIndex([tuple(row) for row in rows])
+    _facet_indexes.set(project, index)
+    return index
+
+
+async def _carousel_facets(project: str, db: Any, arguments: Dict[str, Any]) -> Dict[str, Any] | None:
+    """Conteggi per brand/categoria e istogramma prezzi per i filtri correnti; None se non disponibili."""
+    started = time.perf_counter()
+    try:
+        index = _facet_indexes.get(project)
+        if index is None or time.monotonic() - index.built_at >= CATALOG_CACHE_SECONDS:
+            index = await asyncio.to_thread(_facet_index, project)
+        result = index.compute(arguments)
+    except Exception as exc:
+        print(f"Error computing facets: {exc!r}")
+        return None
+    config = db.CATALOG.config
+    # L'aggregato conosce solo categoria esatta, brand e prezzo: query testuali e match
+    # su nome/descrizione danno conteggi indicativi.
+    result["approximate"] = bool(
+        arguments.get("query")
+        or (config.name_filter and arguments.get("name"))
+        or (arguments.get("category") and config.category_match == catalog.MATCH_IN_OR_DESCRIPTION)
+    )
+    print(f"carousel: facets over {len(index)} groups in {(time.perf_counter() - started) * 1000:.1f} ms")
+    return result
+
+
+# Normalizzazione di `category` per carousel e list: termini in italiano/inglese, maiuscole e
+# plurali ricondotti alle categorie reali del catalogo (più gli alias curati in
+# projects/<proj>/category_aliases.json) prima della query e della chiave di cache.
+_category_normalizers = CACHES.register("category_normalizer", priority=80)
+
+
+def _category_normalizer(project: str) -> Any:
+    normalizer = _category_normalizers.get(project)
+    if normalizer is not None and time.monotonic() - normalizer.built_at < CATALOG_CACHE_SECONDS:
+        return normalizer
+    db = get_object_by_project(project, "database")
+    categories = SHARED_CACHE.get("category_list", project)
+    if categories is None:
+        categories = CATALOG_BREAKER.call_sync(db.CATALOG.categories)
+        SHARED_CACHE.set("category_list", project, categories, CATALOG_CACHE_SECONDS)
+    aliases = category_matcher.load_aliases(
+        Path(__file__).resolve().parent / "projects" / project / "category_aliases.json"
+    )
+    normalizer = category_matcher.CategoryNormalizer(
+        categories, aliases, food_vocabulary=db.CATALOG.config.food_vocabulary
+    )
+    normalizer.built_at = time.monotonic()
+    if normalizer.unknown_aliases:
+        print(f"Category aliases for {project} not in catalog: {', '.join(normalizer.unknown_aliases)}")
+    _category_normalizers.set(project, normalizer)
+    return normalizer
+
+
+async def _normalize_category_argument(
+    project: str, db: Any, arguments: Dict[str, Any]
+) -> Tuple[Dict[str, Any], List[str]]:
+    """(argomenti con `category` canonica, termini non presenti nel catalogo)."""
+    terms = arguments.get("category")
+    if not isinstance(terms, list) or not terms:
+        return arguments, []
+    try:
+        normalizer = _category_normalizers.get(project)
+        if normalizer is None or time.monotonic() - normalizer.built_at >= CATALOG_CACHE_SECONDS:
+            normalizer = await asyncio.to_thread(_category_normalizer, project)
+    except Exception as exc:
+        print(f"Error building category normalizer: {exc!r}")
+        return arguments, []
+    if not len(normalizer):
+        return arguments, []
+    canonical, unmatched = normalizer.normalize(terms)
+    if db.CATALOG.config.category_match == catalog.MATCH_IN_OR_DESCRIPTION:
+        # I termini sconosciuti restano: possono ancora comparire nella descrizione.
+        category = canonical + unmatched
+    else:
+        # categories ILIKE termine: un termine sconosciuto non trova nulla, basta la categoria reale.
+        # Se nessun termine corrisponde si tengono (deduplicati) per non togliere il filtro.
+        category = canonical or unmatched
+    if len(category) != len(terms):
+        print(f"category: {len(terms)} terms -> {len(category)} ({len(unmatched)} unmatched)")
+    return {**arguments, "category": category}, unmatched
+
+
+def _unmatched_categories_text(db: Any, unmatched: List[str], text: str = "Fetched products.") -> str:
+    if not unmatched:
+        return text
+    where = (
+        "; they were only matched against product descriptions"
+        if db.CATALOG.config.category_match == catalog.MATCH_IN_OR_DESCRIPTION
+        else ""
+    )
+    return f"{text} Categories not in the catalog: {', '.join(unmatched)}{where}."
+
+
+def _widget_input_schema(widget: Widget, db: Any) -> Dict[str, Any]:
+    schema = deepcopy(db.TOOL_INPUT_SCHEMA)
+    if widget.identifier == "carousel":
+        schema["properties"]["facets"] = {
+            "type": "boolean",
+            "description": "Also return counts per brand and category and a price histogram for the current filters, to refine the search without extra calls.",
+        }
+    if widget.identifier == "carousel" and _semantic_search_enabled(db.CATALOG.config.project):
+        schema["properties"]["query"] = {
+            "type": "string",
+            "description": "Free-text description of what the user is looking for, in any language (e.g. \"qualcosa per il gaming in salotto\"). Products are ranked by similarity to it; category, brand, min_price and max_price still filter. Prefer it to long category lists for vague or context-driven requests.",
+        }
+    return schema
+
+
+def _cross_sell_build_done(project: str, task: "asyncio.Task[Any]") -> None:
+    _cross_sell_builds.pop(project, None)  # fallita: si riprova al prossimo giro o alla prossima chiamata
+    if task.cancelled():
+        return
+    if task.exception() is not None:
+        print(f"Error building cross-sell index for {project}: {task.exception()!r}")
+    else:
+        _cross_sell_indexes.set(project, task.result())
+
+
+def _refresh_cross_sell_index(project: str) -> "asyncio.Task[Any] | None":
+    """Avvia in background la build dell'indice se manca o è scaduto; ritorna la build in corso."""
+    index = _cross_sell_indexes.get(project)
+    stale = index is None or time.monotonic() - index.built_at >= CATALOG_CACHE_SECONDS
+    task = _cross_sell_builds.get(project)
+    if stale and task is None:
+        task = asyncio.ensure_future(asyncio.to_thread(_build_cross_sell_index, project))
+        task.add_done_callback(lambda t, p=project: _cross_sell_build_done(p, t))
+        _cross_sell_builds[project] = task
+    return task
+
+
+async def _keep_cross_sell_indexes_fresh() -> None:
+    """Build all'avvio e a ogni scadenza, un progetto alla volta: la prima chiamata trova l'indice."""
+    while True:
+        for project in sorted(PROJECTS):
+            task = _refresh_cross_sell_index(project)
+            if task is not None:
+                await asyncio.wait([task])  # gli errori li registra _cross_sell_build_done
+        await asyncio.sleep(CATALOG_CACHE_SECONDS)
+
+
+async def _get_cross_sell_index(project: str) -> Any:
+    """Indice del progetto; scaduto (CATALOG_CACHE_SECONDS) resta in uso finché il nuovo non è pronto."""
+    index = _cross_sell_indexes.get(project)
+    task = _refresh_cross_sell_index(project)
+    if index is not None or task is None:
+        return index
+    try:
+        return await asyncio.wait_for(asyncio.shield(task), timeout=CROSS_SELL_BUDGET_SECONDS)
+    except asyncio.TimeoutError:
+        return None
+    except Exception as exc:
+        print(f"Error building cross-sell index: {exc}")
+        return None
+
+
+# Pagamenti: la chiamata Stripe gira fuori dall'event loop con un tetto di tempo; la
+# chiave di idempotenza (checkout_id + importo + carrello) fa sì che un retry del widget
+# riceva lo stesso PaymentIntent invece di crearne un altro.
+STRIPE_TIMEOUT_SECONDS = float(os.getenv("STRIPE_TIMEOUT_SECONDS", "15"))
+PAYMENT_RESULT_TTL_SECONDS = float(os.getenv("PAYMENT_RESULT_TTL_SECONDS", "600"))
+_payment_results: Dict[str, Tuple[float, Dict[str, Any]]] = {}
+_payment_inflight: Dict[str, "asyncio.Future[Dict[str, Any]]"] = {}
+
+
+def _payment_idempotency_key(arguments: Dict[str, Any], amount: int, currency: str) -> str | None:
+    """Chiave stabile per lo stesso tentativo di pagamento; None senza `checkout_id`."""
+    checkout_id = arguments.get("checkout_id")
+    if not isinstance(checkout_id, str) or not checkout_id.strip():
+        # Sessione o utente non bastano: un secondo acquisto voluto dello stesso carrello
+        # riceverebbe il PaymentIntent del primo (o il suo rifiuto).
+        return None
+    cart = arguments.get("cart") if isinstance(arguments.get("cart"), list) else []
+    lines = sorted(
+        (str(item.get("id")), int(item.get("quantity") or 1)) for item in cart if isinstance(item, dict)
+    )
+    material = json.dumps(
+        [checkout_id, get_current_query_params().get("proj"), amount, currency, lines], default=str
+    )
+    return "mcp-pi-" + hashlib.sha256(material.encode()).hexdigest()[:40]
+
+
+@lru_cache(maxsize=1)
+def _stripe() -> Any:
+    """Modulo stripe importato e configurato al primo pagamento."""
+    import stripe
+
+    stripe.api_key = os.getenv("STRIPE_SECRET_KEY")
+    if os.getenv("STRIPE_API_BASE"):
+        stripe.api_base = os.getenv("STRIPE_API_BASE")  # es. stripe-mock in locale
+    return stripe
+
+
+def _create_payment_intent_sync(amount: int, currency: str, idempotency_key: str | None) -> Dict[str, Any]:
+    if MOCK_UPSTREAMS:
+        upstream_mocks, transport = _upstream_mocks()
+        return upstream_mocks.payment_intent(amount, currency, idempotency_key, transport.latencies)
+    params: Dict[str, Any] = {
+        "amount": amount,
+        "currency": currency,
+        "payment_method": os.getenv("STRIPE_TEST_PAYMENT_METHOD", "pm_card_visa"),
+        "confirm": True,
+        "automatic_payment_methods": {"enabled": True, "allow_redirects": "never"},
+    }
+    if idempotency_key:
+        params["idempotency_key"] = idempotency_key
+    intent = _stripe().PaymentIntent.create(**params)
+    return {"status": intent.status, "payment_intent_id": intent.id}
+
+
+async def _create_payment_intent(amount: int, currency: str, idempotency_key: str | None) -> Dict[str, Any]:
+    """PaymentIntent off-loop con timeout; i replay entro il TTL riusano il risultato."""
+    if idempotency_key is None:
+        return await asyncio.wait_for(
+            asyncio.to_thread(_create_payment_intent_sync, amount, currency, None),
+            timeout=STRIPE_TIMEOUT_SECONDS,
+        )
+    now = time.monotonic()
+    for key in [k for k, (expires, _) in _payment_results.items() if expires <= now]:
+        _payment_results.pop(key, None)
+    cached = _payment_results.get(idempotency_key)
+    if cached is not None:
+        return {**cached[1], "replayed": True}
+    pending = _payment_inflight.get(idempotency_key)
+    if pending is not None:
+        # Stessa richiesta già in corso (doppio click, retry del client): si attende quella.
+        return {**await asyncio.shield(pending), "replayed": True}
+    future: "asyncio.Future[Dict[str, Any]]" = asyncio.get_running_loop().create_future()
+    _payment_inflight[idempotency_key] = future
+    try:
+        result = await asyncio.wait_for(
+            asyncio.to_thread(_create_payment_intent_sync, amount, currency, idempotency_key),
+            timeout=STRIPE_TIMEOUT_SECONDS,
+        )
+        _payment_results[idempotency_key] = (time.monotonic() + PAYMENT_RESULT_TTL_SECONDS, result)
+        future.set_result(result)
+        return result
+    except BaseException as exc:
+        future.set_exception(exc)
+        future.exception()  # evita "exception was never retrieved" senza attese
+        raise
+    finally:
+        _payment_inflight.pop(idempotency_key, None)
+
+
+def _filters_fingerprint(arguments: Dict[str, Any]) -> str:
+    filters = {k: v for k, v in arguments.items() if k not in ("cursor", "limit", "facets")}
+    return hashlib.sha256(json.dumps(filters, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def _encode_cursor(after_id: Any, arguments: Dict[str, Any]) -> str:
+    """Cursor opaco: ultimo id della pagina + impronta dei filtri che l'hanno prodotta."""
+    if hasattr(after_id, "item"):
+        after_id = after_id.item()  # eventuale scalare numpy
+    payload = json.dumps({"after": after_id, "f": _filters_fingerprint(arguments)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str, arguments: Dict[str, Any]) -> Any:
+    """Restituisce l'id da cui ripartire; ValueError se il cursor è malformato o di un'altra ricerca."""
+    payload = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    if not isinstance(payload, dict) or "after" not in payload:
+        raise ValueError("malformed cursor")
+    if payload.get("f") != _filters_fingerprint(arguments):
+        raise ValueError("cursor belongs to a different search")
+    return payload["after"]
+
+
 def _load_prompt_text(path: Path) -> str:
     if not path.exists():
         return ""
     return path.read_text(encoding="utf8")
 
+async def _openai_chat(body: Dict[str, Any], headers: Dict[str, str]) -> Dict[str, Any]:
+    """Chat completion OpenAI sotto il breaker `openai` (timeout adattivo)."""
+
+    async def _post(timeout: float) -> Dict[str, Any]:
+        response = await _shared_http_client().post(
+            "https://api.openai.com/v1/chat/completions", json=body, headers=headers, timeout=timeout
+        )
+        response.raise_for_status()
+        return response.json()
+
+    return await OPENAI_BREAKER.call(_post)
+
 async def _generate_pro_contro(items: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
@@ -443,18 +1308,22 @@ async def _generate_pro_contro(items: List[Dict[str, Any]]) -> List[Dict[str, An
         "response_format": {"type": "json_object"},
     }
 
-    async with httpx.AsyncClient(timeout=20) as client:
-        response = await client.post(
-            "https://api.openai.com/v1/chat/completions", json=body, headers=headers
-        )
-        response.raise_for_status()
-        data = response.json()
+    cache_key = shared_cache.make_key(payload)
+    cached = await SHARED_CACHE.aget("llm_pro_contro", cache_key)
+    if cached is not None:
+        return cached
+
+    data = await _openai_chat(body, headers)
 
     content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
     parsed = json.loads(content) if content else {}
     if isinstance(parsed, dict):
         parsed = parsed.get("items", [])
-    return parsed if isinstance(parsed, list) else []
+    if not isinstance(parsed, list):
+        return []
+    if parsed:
+        await SHARED_CACHE.aset("llm_pro_contro", cache_key, parsed, LLM_CACHE_SECONDS)
+    return parsed
 
 def _normalize_ingredient_name(name: str) -> str:
     return re.sub(r"\s+", " ", name.strip())
@@ -474,16 +1343,40 @@ def _parse_mealdb_ingredients(meal: Dict[str, Any]) -> List[Dict[str, str]]:
         ingredients.append(item)
     return ingredients
 
+# Risultati TheMealDB recenti (cache condivisa): freschi per RECIPE_SEARCH_CACHE_SECONDS,
+# poi serviti solo come ripiego (stale) quando TheMealDB è giù o il circuito è aperto.
+RECIPE_SEARCH_CACHE_SECONDS = float(os.getenv("RECIPE_SEARCH_CACHE_SECONDS", "3600"))
+_RECIPE_SEARCH_STALE_SECONDS = 7 * 86400
+
+
 async def _recipe_search_mealdb(query: str) -> List[Dict[str, Any]]:
     if not query:
         return []
-    params = {"s": query}
-    async with httpx.AsyncClient(timeout=15) as client:
-        response = await client.get(
-            "https://www.themealdb.com/api/json/v1/1/search.php", params=params
+    key = query.strip().lower()
+    cached, age = await SHARED_CACHE.aget_with_age("recipe_search", key)
+    if cached is not None and age < RECIPE_SEARCH_CACHE_SECONDS:
+        return cached
+    try:
+        recipes = await _fetch_mealdb_recipes(query)
+    except Exception as exc:
+        if cached is None:
+            raise
+        print(f"TheMealDB unavailable ({exc!r}), serving stale results for {query!r}")
+        MEALDB_BREAKER.record_fallback()
+        return cached
+    await SHARED_CACHE.aset("recipe_search", key, recipes, _RECIPE_SEARCH_STALE_SECONDS)
+    return recipes
+
+
+async def _fetch_mealdb_recipes(query: str) -> List[Dict[str, Any]]:
+    async def _get(timeout: float) -> Dict[str, Any]:
+        response = await _shared_http_client().get(
+            "https://www.themealdb.com/api/json/v1/1/search.php", params={"s": query}, timeout=timeout
         )
         response.raise_for_status()
-        data = response.json()
+        return response.json()
+
+    data = await MEALDB_BREAKER.call(_get)
     meals = data.get("meals") or []
     recipes: List[Dict[str, Any]] = []
     for meal in meals:
@@ -498,6 +1391,38 @@ async def _recipe_search_mealdb(query: str) -> List[Dict[str, Any]]:
         )
     return recipes
 
+_category_matchers = CACHES.register("category_matcher", priority=80)
+
+
+def _category_matcher(project: str) -> Any:
+    """Indice ingrediente -> categoria costruito una volta per progetto sulle categorie del catalogo."""
+    matcher = _category_matchers.get(project)
+    if matcher is not None:
+        return matcher
+    categories = _catalog_categories(project)
+    if not isinstance(categories, list) or not categories:
+        return None
+    matcher = category_matcher.CategoryMatcher(categories)
+    _category_matchers.set(project, matcher)
+    return matcher
+
+def _safe_category_matcher(project: str) -> Any:
+    try:
+        return _category_matcher(project)
+    except Exception as exc:
+        print(f"Error building category matcher: {exc}")
+        return None
+
+async def _resolve_ingredient_categories(
+    project: str, ingredients: List[Dict[str, Any]], matcher: Any = None
+) -> List[Dict[str, Any]]:
+    if matcher is None:
+        # A freddo il matcher legge le categorie dal catalogo: fuori dall'event loop.
+        matcher = await asyncio.to_thread(_safe_category_matcher, project)
+    if matcher is None:
+        return ingredients
+    return matcher.resolve(ingredients)
+
 def _is_safe_url(url: str) -> bool:
     parsed = urlparse(url)
     if parsed.scheme not in {"http", "https"}:
@@ -519,11 +1444,37 @@ def _is_safe_url(url: str) -> bool:
         pass
     return True
 
-def _strip_html(text: str) -> str:
-    text = re.sub(r"(?is)<script.*?>.*?</script>", " ", text)
-    text = re.sub(r"(?is)<style.*?>.*?</style>", " ", text)
-    text = re.sub(r"(?is)<[^>]+>", " ", text)
-    return re.sub(r"\s+", " ", text).strip()
+_http_client: httpx.AsyncClient | None = None
+
+
+def _shared_http_client() -> httpx.AsyncClient:
+    """Client httpx condiviso (connection pool riusato tra le richieste)."""
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        _http_client = httpx.AsyncClient(
+            timeout=10,
+            limits=httpx.Limits(max_connections=64, max_keepalive_connections=16),
+            transport=_mock_transport(),
+        )
+    return _http_client
+
+
+@lru_cache(maxsize=1)
+def _get_image_proxy() -> Any:
+    image_proxy = _import_local("image_proxy")
+    cache_dir = os.getenv("IMAGE_CACHE_DIR") or str(Path(tempfile.gettempdir()) / "mcp-image-cache")
+    return image_proxy.ImageProxy(
+        client_factory=_shared_http_client,
+        cache=image_proxy.ImageDiskCache(
+            Path(cache_dir), max_bytes=int(os.getenv("IMAGE_CACHE_MAX_MB", "256")) * 1024 * 1024
+        ),
+        is_safe_url=_is_safe_url,
+        max_image_bytes=int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024))),
+        ttl_seconds=float(os.getenv("IMAGE_CACHE_TTL_SECONDS", "86400")),
+    )
+
 
 def _parse_ingredients_fallback(text: str) -> List[Dict[str, str]]:
     lines = [line.strip() for line in text.splitlines()]
@@ -552,7 +1503,7 @@ def _parse_ingredients_fallback(text: str) -> List[Dict[str, str]]:
 async def _parse_ingredients_with_openai(text: str) -> Dict[str, Any]:
     api_key = os.getenv("OPENAI_API_KEY")
     if not api_key:
-        return {"title": None, "ingredients": _parse_ingredients_fallback(text)}
+        return {"title": None, "ingredients": _parse_ingredients_fallback(text), "source": "heuristic"}
     system = (
         "Estrai titolo e ingredienti da una ricetta. "
         "Rispondi SOLO JSON con chiavi: title, ingredients "
@@ -568,32 +1519,116 @@ async def _parse_ingredients_with_openai(text: str) -> Dict[str, Any]:
         ],
         "response_format": {"type": "json_object"},
     }
-    async with httpx.AsyncClient(timeout=20) as client:
-        response = await client.post(
-            "https://api.openai.com/v1/chat/completions", json=body, headers=headers
-        )
-        response.raise_for_status()
-        data = response.json()
-    content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
-    parsed = json.loads(content) if content else {}
+    cache_key = shared_cache.make_key(text)
+    cached = await SHARED_CACHE.aget("llm_ingredients", cache_key)
+    if cached is not None:
+        return cached
+    try:
+        data = await _openai_chat(body, headers)
+        content = data.get("choices", [{}])[0].get("message", {}).get("content", "")
+        parsed = json.loads(content) if content else {}
+    except Exception as exc:
+        # OpenAI lento/giù o circuito aperto: meglio l'euristica che un errore.
+        print(f"OpenAI ingredient parsing unavailable ({exc!r}), using heuristic")
+        OPENAI_BREAKER.record_fallback()
+        parsed = {}
     if not isinstance(parsed, dict):
         parsed = {}
     ingredients = parsed.get("ingredients")
+    source = "llm"
     if not isinstance(ingredients, list):
         ingredients = _parse_ingredients_fallback(text)
-    return {"title": parsed.get("title"), "ingredients": ingredients}
+        source = "heuristic"
+    result = {"title": parsed.get("title"), "ingredients": ingredients, "source": source}
+    if source == "llm":
+        await SHARED_CACHE.aset("llm_ingredients", cache_key, result, LLM_CACHE_SECONDS)
+    return result
+
+async def _fetch_recipe_page(url: str) -> Any:
+    """Scarica una pagina ricetta (URL già validato con `_is_safe_url`)."""
+    import httpx
+
+    async with httpx.AsyncClient(timeout=15, transport=_mock_transport()) as client:
+        return await recipe_extract.fetch_recipe_page(
+            client, url, max_bytes=RECIPE_FETCH_MAX_BYTES
+        )
+
+async def _parse_recipe(text: str, page: Any = None) -> Dict[str, Any]:
+    """Titolo e ingredienti da una pagina scaricata o da testo incollato."""
+    structured = None
+    if page is not None:
+        structured = page.structured_recipe()
+        text = page.text
+    elif "<" in text and ">" in text:
+        # HTML incollato dall'utente: proviamo comunque i dati strutturati. Il parsing
+        # (fino a PARSE_BUDGET_SECONDS) gira in un thread, come per le pagine scaricate.
+        page = await asyncio.to_thread(recipe_extract.parse_recipe_html, text)
+        structured = page.structured_recipe()
+    # Fast path: con JSON-LD/microdata schema.org non serve la chiamata LLM.
+    return structured or await _parse_ingredients_with_openai(text)
+
+# Ultimo `additional_information()` riuscito per progetto, ripiego di `min`.
+_additional_information_cache = CACHES.register("additional_information", priority=100)
 
 async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
-    query_params = get_current_query_params()
-    project = query_params.get("proj")
-    db = get_object_by_project(project, "database")
+    project = get_current_query_params().get("proj")
+    try:
+        async with ADMISSION.admit(req.params.name, project):
+            with resilience.deadline(_TOOL_DEADLINES.get(req.params.name, TOOL_DEADLINE_SECONDS)):
+                request = get_current_request()
+                forced = request is not None and _profiler_secret_ok(request.headers.get("x-profile"))
+                if PROFILER_SECRET and PROFILER.should_profile(req.params.name, project, forced):
+                    return await PROFILER.run(_dispatch_tool_request(req), req.params.name, project)
+                return await _dispatch_tool_request(req)
+    except admission.Overloaded as exc:
+        print(f"Rejected {req.params.name} for {project}: {exc}")
+        return types.ServerResult(
+            types.CallToolResult(
+                content=[types.TextContent(type="text", text="Server busy, please retry in a few seconds.")],
+                isError=True,
+                _meta={"retryable": True, "retryAfterSeconds": exc.retry_after},
+            )
+        )
+
+def _unknown_result_id() -> types.ServerResult:
+    return types.ServerResult(
+        types.CallToolResult(
+            content=[types.TextContent(type="text", text="Unknown or expired result_id: pass the product ids instead.")],
+            isError=True,
+        )
+    )
+
+async def _dispatch_tool_request(req: types.CallToolRequest) -> types.ServerResult:
+    session = _session_context()
+    if session is not None:
+        project, db = session.project, session.db
+    else:
+        project = get_current_query_params().get("proj")
+        db = get_object_by_project(project, "database")
     PROMPTS_DIR = Path(__file__).resolve().parent / "projects" / project / "prompts"
     DEVELOPER_CORE_PATH = PROMPTS_DIR / "developer_core.md"
     RUNTIME_CONTEXT_PATH = PROMPTS_DIR / "runtime_context.md"
+    if req.params.name == "min" and session is not None and session.prompts is not None:
+        return types.ServerResult(
+            types.CallToolResult(
+                content=[types.TextContent(type="text", text="Loaded prompts.")],
+                structuredContent=session.prompts,
+            )
+        )
     if req.params.name == "min":
         developer_core = _load_prompt_text(DEVELOPER_CORE_PATH)
         runtime_context = _load_prompt_text(RUNTIME_CONTEXT_PATH)
-        raw_additional = db.get_additional_information()
+        try:
+            raw_additional = await SHARED_CACHE.aget("categories", project)
+            if raw_additional is None:
+                raw_additional = await CATALOG_BREAKER.run_in_thread(db.CATALOG.additional_information)
+                await SHARED_CACHE.aset("categories", project, raw_additional, CATALOG_CACHE_SECONDS)
+            _additional_information_cache.set(project, raw_additional)
+        except Exception as exc:
+            # Catalogo irraggiungibile: ultime categorie note, altrimenti prompt senza elenco.
+            print(f"Error loading additional information: {exc!r}")
+            CATALOG_BREAKER.record_fallback()
+            raw_additional = _additional_information_cache.get(project, "")
         if isinstance(raw_additional, list):
             categories = raw_additional or []
             categories_block = (
@@ -605,14 +1640,18 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
             additional_information = categories_block
         else:
             additional_information = raw_additional or ""
+        prompts = {
+            "developer_core": developer_core,
+            "runtime_context": runtime_context + additional_information,
+        }
+        if session is not None:
+            session.prompts = prompts
+            SESSIONS.save(session)
+        print("Loaded prompts.")
         return types.ServerResult(
-            print("Loaded prompts."),
             types.CallToolResult(
                 content=[types.TextContent(type="text", text="Loaded prompts.")],
-                structuredContent={
-                    "developer_core": developer_core,
-                    "runtime_context": runtime_context + additional_information,
-                },
+                structuredContent=prompts,
             )
         )
 
@@ -621,7 +1660,37 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
         items = args.get("items", [])
         if not isinstance(items, list):
             items = []
-        enriched = await _generate_pro_contro(items)
+        items = [item for item in items if isinstance(item, dict)]
+        ids = args.get("ids") if isinstance(args.get("ids"), list) else []
+        if args.get("result_id"):
+            result_ids = session.result_ids(args["result_id"]) if session is not None else None
+            if result_ids is None:
+                return _unknown_result_id()
+            ids = [*ids, *result_ids]
+        known = {str(item.get("id")) for item in items}
+        items += [{"id": product_id} for product_id in ids if str(product_id) not in known]
+        # Nome, prezzo e descrizione freschi dal catalogo: il widget può mandare solo gli id.
+        item_ids = [item["id"] for item in items if item.get("id") is not None][:PRODUCTS_BY_IDS_MAX]
+        if item_ids:
+            try:
+                fresh = await _products_by_ids(
+                    project,
+                    db,
+                    item_ids,
+                    ["id", "name", "brand", "categories", "price", "description"],
+                    description_chars=600,
+                )
+                items = [{**item, **fresh.get(str(item.get("id")), {})} for item in items]
+            except Exception as exc:
+                print(f"Error hydrating compare items: {exc!r}")
+                CATALOG_BREAKER.record_fallback()
+        try:
+            enriched = await _generate_pro_contro(items)
+        except Exception as exc:
+            # Il widget confronta comunque i prodotti, solo senza pro/contro.
+            print(f"Error generating pro/contro: {exc!r}")
+            OPENAI_BREAKER.record_fallback()
+            enriched = []
         return types.ServerResult(
             types.CallToolResult(
                 content=[types.TextContent(type="text", text="Generated pro/contro.")],
@@ -629,8 +1698,8 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
             )
         )
 
-    if req.params.name in ("recipe_search", "recipe_parse"):
-        if req.params.name not in PROJECT_EXTRA_TOOLS.get(project, []):
+    if req.params.name in _EXTRA_TOOLS_BY_NAME:
+        if req.params.name not in _project_extra_tools(project):
             return types.ServerResult(
                 types.CallToolResult(
                     content=[types.TextContent(type="text", text="Tool not available for this project.")],
@@ -638,6 +1707,74 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
                 )
             )
 
+    if req.params.name == "cross_sell_recommendations":
+        args = req.params.arguments or {}
+        cart_items = args.get("cartItems")
+        if session is not None and isinstance(cart_items, list):
+            session.cart = cart_items
+            SESSIONS.save(session)
+        elif session is not None and cart_items is None:
+            cart_items = session.cart  # il widget può non rimandare il carrello
+        if not isinstance(cart_items, list):
+            cart_items = []
+        max_results = args.get("maxResults")
+        max_results = min(max_results, 20) if isinstance(max_results, int) and max_results > 0 else 8
+        started = time.perf_counter()
+        index = await _get_cross_sell_index(project)
+        suggestions = index.recommend(cart_items, max_results) if index is not None and cart_items else []
+        print(f"cross_sell_recommendations: {len(suggestions)} in {(time.perf_counter() - started) * 1000:.1f} ms")
+        return types.ServerResult(
+            types.CallToolResult(
+                content=[types.TextContent(type="text", text="Fetched cross-sell suggestions.")],
+                structuredContent={"suggestions": suggestions},
+            )
+        )
+
+    if req.params.name == "products_by_ids":
+        args = req.params.arguments or {}
+        ids = args.get("ids") if isinstance(args.get("ids"), list) else []
+        if args.get("result_id"):
+            result_ids = session.result_ids(args["result_id"]) if session is not None else None
+            if result_ids is None:
+                return _unknown_result_id()
+            ids = [*ids, *result_ids]
+        ids = [i for i in ids if isinstance(i, (str, int)) and not isinstance(i, bool) and str(i).strip()]
+        if not ids or len(ids) > PRODUCTS_BY_IDS_MAX:
+            return types.ServerResult(
+                types.CallToolResult(
+                    content=[
+                        types.TextContent(
+                            type="text", text=f"Pass between 1 and {PRODUCTS_BY_IDS_MAX} product ids."
+                        )
+                    ],
+                    isError=True,
+                )
+            )
+        fields = args.get("fields") if isinstance(args.get("fields"), list) else []
+        columns = [c for c in catalog.PRODUCT_COLUMNS if c in fields or c == "id"]
+        if len(columns) < 2:
+            columns = _PRODUCTS_BY_IDS_FIELDS
+        try:
+            rows = await _products_by_ids(project, db, ids, columns)
+        except Exception as exc:
+            print(f"Error fetching products by id: {exc!r}")
+            return types.ServerResult(
+                types.CallToolResult(
+                    content=[types.TextContent(type="text", text="Catalog unavailable, please retry.")],
+                    isError=True,
+                    _meta={"retryable": True},
+                )
+            )
+        wanted = list(dict.fromkeys(str(i) for i in ids))
+        products = [rows[i] for i in wanted if i in rows]
+        missing = [i for i in wanted if i not in rows]
+        return types.ServerResult(
+            types.CallToolResult(
+                content=[types.TextContent(type="text", text=f"Fetched {len(products)} products.")],
+                structuredContent={"products": products, "missing": missing},
+            )
+        )
+
     if req.params.name == "recipe_search":
         args = req.params.arguments or {}
         query = (args.get("query") or "").strip()
@@ -649,7 +1786,11 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
                 )
             )
         try:
-            recipes = await _recipe_search_mealdb(query)
+            recipes, matcher = await asyncio.gather(
+                _recipe_search_mealdb(query), asyncio.to_thread(_safe_category_matcher, project)
+            )
+            for recipe in recipes:
+                recipe["ingredients"] = await _resolve_ingredient_categories(project, recipe["ingredients"], matcher)
         except Exception as exc:
             print(f"Error searching recipes: {exc}")
             return types.ServerResult(
@@ -681,6 +1822,8 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
                     isError=True,
                 )
             )
+        started = time.perf_counter()
+        page = None
         if url:
             if not _is_safe_url(url):
                 return types.ServerResult(
@@ -695,10 +1838,7 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
                     )
                 )
             try:
-                async with httpx.AsyncClient(timeout=15) as client:
-                    response = await client.get(url)
-                    response.raise_for_status()
-                    text = _strip_html(response.text)
+                page = await _fetch_recipe_page(url)
             except Exception as exc:
                 print(f"Error fetching recipe url: {exc}")
                 return types.ServerResult(
@@ -712,7 +1852,9 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
                         isError=True,
                     )
                 )
-        parsed = await _parse_ingredients_with_openai(text)
+        parsed = await _parse_recipe(text, page)
+        parsed["ingredients"] = await _resolve_ingredient_categories(project, parsed.get("ingredients") or [])
+        print(f"recipe_parse via {parsed.get('source')} in {(time.perf_counter() - started) * 1000:.0f} ms")
         return types.ServerResult(
             types.CallToolResult(
                 content=[types.TextContent(type="text", text="Parsed recipe.")],
@@ -720,6 +1862,111 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
             )
         )
 
+    if req.params.name == "recipe_bundle":
+        args = req.params.arguments or {}
+        query = (args.get("query") or "").strip()
+        text = (args.get("text") or "").strip()
+        url = (args.get("url") or "").strip()
+        if not query and not text and not url:
+            return types.ServerResult(
+                types.CallToolResult(
+                    content=[types.TextContent(type="text", text="Missing recipe query, text or url.")],
+                    isError=True,
+                )
+            )
+        if url and not _is_safe_url(url):
+            return types.ServerResult(
+                types.CallToolResult(
+                    content=[types.TextContent(type="text", text="URL not allowed.")],
+                    isError=True,
+                )
+            )
+        started = time.perf_counter()
+
+        async def _load_recipe() -> Dict[str, Any] | None:
+            if query:
+                recipes = await _recipe_search_mealdb(query)
+                return {**recipes[0], "source": "themealdb"} if recipes else None
+            page = await _fetch_recipe_page(url) if url else None
+            return await _parse_recipe(text, page)
+
+        # Ricetta (rete) e indice categorie (catalogo) in parallelo.
+        try:
+            recipe, matcher = await asyncio.gather(
+                _load_recipe(),
+                asyncio.to_thread(_safe_category_matcher, project),
+            )
+        except Exception as exc:
+            print(f"Error loading recipe for bundle: {exc}")
+            return types.ServerResult(
+                types.CallToolResult(
+                    content=[types.TextContent(type="text", text="Failed to load recipe.")],
+                    isError=True,
+                )
+            )
+        if not recipe:
+            return types.ServerResult(
+                types.CallToolResult(
+                    content=[types.TextContent(type="text", text="No recipe found.")],
+                    isError=True,
+                )
+            )
+        recipe_loaded = time.perf_counter()
+        ingredients = await _resolve_ingredient_categories(project, recipe.get("ingredients") or [], matcher)
+        categories = list(dict.fromkeys(item["category"] for item in ingredients if item.get("category")))
+        products = []
+        if categories:
+            # Un solo passaggio sul catalogo: il prodotto più economico per categoria.
+            try:
+                products = await _cached_products(
+                    project,
+                    db,
+                    {"category": categories},
+                    1,
+                    **_projection_for("list", {}),
+                )
+            except Exception as e:
+                print(f"Error fetching products from catalog: {e}")
+                return types.ServerResult(
+                    types.CallToolResult(
+                        content=[
+                            types.TextContent(
+                                type="text",
+                                text="Catalog connection failed while fetching products.",
+                            )
+                        ],
+                        isError=True,
+                    )
+                )
+        found = {str(product.categories).lower() for product in products}
+        missing = [
+            item["name"]
+            for item in ingredients
+            if not item.get("category") or str(item["category"]).lower() not in found
+        ]
+        finished = time.perf_counter()
+        print(
+            f"recipe_bundle: recipe+index {(recipe_loaded - started) * 1000:.0f} ms, "
+            f"catalog {(finished - recipe_loaded) * 1000:.0f} ms, total {(finished - started) * 1000:.0f} ms"
+        )
+        structured = {
+            "places": products,
+            "recipe": {
+                "title": recipe.get("title"),
+                "source": recipe.get("source"),
+                "ingredients": ingredients,
+            },
+            "missing_ingredients": missing,
+        }
+        _log_payload_size("recipe_bundle", structured)
+        return types.ServerResult(
+            types.CallToolResult(
+                content=[types.TextContent(type="text", text="Fetched recipe bundle.")],
+                structuredContent=structured,
+                _meta=_tool_invocation_meta(WIDGETS_BY_ID["list"]),
+            )
+        )
+
     if req.params.name == "create_payment_intent":
         args = req.params.arguments or {}
         amount = int(args.get("amount", 0))
@@ -733,22 +1980,45 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
                 )
             )
 
-        payment_method = os.getenv("STRIPE_TEST_PAYMENT_METHOD", "pm_card_visa")
-        intent = stripe.PaymentIntent.create(
-            amount=amount,
-            currency=currency,
-            payment_method=payment_method,
-            confirm=True,
-            automatic_payment_methods={"enabled": True, "allow_redirects": "never"},
+        if session is not None and not args.get("cart") and session.cart:
+            # Righe del carrello della sessione per la chiave di idempotenza.
+            args = {**args, "cart": session.cart}
+        idempotency_key = _payment_idempotency_key(args, amount, currency)
+        started = time.perf_counter()
+        try:
+            result = await _create_payment_intent(amount, currency, idempotency_key)
+        except asyncio.TimeoutError:
+            # Con la chiave di idempotenza il retry non crea un secondo addebito.
+            print(f"create_payment_intent: Stripe timed out after {STRIPE_TIMEOUT_SECONDS}s")
+            return types.ServerResult(
+                types.CallToolResult(
+                    content=[types.TextContent(type="text", text="Payment provider timed out, please retry.")],
+                    # Esito sconosciuto: il retry va fatto con lo stesso checkout_id.
+                    structuredContent={"retryable": idempotency_key is not None},
+                    isError=True,
+                )
+            )
+        except _stripe().StripeError as exc:
+            print(f"create_payment_intent: Stripe error: {exc}")
+            return types.ServerResult(
+                types.CallToolResult(
+                    content=[
+                        types.TextContent(
+                            type="text", text=f"Payment failed: {exc.user_message or 'Stripe error.'}"
+                        )
+                    ],
+                    isError=True,
+                )
+            )
+        print(
+            f"create_payment_intent: {result['status']} in {(time.perf_counter() - started) * 1000:.0f}ms"
+            f" (idempotent={idempotency_key is not None}, replayed={result.get('replayed', False)})"
         )
 
         return types.ServerResult(
             types.CallToolResult(
                 content=[types.TextContent(type="text", text="PaymentIntent created.")],
-                structuredContent={
-                    "status": intent.status,
-                    "payment_intent_id": intent.id,
-                },
+                structuredContent=result,
             )
         )
 
@@ -769,61 +2039,138 @@ async def _call_tool_request(req: types.CallToolRequest) -> types.ServerResult:
     meta = _tool_invocation_meta(widget)
 
     if widget.identifier == "carousel":
-        arguments = req.params.arguments or {}
+        arguments, unmatched = await _normalize_category_argument(project, db, req.params.arguments or {})
         limit = arguments.get("limit")
+        page_size = limit if isinstance(limit, int) and limit > 0 else CAROUSEL_DEFAULT_PAGE_SIZE
+        page_size = min(page_size, CAROUSEL_MAX_PAGE_SIZE)
+        after_id = None
+        cursor = arguments.get("cursor")
+        if cursor:
+            try:
+                after_id = _decode_cursor(str(cursor), arguments)
+            except ValueError:
+                return types.ServerResult(
+                    types.CallToolResult(
+                        content=[types.TextContent(type="text", text="Invalid or expired cursor.")],
+                        isError=True,
+                    )
+                )
+        query = arguments.get("query")
+        semantic = None
+        if _semantic_search_enabled(project) and isinstance(query, str) and query.strip():
+            semantic = await _get_semantic_index(project)
+        if semantic is not None:
+            # Cursor semantico: posizione nel ranking, non ultimo id.
+            offset = after_id.get("rank", 0) if isinstance(after_id, dict) else 0
+            categories = arguments.get("category") if isinstance(arguments.get("category"), list) else []
+            started = time.perf_counter()
+            hits = semantic.search(
+                query,
+                page_size + 1,
+                offset=offset,
+                brand=arguments.get("brand"),
+                min_price=arguments.get("min_price"),
+                max_price=arguments.get("max_price"),
+                categories=categories,
+                category_in_description=db.CATALOG.config.category_match == catalog.MATCH_IN_OR_DESCRIPTION,
+            )
+            print(f"carousel: semantic top-{page_size} over {len(semantic)} in {(time.perf_counter() - started) * 1000:.1f} ms")
+            products = [product for product, _ in hits]
+            chars = _projection_for(widget.identifier, arguments).get("description_chars")
+            if chars:
+                products = [
+                    replace(p, description=p.description[:chars] + "…") if len(p.description) > chars else p
+                    for p in products
+                ]
+            next_cursor = None
+            if len(products) > page_size:
+                products = products[:page_size]
+                next_cursor = _encode_cursor({"rank": offset + page_size}, arguments)
+            structured = {"places": products, "next_cursor": next_cursor}
+            if unmatched:
+                structured["unmatched_categories"] = unmatched
+            if arguments.get("facets"):
+                structured["facets"] = await _carousel_facets(project, db, arguments)
+            text = _unmatched_categories_text(db, unmatched, _remember_result(session, products, structured))
+            _log_payload_size(widget.identifier, structured)
+            return types.ServerResult(
+                types.CallToolResult(
+                    content=[types.TextContent(type="text", text=text)],
+                    structuredContent=structured,
+                    _meta=meta,
+                )
+            )
+        if isinstance(after_id, dict):
+            after_id = None  # cursor di una ricerca semantica non più disponibile: dalla prima pagina
         try:
-            products = db.get_products_from_motherduck(arguments)
+            # Una riga in più per sapere se esiste una pagina successiva.
+            products = await _cached_products(
+                project,
+                db,
+                {k: v for k, v in arguments.items() if k != "facets"},
+                limit=page_size + 1,
+                after_id=after_id,
+                **_projection_for(widget.identifier, arguments),
+            )
         except Exception as e:
-            print(f"Error fetching products from MotherDuck: {e}")
+            print(f"Error fetching products from catalog: {e}")
             return types.ServerResult(
                 types.CallToolResult(
                     content=[
                         types.TextContent(
                             type="text",
-                            text="MotherDuck connection failed while fetching products.",
+                            text="Catalog connection failed while fetching products.",
                         )
                     ],
                     isError=True,
                 )
             )
-        if isinstance(limit, int) and limit > 0:
-            products = products[:limit]
-        places = [
-            product
-            for index, product in enumerate(products)
-        ]
+        next_cursor = None
+        if len(products) > page_size:
+            products = products[:page_size]
+            next_cursor = _encode_cursor(products[-1].id, arguments)
+        structured = {"places": products, "next_cursor": next_cursor}
+        if unmatched:
+            structured["unmatched_categories"] = unmatched
+        if arguments.get("facets"):
+            structured["facets"] = await _carousel_facets(project, db, arguments)
+        text = _unmatched_categories_text(db, unmatched, _remember_result(session, products, structured))
+        _log_payload_size(widget.identifier, structured)
         return types.ServerResult(
             types.CallToolResult(
-                content=[types.TextContent(type="text", text="Fetched products.")],
-                structuredContent={"places": places},
+                content=[types.TextContent(type="text", text=text)],
+                structuredContent=structured,
                 _meta=meta,
             )
         )
     elif widget.identifier == "list":
-        arguments = req.params.arguments or {}
+        arguments, unmatched = await _normalize_category_argument(project, db, req.params.arguments or {})
         try:
-            products = db.get_products_from_motherduck(arguments, 1)
+            products = await _cached_products(
+                project, db, arguments, 1, **_projection_for(widget.identifier, arguments)
+            )
         except Exception as e:
-            print(f"Error fetching products from MotherDuck: {e}")
+            print(f"Error fetching products from catalog: {e}")
             return types.ServerResult(
                 types.CallToolResult(
                     content=[
                         types.TextContent(
                             type="text",
-                            text="MotherDuck connection failed while fetching products.",
+                            text="Catalog connection failed while fetching products.",
                         )
                     ],
                     isError=True,
                 )
             )
-        places = [
-            product
-            for index, product in enumerate(products)
-        ]
+        structured = {"places": products}
+        if unmatched:
+            structured["unmatched_categories"] = unmatched
+        text = _unmatched_categories_text(db, unmatched, _remember_result(session, products, structured))
+        _log_payload_size(widget.identifier, structured)
         return types.ServerResult(
             types.CallToolResult(
-                content=[types.TextContent(type="text", text="Fetched products.")],
-                structuredContent={"places": places},
+                content=[types.TextContent(type="text", text=text)],
+                structuredContent=structured,
                 _meta=meta,
             )
         )
@@ -845,7 +2192,7 @@ async def product_list_tool(req: types.CallToolRequest) -> types.ServerResult:
     query_params = get_current_query_params()
     project = query_params.get("proj")
     db = get_object_by_project(project, "database")
-    products = db.get_products_from_motherduck()
+    products = db.CATALOG.search({})
     return types.ServerResult(
         types.CallToolResult(
             content=[types.TextContent(type="text", text="Fetched products.")],
@@ -853,12 +2200,134 @@ async def product_list_tool(req: types.CallToolRequest) -> types.ServerResult:
         )
     )
 
+@mcp.custom_route("/proxy-image", methods=["GET"])
+async def _proxy_image(request: Request) -> Any:
+    """Proxy immagini per `SafeImage.jsx`: `?url=` obbligatorio, `?w=` per una miniatura."""
+    import httpx
+    from starlette.responses import PlainTextResponse, Response
+
+    image_proxy = _import_local("image_proxy")
+    url = request.query_params.get("url", "").strip()
+    raw_width = request.query_params.get("w", "")
+    width = int(raw_width) if raw_width.isdigit() else None
+    if not url:
+        return PlainTextResponse("Missing url.", status_code=400)
+    # Contenuto di terzi servito dalla nostra origine: niente sniffing, niente script.
+    headers = {"X-Content-Type-Options": "nosniff", "Content-Security-Policy": "sandbox"}
+    try:
+        proxy = await asyncio.to_thread(_get_image_proxy)
+        image = await proxy.get(url, width)
+        headers.update({"ETag": image.etag, "Cache-Control": "public, max-age=86400"})
+        if request.headers.get("if-none-match") == image.etag:
+            return Response(status_code=304, headers=headers)
+        # Byte letti in memoria (max IMAGE_MAX_BYTES): l'LRU può rimuovere il file in ogni momento.
+        image, data = await proxy.read(url, width, image)
+    except image_proxy.ImageProxyError as exc:
+        return PlainTextResponse(str(exc), status_code=exc.status_code, headers=headers)
+    except httpx.HTTPError as exc:
+        print(f"Error proxying image: {exc}")
+        return PlainTextResponse("Image fetch failed.", status_code=502, headers=headers)
+    headers["ETag"] = image.etag
+    return Response(data, media_type=image.content_type, headers=headers)
+
+
+@mcp.custom_route("/widgets/manifest", methods=["GET"])
+async def _widgets_manifest(request: Request) -> Any:
+    """Bundle correnti per widget (file, ETag, dimensione, data) dopo l'ultima ricarica."""
+    from starlette.responses import JSONResponse
+
+    return JSONResponse(await asyncio.to_thread(WIDGET_ASSETS.manifest))
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def _metrics(request: Request) -> Any:
+    """Stato di circuit breaker, admission control, rate limiting e cache del worker corrente (JSON)."""
+    from starlette.responses import JSONResponse, PlainTextResponse
+
+    if not _admin_authorized(request):
+        # Espone carico, sessioni e percorsi su disco: stesso segreto di /admin/profile.
+        return PlainTextResponse("Not Found", status_code=404)
+
+    return JSONResponse(
+        {
+            "upstreams": resilience.snapshot(),
+            "admission": ADMISSION.snapshot(),
+            "rate_limit": RATE_LIMITER.snapshot(),
+            "shared_cache": SHARED_CACHE.snapshot(),
+            "memory_caches": CACHES.snapshot(),
+            "sessions": {"stateful": MCP_STATEFUL, **SESSIONS.snapshot()},
+            "capture": CAPTURE.snapshot() if CAPTURE is not None else None,
+            "upstream_mocks": _upstream_mocks()[1].stats if MOCK_UPSTREAMS else None,
+            "pid": os.getpid(),
+        }
+    )
+
+
+@mcp.custom_route("/admin/profile", methods=["GET", "POST", "DELETE"])
+async def _admin_profile(request: Request) -> Any:
+    """Arma (POST), disarma (DELETE) o mostra (GET) il profiler del worker; `Authorization: Bearer <PROFILER_SECRET>`."""
+    from starlette.responses import JSONResponse, PlainTextResponse
+
+    if not _admin_authorized(request):
+        # 404 anche con segreto sbagliato: la route non si distingue da una inesistente.
+        return PlainTextResponse("Not Found", status_code=404)
+    if request.method == "POST":
+        params = dict(request.query_params)
+        if request.headers.get("content-type", "").startswith("application/json"):
+            try:
+                body = await request.json()
+            except ValueError:
+                return PlainTextResponse("Invalid JSON body.", status_code=400)
+            if isinstance(body, dict):
+                params.update(body)
+        try:
+            calls = min(max(int(params.get("calls") or 0), 0), 1000)
+            rate = min(max(float(params.get("rate") or 0), 0.0), 1.0)
+            seconds = min(max(float(params.get("seconds") or 300), 1.0), 3600.0)
+        except (TypeError, ValueError):
+            return PlainTextResponse("calls, rate and seconds must be numbers.", status_code=400)
+        if not calls and not rate:
+            return PlainTextResponse("Pass calls (next N tool calls) or rate (0-1).", status_code=400)
+        tool = str(params["tool"]) if params.get("tool") else None
+        project = str(params["proj"]) if params.get("proj") else None
+        PROFILER.arm(calls, rate, seconds, tool, project)
+        print(f"Profiler armed: calls={calls} rate={rate} seconds={seconds:.0f} tool={tool} proj={project}")
+    elif request.method == "DELETE":
+        PROFILER.disarm()
+    return JSONResponse({**PROFILER.snapshot(), "pid": os.getpid()})
+
+
 mcp._mcp_server.request_handlers[types.CallToolRequest] = _call_tool_request
 mcp._mcp_server.request_handlers[types.ReadResourceRequest] = _handle_read_resource
 
 
 app = mcp.streamable_http_app()
 
+_mcp_lifespan = app.router.lifespan_context
+
+
+@contextlib.asynccontextmanager
+async def _lifespan(app_: Any) -> Any:
+    """Lifespan MCP più indici (widget, cross-sell) all'avvio e chiusura delle risorse condivise allo shutdown."""
+    async with _mcp_lifespan(app_) as state:
+        # Indice dei widget pronto prima della prima richiesta.
+        await asyncio.to_thread(WIDGET_ASSETS.refresh, True)
+        cross_sell_refresh = asyncio.ensure_future(_keep_cross_sell_indexes_fresh())
+        try:
+            yield state
+        finally:
+            cross_sell_refresh.cancel()
+            global _http_client
+            if _http_client is not None:
+                await _http_client.aclose()
+                _http_client = None
+            if CAPTURE is not None:
+                CAPTURE.flush()
+            print(f"Worker {os.getpid()} shut down")
+
+
+app.router.lifespan_context = _lifespan
+
 class _RequestContextMiddleware:
     """Imposta la richiesta HTTP corrente in una contextvar così i handler MCP possono leggere query params."""
 
@@ -880,6 +2349,11 @@ class _RequestContextMiddleware:
 
 
 app.add_middleware(_RequestContextMiddleware)
+if RATE_LIMIT_ENABLED:
+    app.add_middleware(ratelimit.RateLimitMiddleware, limiter=RATE_LIMITER)
+if CAPTURE is not None:
+    # Esterno al rate limiting: anche le chiamate respinte (429) fanno parte del traffico reale.
+    app.add_middleware(traffic_capture.CaptureMiddleware, capture=CAPTURE)
 
 # Serve frontend static files when deploying as a single service (e.g. Render).
 # MCP routes (/mcp, /mcp/messages) are registered first, so they take precedence.
@@ -906,4 +2380,14 @@ except Exception:
 if __name__ == "__main__":
     import uvicorn
 
-    uvicorn.run("main:app", host="0.0.0.0", port=8000)
\ No newline at end of file
+    # WEB_CONCURRENCY > 1: un processo per core, con le cache condivise via SHARED_CACHE_PATH.
+    # loop/http "auto" usano uvloop/httptools se installati (uvicorn[standard]).
+    uvicorn.run(
+        "main:app",
+        host=os.getenv("HOST", "0.0.0.0"),
+        port=int(os.getenv("PORT", "8000")),
+        workers=int(os.getenv("WEB_CONCURRENCY", "1")),
+        loop="auto",
+        http="auto",
+        timeout_graceful_shutdown=int(os.getenv("GRACEFUL_SHUTDOWN_SECONDS", "20")),
+    )
\ No newline at end of file
@@ -0,0 +1,217 @@
+"""Profiler a campionamento, su richiesta, per le chiamate ai tool MCP.
+
+Si arma dalla route admin per le prossime N chiamate o per una frazione di esse
+(eventualmente solo per un tool o un progetto), oppure per una singola chiamata
+con l'header `X-Profile`; in main.py entrambi richiedono `PROFILER_SECRET`.
+
+Un solo thread demone, vivo solo finché c'è almeno una chiamata profilata,
+ogni `interval` secondi legge lo stack di ciascuna chiamata:
+- coroutine del tool in esecuzione: lo stack reale del thread dell'event loop,
+  dal frame radice della chiamata in giù;
+- coroutine sospesa: la catena di `await` (`cr_await`) fino a ciò che si sta
+  aspettando, così anche l'attesa di catalogo, thread e upstream finisce nel
+  profilo (campionamento a tempo reale, non solo CPU).
+Gli stack sono "piegati" (formato di flamegraph.pl e speedscope) con radice
+`proj=<proj>;tool=<tool>` e vengono aggiunti al file del worker a fine chiamata,
+fuori dall'event loop.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Coroutine, Dict, List
+
+# Profondità massima della catena di await seguita per campione.
+_MAX_AWAIT_DEPTH = 64
+
+
+def _escape(text: str) -> str:
+    # `;` separa i frame e lo spazio precede il conteggio: nelle etichette non devono comparire.
+    return "_".join(text.replace(";", ":").split())
+
+
+def _label(frame: Any) -> str:
+    code = frame.f_code
+    name = getattr(code, "co_qualname", code.co_name)
+    # Riga di definizione, non quella corrente: un nodo per funzione nel flamegraph.
+    return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})".replace(";", ":")
+
+
+def _await_chain(awaitable: Any) -> List[str]:
+    stack: List[str] = []
+    current = awaitable
+    while current is not None and len(stack) < _MAX_AWAIT_DEPTH:
+        frame = getattr(current, "cr_frame", None) or getattr(current, "gi_frame", None)
+        if frame is None:
+            stack.append("[await]")  # future, task o thread: il tempo passa fuori dalla coroutine
+            break
+        stack.append(_label(frame))
+        current = getattr(current, "cr_await", None) or getattr(current, "gi_yieldfrom", None)
+    return stack
+
+
+@dataclass
+class _Session:
+    coro: Any
+    tool: str
+    project: str
+    thread_id: int
+    started: float = field(default_factory=time.perf_counter)
+    samples: int = 0
+    counts: Counter = field(default_factory=Counter)
+
+    def sample(self, frames: Dict[int, Any]) -> None:
+        root = self.coro.cr_frame
+        if root is None:
+            return  # già terminata
+        if self.coro.cr_running:
+            stack: List[str] = []
+            frame = frames.get(self.thread_id)
+            while frame is not None and frame is not root:
+                stack.append(_label(frame))
+                frame = frame.f_back
+            if frame is None:
+                return  # tra un passo e l'altro dell'event loop: campione scartato
+            stack.append(_label(root))
+            stack.reverse()
+        else:
+            stack = _await_chain(self.coro)
+        self.counts[";".join(stack)] += 1
+        self.samples += 1
+
+
+@dataclass
+class _Arming:
+    calls: int
+    rate: float
+    until: float
+    tool: str | None
+    project: str | None
+
+
+class Profiler:
+    def __init__(self, directory: Path, interval: float = 0.005, max_active: int = 4, max_samples: int = 20_000):
+        self.directory = directory
+        self.interval = interval
+        self.max_active = max_active
+        self.max_samples = max_samples
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._sessions: Dict[int, _Session] = {}
+        self._thread: threading.Thread | None = None
+        self._arming: _Arming | None = None
+        self.stats: Dict[str, int] = {"profiled": 0, "samples": 0, "skipped_busy": 0}
+
+    @property
+    def path(self) -> Path:
+        return self.directory / f"profile-{os.getpid()}.folded"
+
+    def arm(
+        self,
+        calls: int = 0,
+        rate: float = 0.0,
+        seconds: float = 300.0,
+        tool: str | None = None,
+        project: str | None = None,
+    ) -> None:
+        """Profila le prossime `calls` chiamate, oppure una frazione `rate`, per al massimo `seconds`."""
+        with self._lock:
+            self._arming = _Arming(calls, rate, time.monotonic() + seconds, tool or None, project or None)
+
+    def disarm(self) -> None:
+        with self._lock:
+            self._arming = None
+
+    def should_profile(self, tool: str, project: str | None, forced: bool = False) -> bool:
+        with self._lock:
+            arming = self._arming
+            if arming is not None and time.monotonic() > arming.until:
+                arming = self._arming = None
+            matches = arming is not None and (
+                (arming.tool is None or arming.tool == tool)
+                and (arming.project is None or arming.project == project)
+            )
+            if not forced and not matches:
+                return False
+            if len(self._sessions) >= self.max_active:
+                # Sotto carico il profiler non si accumula: la chiamata passa senza profilo.
+                self.stats["skipped_busy"] += 1
+                return False
+            if forced:
+                return True
+            if arming.calls > 0:
+                arming.calls -= 1
+                if arming.calls == 0 and not arming.rate:
+                    self._arming = None
+                return True
+            return random.random() < arming.rate
+
+    async def run(self, coro: Coroutine[Any, Any, Any], tool: str, project: str | None) -> Any:
+        """Esegue la coroutine del tool campionandola; gli stack vanno su file a fine chiamata."""
+        session = _Session(coro, tool, project or "-", threading.get_ident())
+        with self._lock:
+            self._sessions[id(session)] = session
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._sample_loop, name="tool-profiler", daemon=True)
+                self._thread.start()
+        try:
+            return await coro
+        finally:
+            with self._lock:
+                self._sessions.pop(id(session), None)
+                self.stats["profiled"] += 1
+                self.stats["samples"] += session.samples
+            asyncio.get_running_loop().run_in_executor(None, self._write, session)
+
+    def _sample_loop(self) -> None:
+        while True:
+            with self._lock:
+                sessions = [s for s in self._sessions.values() if s.samples < self.max_samples]
+                if not self._sessions:
+                    self._thread = None
+                    return
+            frames = sys._current_frames()
+            for session in sessions:
+                try:
+                    session.sample(frames)
+                except Exception:
+                    pass  # stato letto da un altro thread mentre cambia: campione perso
+            del frames
+            time.sleep(self.interval)
+
+    def _write(self, session: _Session) -> None:
+        elapsed_ms = (time.perf_counter() - session.started) * 1000
+        print(f"Profiled {session.tool} for {session.project}: {session.samples} samples in {elapsed_ms:.0f}ms")
+        if not session.counts:
+            return
+        # proj e tool arrivano dal client.
+        root = f"proj={_escape(session.project)};tool={_escape(session.tool)}"
+        lines = "".join(f"{root};{stack} {count}\n" for stack, count in session.counts.items())
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with self._write_lock, open(self.path, "a", encoding="utf8") as out:
+                out.write(lines)
+        except OSError as exc:
+            print(f"Error writing profile: {exc}")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            arming = self._arming
+            armed = None
+            if arming is not None:
+                armed = {
+                    "calls": arming.calls,
+                    "rate": arming.rate,
+                    "expires_in": round(max(arming.until - time.monotonic(), 0.0), 1),
+                    "tool": arming.tool,
+                    "proj": arming.project,
+                }
+            return {"armed": armed, "active": len(self._sessions), "file": str(self.path), **self.stats}
@@ -0,0 +1,347 @@
+"""Rate limiting token bucket per le chiamate `tools/call` del server MCP.
+
+`RateLimitMiddleware` legge il corpo JSON-RPC delle POST su `/mcp`, ricava il
+nome del tool e scala un gettone dal bucket `tool|chiave`, dove la chiave è
+l'IP del client, la sessione MCP (solo se il transport la valida, cioè in
+modalità stateful) o il progetto (`proj`, solo se esiste). A bucket vuoto
+risponde 429 con `Retry-After` senza arrivare al dispatcher; un batch passa
+intero o viene rifiutato intero, senza consumare gettoni. Corpi oltre
+`_MAX_INSPECTED_BODY` sono rifiutati con 413.
+
+L'IP è quello del peer TCP; dietro `trusted_proxies` proxy (ngrok, Render) è la
+voce di `X-Forwarded-For` aggiunta dall'ultimo proxy fidato, non la prima, che
+il client può scrivere a piacere.
+
+Il nome del tool arriva dal client: quelli non registrati (`tools`) e senza un
+limite proprio contano tutti sotto `unknown`, così bucket, righe SQLite e
+contatori restano limitati.
+
+Lo store di default è in memoria (un processo); con più worker si usa
+`SQLiteBucketStore` su un file condiviso, così il limite vale per tutti.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Tuple
+from urllib.parse import parse_qs
+
+# Corpo massimo di una POST su /mcp: va letto tutto per contare i tool, oltre si rifiuta.
+_MAX_INSPECTED_BODY = 1024 * 1024
+
+UNKNOWN = "unknown"
+
+
+@dataclass(frozen=True)
+class Limit:
+    """`requests` chiamate ogni `per_seconds` secondi, con burst pari a `requests`."""
+
+    requests: int
+    per_seconds: float
+
+    @property
+    def rate(self) -> float:
+        return self.requests / self.per_seconds
+
+
+def parse_limits(value: str | None) -> Dict[str, Limit]:
+    """`"compare_enrich=10/60,*=120/60"` -> {"compare_enrich": Limit(10, 60), "*": Limit(120, 60)}."""
+    limits: Dict[str, Limit] = {}
+    for part in (value or "").split(","):
+        name, _, spec = part.partition("=")
+        requests, _, seconds = spec.partition("/")
+        try:
+            limit = Limit(int(requests), float(seconds or 60))
+        except ValueError:
+            continue
+        if name.strip() and limit.requests > 0 and limit.per_seconds > 0:
+            limits[name.strip()] = limit
+    return limits
+
+
+def _refill(
+    state: Tuple[float, float] | None, limit: Limit, now: float, cost: int = 1
+) -> Tuple[float, bool, float]:
+    """Nuovi gettoni, esito e secondi di attesa suggeriti dato lo stato (tokens, updated)."""
+    tokens, updated = state if state is not None else (float(limit.requests), now)
+    tokens = min(float(limit.requests), tokens + max(0.0, now - updated) * limit.rate)
+    if tokens >= cost:
+        return tokens - cost, True, 0.0
+    return tokens, False, (cost - tokens) / limit.rate
+
+
+class InMemoryBucketStore:
+    blocking = False
+
+    def __init__(self, max_keys: int = 100_000):
+        # Ordinati per ultimo uso: oltre `max_keys` si scarta il più vecchio, in O(1).
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_keys = max_keys
+
+    def take(self, key: str, limit: Limit, cost: int = 1) -> Tuple[bool, float]:
+        now = time.time()
+        with self._lock:
+            tokens, allowed, retry_after = _refill(self._buckets.get(key), limit, now, cost)
+            self._buckets[key] = (tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self._max_keys:
+                self._buckets.popitem(last=False)
+        return allowed, retry_after
+
+    def refund(self, key: str, limit: Limit, cost: int) -> None:
+        with self._lock:
+            state = self._buckets.get(key)
+            if state is not None:
+                self._buckets[key] = (min(float(limit.requests), state[0] + cost), state[1])
+
+
+class SQLiteBucketStore:
+    """Bucket in un file SQLite condiviso tra i worker (transazione IMMEDIATE per chiamata)."""
+
+    blocking = True
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        self._takes = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS rate_buckets "
+                "(key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            self._local.conn = conn
+        return conn
+
+    def take(self, key: str, limit: Limit, cost: int = 1) -> Tuple[bool, float]:
+        conn = self._connection()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT tokens, updated FROM rate_buckets WHERE key = ?", (key,)).fetchone()
+            tokens, allowed, retry_after = _refill(row, limit, now, cost)
+            conn.execute(
+                "INSERT INTO rate_buckets (key, tokens, updated) VALUES (?, ?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated",
+                (key, tokens, now),
+            )
+            self._takes += 1
+            if self._takes % 1000 == 0:
+                conn.execute("DELETE FROM rate_buckets WHERE updated < ?", (now - 3600,))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return allowed, retry_after
+
+    def refund(self, key: str, limit: Limit, cost: int) -> None:
+        self._connection().execute(
+            "UPDATE rate_buckets SET tokens = min(?, tokens + ?) WHERE key = ?", (float(limit.requests), cost, key)
+        )
+
+
+def create_store(spec: str | None) -> Any:
+    """`memory` (default) oppure `sqlite:/percorso/file.db`."""
+    spec = (spec or "memory").strip()
+    if spec.startswith("sqlite:"):
+        return SQLiteBucketStore(spec[len("sqlite:"):])
+    return InMemoryBucketStore()
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        store: Any,
+        limits: Dict[str, Limit],
+        key_by: str = "ip",
+        trusted_proxies: int = 0,
+        sessions_validated: bool = False,
+        projects: Iterable[str] = (),
+        tools: Iterable[str] = (),
+    ):
+        self.store = store
+        self.limits = limits
+        self.key_by = key_by
+        self.trusted_proxies = trusted_proxies
+        # Solo un transport stateful rifiuta id di sessione inventati: altrimenti ogni id nuovo
+        # sarebbe un bucket pieno.
+        self.sessions_validated = sessions_validated
+        self.projects = frozenset(projects)
+        self.tools = frozenset(tools)
+        self.stats: Dict[str, Any] = {"allowed": 0, "rejected": 0, "rejected_by_tool": {}}
+
+    def limit_for(self, tool: str) -> Limit | None:
+        return self.limits.get(tool) or self.limits.get("*")
+
+    def tool_key(self, tool: str) -> str:
+        """Nome del tool per bucket e contatori: `unknown` se non registrato né limitato."""
+        if tool in self.tools or (tool in self.limits and tool != "*"):
+            return tool
+        return UNKNOWN
+
+    def client_key(self, scope: dict) -> str:
+        headers = {k.decode("latin-1"): v.decode("latin-1") for k, v in scope.get("headers") or []}
+        if self.key_by == "proj":
+            proj = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("proj", [""])[0]
+            if proj in self.projects:
+                return f"proj:{proj}"
+        if self.key_by == "session" and self.sessions_validated and headers.get("mcp-session-id"):
+            return f"session:{headers['mcp-session-id']}"
+        ip = (scope.get("client") or ("unknown",))[0]
+        if self.trusted_proxies > 0:
+            # Ogni proxy aggiunge a destra l'indirizzo da cui riceve: le voci più a sinistra
+            # di quella scritta dal primo proxy fidato vengono dal client.
+            hops = [h.strip() for h in headers.get("x-forwarded-for", "").split(",") if h.strip()]
+            if hops:
+                ip = hops[-min(self.trusted_proxies, len(hops))]
+        return f"ip:{ip}"
+
+    async def check(self, tools: List[str], scope: dict) -> Tuple[bool, float, str | None]:
+        """Un gettone per chiamata; tutto o niente: (esito, attesa suggerita, tool rifiutato)."""
+        client = self.client_key(scope)
+        taken: List[Tuple[str, Limit, int]] = []
+        # Nome del tool come lo ha scritto il client, per rispondere alla richiesta giusta.
+        called = {self.tool_key(tool): tool for tool in reversed(tools)}
+        for tool, cost in Counter(self.tool_key(tool) for tool in tools).items():
+            limit = self.limit_for(tool)
+            if limit is None:
+                continue
+            key = f"{tool}|{client}"
+            if self.store.blocking:
+                allowed, retry_after = await asyncio.to_thread(self.store.take, key, limit, cost)
+            else:
+                allowed, retry_after = self.store.take(key, limit, cost)
+            if not allowed:
+                # Il batch non passa: i gettoni già scalati per gli altri tool tornano nei bucket.
+                for taken_key, taken_limit, taken_cost in taken:
+                    if self.store.blocking:
+                        await asyncio.to_thread(self.store.refund, taken_key, taken_limit, taken_cost)
+                    else:
+                        self.store.refund(taken_key, taken_limit, taken_cost)
+                self.stats["rejected"] += 1
+                by_tool = self.stats["rejected_by_tool"]
+                by_tool[tool] = by_tool.get(tool, 0) + 1
+                return False, retry_after, called[tool]
+            taken.append((key, limit, cost))
+        self.stats["allowed"] += 1
+        return True, 0.0, None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "key_by": self.key_by,
+            "store": type(self.store).__name__,
+            "trusted_proxies": self.trusted_proxies,
+            **self.stats,
+        }
+
+
+def _tool_calls(body: bytes) -> List[Tuple[Any, str]]:
+    """(id, nome tool) delle richieste `tools/call` nel corpo JSON-RPC (anche batch)."""
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return []
+    messages = payload if isinstance(payload, list) else [payload]
+    calls = []
+    for message in messages:
+        if isinstance(message, dict) and message.get("method") == "tools/call":
+            params = message.get("params") if isinstance(message.get("params"), dict) else {}
+            calls.append((message.get("id"), str(params.get("name") or "")))
+    return calls
+
+
+class RateLimitMiddleware:
+    """Middleware ASGI: applica `RateLimiter` alle `tools/call` prima del transport MCP."""
+
+    def __init__(self, app: Any, limiter: RateLimiter, path_prefix: str = "/mcp"):
+        self._app = app
+        self._limiter = limiter
+        self._path_prefix = path_prefix
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if (
+            scope.get("type") != "http"
+            or scope.get("method") != "POST"
+            or not scope.get("path", "").startswith(self._path_prefix)
+        ):
+            await self._app(scope, receive, send)
+            return
+
+        # Il corpo va letto per trovare il tool, poi riconsegnato intatto all'app.
+        messages = []
+        size = 0
+        more = True
+        while more and size <= _MAX_INSPECTED_BODY:
+            message = await receive()
+            messages.append(message)
+            if message["type"] != "http.request":
+                break
+            size += len(message.get("body", b""))
+            more = message.get("more_body", False)
+
+        async def replay() -> Any:
+            if messages:
+                return messages.pop(0)
+            return await receive()
+
+        if more and messages[-1]["type"] == "http.request":
+            # Un corpo che non si può ispezionare non passa: sarebbe un batch di tool non contati.
+            print(f"Rejected /mcp body over {_MAX_INSPECTED_BODY} bytes")
+            await self._send_error(send, 413, None, "Request body too large.", {"retryable": False})
+            return
+        body = b"".join(m.get("body", b"") for m in messages if m["type"] == "http.request")
+        calls = _tool_calls(body)
+        if calls:
+            allowed, retry_after, tool = await self._limiter.check([name for _, name in calls], scope)
+            if not allowed:
+                await self._reject(send, next(i for i, name in calls if name == tool), str(tool), retry_after)
+                return
+        await self._app(scope, replay, send)
+
+    async def _reject(self, send: Any, request_id: Any, tool: str, retry_after: float) -> None:
+        seconds = max(1, round(retry_after + 0.5))
+        print(f"Rate limited {tool}: retry in {seconds}s")
+        await self._send_error(
+            send,
+            429,
+            request_id,
+            f"Rate limit exceeded for {tool}, retry in {seconds}s.",
+            {"retryable": True, "retryAfterSeconds": seconds},
+            [(b"retry-after", str(seconds).encode())],
+        )
+
+    async def _send_error(
+        self,
+        send: Any,
+        status: int,
+        request_id: Any,
+        message: str,
+        data: Dict[str, Any],
+        headers: List[Tuple[bytes, bytes]] | None = None,
+    ) -> None:
+        body = json.dumps(
+            {"jsonrpc": "2.0", "id": request_id, "error": {"code": -32000, "message": message, "data": data}}
+        ).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    *(headers or []),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
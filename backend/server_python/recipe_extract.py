@@ -0,0 +1,445 @@
+"""Download e parsing incrementale delle pagine ricetta usate da `recipe_parse`.
+
+La pagina viene letta in streaming con un tetto massimo di byte e passata
+chunk per chunk a un `HTMLParser` che scarta script/style, raccoglie il testo
+visibile e intercetta i dati strutturati schema.org (JSON-LD `Recipe` e
+microdata `recipeIngredient`). Tutto avviene in un solo passaggio lineare,
+senza regex DOTALL sull'intera pagina.
+
+Il parsing gira in un thread, a blocchi, e si ferma presto su pagine ostili:
+`HTMLParser` riscandisce il buffer non ancora consumato a ogni `feed`, quindi
+un costrutto mai chiuso (`<a xxxx...`) costerebbe tempo quadratico. Oltre
+`_MAX_PENDING` caratteri pendenti o `PARSE_BUDGET_SECONDS` di parsing la
+pagina si tratta come troncata. Il corpo di `<script>` e `<style>` resterebbe
+anch'esso nel buffer fino al tag di chiusura: si consuma a blocchi, così uno
+script inline grande (`__NEXT_DATA__`, dati di idratazione) non tronca la
+pagina.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import codecs
+import html
+import json
+import re
+import time
+from dataclasses import dataclass, field
+from html.parser import HTMLParser
+from typing import TYPE_CHECKING, Any, Dict, List
+
+if TYPE_CHECKING:
+    import httpx
+
+# Tetto di default per il download (2 MiB): le pagine ricetta reali stanno ben sotto.
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+# Testo passato al parser per volta (meno passaggi di thread) e testo non ancora
+# consumato oltre il quale un costrutto aperto rende la pagina inutilizzabile.
+_FEED_CHARS = 64 * 1024
+_MAX_PENDING = 64 * 1024
+# Tempo massimo di parsing per pagina.
+PARSE_BUDGET_SECONDS = 1.0
+
+_SKIP_TAGS = {"script", "style", "noscript", "template", "svg", "iframe"}
+_VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "param", "source", "track", "wbr",
+}
+_BLOCK_TAGS = {
+    "p", "div", "li", "ul", "ol", "br", "tr", "td", "th", "table",
+    "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "header",
+    "footer", "aside", "nav", "dt", "dd", "blockquote", "pre",
+}
+_INGREDIENT_ITEMPROPS = {"recipeingredient", "ingredients"}
+
+
+class RecipeFetchError(Exception):
+    """Errore di download della pagina ricetta (es. content type non HTML)."""
+
+
+class RecipeHTMLParser(HTMLParser):
+    """Parser incrementale: testo visibile + JSON-LD + microdata degli ingredienti."""
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.title: str | None = None
+        self.json_ld: List[Any] = []
+        self.microdata_ingredients: List[str] = []
+        self._lines: List[str] = []
+        self._words: List[str] = []
+        self._skip_tag: str | None = None
+        self._skip_depth = 0
+        self._json_ld_parts: List[str] | None = None
+        self._in_title = False
+        self._title_parts: List[str] = []
+        self._ingredient_depth = 0
+        self._ingredient_tag: str | None = None
+        self._ingredient_parts: List[str] = []
+        self._has_recipe_json_ld = False
+        self.parse_seconds = 0.0
+        self.stopped = False
+
+    # --- callback HTMLParser ---
+
+    def handle_starttag(self, tag: str, attrs: List[tuple[str, str | None]]) -> None:
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth += 1
+            return
+        attr_map = {name.lower(): (value or "") for name, value in attrs}
+        if tag == "script":
+            if attr_map.get("type", "").strip().lower() == "application/ld+json":
+                self._json_ld_parts = []
+            self._skip_tag, self._skip_depth = tag, 1
+            return
+        if tag in _SKIP_TAGS:
+            self._skip_tag, self._skip_depth = tag, 1
+            return
+        if tag == "title" and self.title is None:
+            self._in_title = True
+        if tag in _BLOCK_TAGS:
+            self._break_line()
+
+        itemprop = attr_map.get("itemprop", "").strip().lower()
+        if self._ingredient_depth and itemprop in _INGREDIENT_ITEMPROPS:
+            # Tag inline non chiusi (`<b>` senza `</b>`): il nuovo ingrediente chiude il precedente.
+            self._close_ingredient()
+        if self._ingredient_depth:
+            if tag not in _VOID_TAGS:
+                self._ingredient_depth += 1
+        elif itemprop in _INGREDIENT_ITEMPROPS:
+            if tag == "meta" or tag in _VOID_TAGS:
+                content = " ".join(attr_map.get("content", "").split())
+                if content:
+                    self.microdata_ingredients.append(content)
+            else:
+                self._ingredient_depth = 1
+                self._ingredient_tag = tag
+                self._ingredient_parts = []
+
+    def handle_startendtag(self, tag: str, attrs: List[tuple[str, str | None]]) -> None:
+        # <tag/>: non deve aprire un livello di annidamento.
+        if tag in _VOID_TAGS or tag in _SKIP_TAGS or tag == "script":
+            self.handle_starttag(tag, attrs)
+            if self._skip_tag == tag:
+                self._skip_tag, self._skip_depth = None, 0
+                self._json_ld_parts = None
+            return
+        self.handle_starttag(tag, attrs)
+        self.handle_endtag(tag)
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skip_tag is not None:
+            if tag == self._skip_tag:
+                self._skip_depth -= 1
+                if self._skip_depth <= 0:
+                    if self._json_ld_parts is not None:
+                        self._add_json_ld("".join(self._json_ld_parts))
+                        self._json_ld_parts = None
+                    self._skip_tag = None
+            return
+        if tag == "title" and self._in_title:
+            self._in_title = False
+            self.title = " ".join("".join(self._title_parts).split()) or None
+        if self._ingredient_depth and tag not in _VOID_TAGS:
+            self._ingredient_depth -= 1
+            if self._ingredient_depth == 0 or tag in (self._ingredient_tag, "li"):
+                self._close_ingredient()
+        if tag in _BLOCK_TAGS:
+            self._break_line()
+
+    def handle_data(self, data: str) -> None:
+        if self._skip_tag is not None:
+            if self._json_ld_parts is not None:
+                self._json_ld_parts.append(data)
+            return
+        if self._in_title:
+            self._title_parts.append(data)
+            return
+        if self._ingredient_depth:
+            self._ingredient_parts.append(data)
+        self._words.extend(data.split())
+
+    # --- risultati ---
+
+    @property
+    def has_structured_recipe(self) -> bool:
+        """True quando è già stato trovato un JSON-LD `Recipe` con ingredienti."""
+        return self._has_recipe_json_ld
+
+    def text(self) -> str:
+        self._break_line()
+        return "\n".join(self._lines)
+
+    def recipe_json_ld(self) -> Dict[str, Any] | None:
+        """Primo oggetto schema.org `Recipe` trovato nei blocchi JSON-LD."""
+        for blob in self.json_ld:
+            recipe = _find_recipe_node(blob)
+            if recipe is not None:
+                return recipe
+        return None
+
+    def feed_limited(self, data: str) -> bool:
+        """`feed` con i limiti anti-pagine ostili; False quando conviene smettere di leggere."""
+        if self.stopped:
+            return False
+        started = time.perf_counter()
+        for start in range(0, len(data), _FEED_CHARS):
+            self.feed(data[start:start + _FEED_CHARS])
+            self._drain_cdata()
+            self.parse_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            if len(self.rawdata) > _MAX_PENDING or self.parse_seconds > PARSE_BUDGET_SECONDS:
+                self.stopped = True
+                # Il resto pendente non si analizza: close() lo riscandirebbe.
+                self.rawdata = ""
+                return False
+            if self.has_structured_recipe:
+                return False  # il resto della pagina non serve
+        return True
+
+    # --- helper interni ---
+
+    def _drain_cdata(self) -> None:
+        """Passa a `handle_data` il corpo già letto di uno script/style ancora aperto.
+
+        Dentro `<script>`/`<style>` `HTMLParser` tiene tutto in `rawdata` finché non trova
+        la chiusura: si consuma tutto tranne un possibile `</script` spezzato tra due feed.
+        Il JSON-LD si accumula come sempre, gli altri script si scartano.
+        """
+        if self.cdata_elem is None:
+            return
+        rawdata = self.rawdata
+        cut = rawdata.rfind("<", max(len(rawdata) - len(self.cdata_elem) - 2, 0))
+        if cut < 0:
+            cut = len(rawdata)
+        if cut:
+            self.handle_data(rawdata[:cut])
+            self.rawdata = rawdata[cut:]
+
+    def _close_ingredient(self) -> None:
+        # Le parti si uniscono con spazi: "200 g <b>pasta</b>" non diventa "200 gpasta".
+        text = " ".join(" ".join(self._ingredient_parts).split())
+        if text:
+            self.microdata_ingredients.append(text)
+        self._ingredient_parts = []
+        self._ingredient_depth = 0
+        self._ingredient_tag = None
+
+    def _break_line(self) -> None:
+        if self._words:
+            self._lines.append(" ".join(self._words))
+            self._words = []
+
+    def _add_json_ld(self, raw: str) -> None:
+        raw = raw.strip()
+        if not raw:
+            return
+        try:
+            blob = json.loads(raw)
+        except ValueError:
+            return
+        self.json_ld.append(blob)
+        recipe = _find_recipe_node(blob)
+        if recipe is not None and recipe.get("recipeIngredient"):
+            self._has_recipe_json_ld = True
+
+
+def _is_recipe_type(value: Any) -> bool:
+    if isinstance(value, str):
+        return value.rsplit("/", 1)[-1].lower() == "recipe"
+    if isinstance(value, list):
+        return any(_is_recipe_type(item) for item in value)
+    return False
+
+
+def _find_recipe_node(blob: Any, _depth: int = 0) -> Dict[str, Any] | None:
+    """Cerca un nodo `@type: Recipe` in un documento JSON-LD (anche dentro `@graph`)."""
+    if _depth > 6:
+        return None
+    if isinstance(blob, list):
+        for item in blob:
+            found = _find_recipe_node(item, _depth + 1)
+            if found is not None:
+                return found
+        return None
+    if not isinstance(blob, dict):
+        return None
+    if _is_recipe_type(blob.get("@type")):
+        return blob
+    for key in ("@graph", "mainEntity", "mainEntityOfPage"):
+        if key in blob:
+            found = _find_recipe_node(blob[key], _depth + 1)
+            if found is not None:
+                return found
+    return None
+
+
+# Quantità iniziale di una riga ingrediente: numeri, frazioni, intervalli ("1-2", "1/2", "½").
+_QUANTITY_RE = re.compile(
+    r"^\s*((?:\d+(?:[.,]\d+)?|[\u00bc-\u00be\u2150-\u215e])"
+    r"(?:\s*(?:[-\u2013/]|to|a)\s*(?:\d+(?:[.,]\d+)?|[\u00bc-\u00be\u2150-\u215e]))?"
+    r"(?:\s+\d+/\d+)?)\s*"
+)
+_UNITS = (
+    "g", "gr", "grammi", "kg", "mg", "ml", "cl", "dl", "l", "lt", "litri", "litro",
+    "oz", "lb", "lbs", "cup", "cups", "tbsp", "tsp", "tablespoon", "tablespoons",
+    "teaspoon", "teaspoons", "pinch", "clove", "cloves", "slice", "slices",
+    "cucchiaio", "cucchiai", "cucchiaino", "cucchiaini", "bicchiere", "bicchieri",
+    "tazza", "tazze", "pizzico", "pizzichi", "spicchio", "spicchi", "fetta", "fette",
+    "foglia", "foglie", "rametto", "rametti", "mazzetto", "bustina", "bustine",
+    "vasetto", "confezione", "pz", "pezzi",
+)
+_UNIT_RE = re.compile(
+    r"^(" + "|".join(sorted(_UNITS, key=len, reverse=True)) + r")\b\.?(?:\s*(?:di|d'|of)\b)?\s*",
+    re.IGNORECASE,
+)
+_TRAILING_MEASURE_RE = re.compile(r"[,\s]*\b(q\.?\s?b\.?|quanto basta|to taste|a piacere)\s*$", re.IGNORECASE)
+
+
+def split_ingredient_line(line: str) -> Dict[str, str]:
+    """Separa quantità/unità dal nome ("150 g di guanciale" -> measure "150 g", name "guanciale").
+
+    Restituisce la stessa forma di `_parse_mealdb_ingredients`: `name` e `measure` opzionale.
+    """
+    text = " ".join(html.unescape(line).split())
+    measure_parts: List[str] = []
+    match = _QUANTITY_RE.match(text)
+    if match and match.group(1):
+        measure_parts.append(match.group(1).strip())
+        text = text[match.end():]
+        unit = _UNIT_RE.match(text)
+        if unit:
+            measure_parts.append(unit.group(1))
+            text = text[unit.end():]
+    trailing = _TRAILING_MEASURE_RE.search(text)
+    if trailing and trailing.start() > 0:
+        measure_parts.append(trailing.group(1))
+        text = text[: trailing.start()]
+    name = text.strip(" ,;:-")
+    if not name:
+        return {"name": " ".join(line.split())}
+    item: Dict[str, str] = {"name": name}
+    if measure_parts:
+        item["measure"] = " ".join(measure_parts)
+    return item
+
+
+@dataclass
+class RecipePage:
+    text: str
+    title: str | None = None
+    json_ld_recipe: Dict[str, Any] | None = None
+    microdata_ingredients: List[str] = field(default_factory=list)
+
+    def _structured_lines(self) -> tuple[str | None, List[str], str | None]:
+        title = self.title
+        if self.json_ld_recipe is not None:
+            title = self.json_ld_recipe.get("name") or title
+            raw = self.json_ld_recipe.get("recipeIngredient") or self.json_ld_recipe.get("ingredients") or []
+            if isinstance(raw, str):
+                raw = [raw]
+            lines = [" ".join(html.unescape(str(item)).split()) for item in raw if str(item).strip()]
+            if lines:
+                return title, lines, "json-ld"
+        if self.microdata_ingredients:
+            return title, list(self.microdata_ingredients), "microdata"
+        return title, [], None
+
+    def structured_recipe(self) -> Dict[str, Any] | None:
+        """Ricetta dai dati strutturati (titolo, ingredienti, sorgente) o None se assenti."""
+        title, lines, source = self._structured_lines()
+        if not lines:
+            return None
+        seen = set()
+        ingredients: List[Dict[str, str]] = []
+        for line in lines:
+            item = split_ingredient_line(line)
+            key = (item["name"].lower(), item.get("measure", ""))
+            if key in seen:
+                continue
+            seen.add(key)
+            ingredients.append(item)
+        return {
+            "title": " ".join(str(title).split()) if title else None,
+            "ingredients": ingredients,
+            "source": source,
+        }
+
+
+def parse_recipe_html(html: str) -> RecipePage:
+    """Variante non streaming (testo già in memoria, es. HTML incollato dall'utente)."""
+    parser = RecipeHTMLParser()
+    parser.feed_limited(html)
+    parser.close()
+    return _page_from_parser(parser)
+
+
+def _page_from_parser(parser: RecipeHTMLParser) -> RecipePage:
+    return RecipePage(
+        text=parser.text(),
+        title=parser.title,
+        json_ld_recipe=parser.recipe_json_ld(),
+        microdata_ingredients=parser.microdata_ingredients,
+    )
+
+
+def _feed(parser: RecipeHTMLParser, text: str, final: bool) -> bool:
+    more = parser.feed_limited(text)
+    if final:
+        parser.close()
+    return more
+
+
+def _charset_from_content_type(content_type: str) -> str:
+    for part in content_type.split(";")[1:]:
+        key, _, value = part.partition("=")
+        if key.strip().lower() == "charset" and value.strip():
+            charset = value.strip().strip("\"'")
+            try:
+                codecs.lookup(charset)
+                return charset
+            except LookupError:
+                break
+    return "utf-8"
+
+
+async def fetch_recipe_page(
+    client: httpx.AsyncClient,
+    url: str,
+    max_bytes: int = DEFAULT_MAX_BYTES,
+) -> RecipePage:
+    """Scarica la pagina in streaming, fermandosi al tetto di byte o appena trova un JSON-LD Recipe.
+
+    Il parsing gira in un thread a blocchi di `_FEED_CHARS`: una pagina lenta da
+    analizzare non ferma l'event loop.
+    """
+    async with client.stream("GET", url, headers={"Accept": "text/html,application/xhtml+xml"}) as response:
+        response.raise_for_status()
+        content_type = response.headers.get("content-type", "")
+        mime = content_type.split(";", 1)[0].strip().lower()
+        if mime and mime not in HTML_CONTENT_TYPES:
+            raise RecipeFetchError(f"Unsupported content type: {mime}")
+        decoder = codecs.getincrementaldecoder(_charset_from_content_type(content_type))(errors="replace")
+        parser = RecipeHTMLParser()
+        received = 0
+        pending: List[str] = []
+        pending_chars = 0
+        async for chunk in response.aiter_bytes():
+            chunk = chunk[: max_bytes - received]
+            received += len(chunk)
+            text = decoder.decode(chunk)
+            pending.append(text)
+            pending_chars += len(text)
+            if pending_chars < _FEED_CHARS and received < max_bytes:
+                continue
+            more = await asyncio.to_thread(_feed, parser, "".join(pending), False)
+            pending, pending_chars = [], 0
+            if not more or received >= max_bytes:
+                break
+        pending.append(decoder.decode(b"", final=True))
+        await asyncio.to_thread(_feed, parser, "".join(pending), True)
+    return _page_from_parser(parser)
@@ -0,0 +1,271 @@
+"""Circuit breaker e timeout adattivi per gli upstream (OpenAI, TheMealDB, MotherDuck).
+
+Ogni upstream ha un breaker: dopo `failure_threshold` errori consecutivi (le
+chiamate più lente di `slow_call_seconds` contano come errori) il circuito si
+apre e le chiamate falliscono subito con `CircuitOpenError`, così i tool
+ripiegano su cache o euristiche invece di attendere il timeout pieno. Passati
+`reset_seconds` una sola chiamata di prova passa (half-open): se riesce il
+circuito si richiude.
+
+Il timeout di ogni chiamata segue la latenza osservata (4 × p95, tra
+`min_timeout` e `max_timeout`) ed è ridotto al budget residuo del tool
+impostato con `deadline()`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Deque, Dict, Iterator, List, TypeVar
+
+T = TypeVar("T")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# Campioni minimi prima di stringere il timeout sotto `max_timeout`.
+_MIN_SAMPLES = 10
+
+_deadline: ContextVar[float | None] = ContextVar("tool_deadline", default=None)
+
+
+class UpstreamUnavailable(Exception):
+    """L'upstream non va chiamato ora: circuito aperto o budget del tool esaurito."""
+
+
+class CircuitOpenError(UpstreamUnavailable):
+    pass
+
+
+class DeadlineExceeded(UpstreamUnavailable):
+    pass
+
+
+@contextlib.contextmanager
+def deadline(seconds: float | None) -> Iterator[None]:
+    """Budget di tempo complessivo per il tool corrente (ereditato da task e thread figli)."""
+    token = _deadline.set(time.monotonic() + seconds if seconds else None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining() -> float | None:
+    """Secondi rimasti al budget del tool corrente, None se senza budget."""
+    expires = _deadline.get()
+    return None if expires is None else expires - time.monotonic()
+
+
+def _counts_as_failure(exc: BaseException) -> bool:
+    # Un 4xx (tranne 429) è un errore della richiesta, non un segnale sulla salute dell'upstream.
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    return not (isinstance(status, int) and 400 <= status < 500 and status != 429)
+
+
+class CircuitBreaker:
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = 5,
+        reset_seconds: float = 30.0,
+        slow_call_seconds: float | None = None,
+        min_timeout: float = 1.0,
+        max_timeout: float = 20.0,
+        window: int = 50,
+        interrupt: Callable[[int], None] | None = None,
+    ):
+        self.name = name
+        # Ferma il lavoro del thread indicato (es. la query DuckDB) quando `run_in_thread` scade.
+        self.interrupt = interrupt
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.slow_call_seconds = slow_call_seconds
+        self.min_timeout = min_timeout
+        self.max_timeout = max_timeout
+        self.state = CLOSED
+        self._lock = threading.Lock()
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self.stats: Dict[str, int] = {
+            "calls": 0,
+            "successes": 0,
+            "failures": 0,
+            "timeouts": 0,
+            "slow_calls": 0,
+            "rejected": 0,
+            "fallbacks": 0,
+            "opened": 0,
+        }
+
+    def _p95(self) -> float | None:
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < _MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+
+    def _adaptive_timeout(self, p95: float | None) -> float:
+        if p95 is None:
+            return self.max_timeout
+        return min(self.max_timeout, max(self.min_timeout, 4 * p95))
+
+    def timeout(self) -> float:
+        """Timeout adattivo della prossima chiamata, già ridotto al budget residuo."""
+        value = self._adaptive_timeout(self._p95())
+        left = remaining()
+        return value if left is None else min(value, left)
+
+    def _before_call(self) -> None:
+        left = remaining()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded(f"{self.name}: tool deadline exhausted")
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self._opened_at < self.reset_seconds:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(f"{self.name}: circuit open")
+                self.state = HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == HALF_OPEN:
+                if self._probe_in_flight:
+                    self.stats["rejected"] += 1
+                    raise CircuitOpenError(f"{self.name}: circuit half-open, probe in flight")
+                self._probe_in_flight = True
+            self.stats["calls"] += 1
+
+    def _after_call(self, latency: float, error: BaseException | None) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+            slow = self.slow_call_seconds is not None and latency > self.slow_call_seconds
+            if error is None:
+                self.stats["successes"] += 1
+                self._latencies.append(latency)
+                if not slow:
+                    self._consecutive_failures = 0
+                    if self.state != CLOSED:
+                        print(f"Circuit {self.name}: closed")
+                    self.state = CLOSED
+                    return
+                self.stats["slow_calls"] += 1
+            elif not _counts_as_failure(error):
+                if self.state == HALF_OPEN:
+                    self.state = CLOSED  # l'upstream ha risposto: è vivo
+                return
+            else:
+                self.stats["failures"] += 1
+                if isinstance(error, asyncio.TimeoutError):
+                    self.stats["timeouts"] += 1
+            self._consecutive_failures += 1
+            if self.state == HALF_OPEN or self._consecutive_failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    self.stats["opened"] += 1
+                    print(f"Circuit {self.name}: open after {self._consecutive_failures} failed/slow calls")
+                self.state = OPEN
+                self._opened_at = time.monotonic()
+
+    def _release_probe(self) -> None:
+        with self._lock:
+            self._probe_in_flight = False
+
+    async def call(self, fn: Callable[[float], Awaitable[T]]) -> T:
+        """Esegue `fn(timeout)` sotto il breaker; `fn` riceve il timeout da passare al client."""
+        self._before_call()
+        adaptive = self._adaptive_timeout(self._p95())
+        timeout = self.timeout()
+        started = time.monotonic()
+        try:
+            result = await asyncio.wait_for(fn(timeout), timeout=timeout)
+        except asyncio.CancelledError:
+            self._release_probe()
+            raise
+        except asyncio.TimeoutError:
+            if timeout < adaptive:
+                # Scaduto il budget del tool, non l'upstream: non conta come errore.
+                self._release_probe()
+                raise DeadlineExceeded(f"{self.name}: tool deadline exhausted") from None
+            self._after_call(time.monotonic() - started, asyncio.TimeoutError())
+            raise
+        except Exception as exc:
+            self._after_call(time.monotonic() - started, exc)
+            raise
+        self._after_call(time.monotonic() - started, None)
+        return result
+
+    async def run_in_thread(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Funzione bloccante (es. query DuckDB) in un thread, con breaker e timeout.
+
+        Un thread non si può cancellare: allo scadere si chiede a `interrupt` di fermarlo e
+        si attende che termini, così breaker e slot di admission restano occupati finché lavora.
+        """
+        thread_ids: List[int] = []
+
+        def target() -> T:
+            thread_ids.append(threading.get_ident())
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                thread_ids.clear()
+
+        async def guarded(_timeout: float) -> T:
+            future = asyncio.ensure_future(asyncio.to_thread(target))
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if self.interrupt is not None and thread_ids:
+                    self.interrupt(thread_ids[0])
+                await asyncio.wait([future])
+                if not future.cancelled():
+                    future.exception()  # errore dovuto all'interruzione: conta il timeout
+                raise
+
+        return await self.call(guarded)
+
+    def call_sync(self, fn: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+        """Per codice già in un thread: breaker e statistiche, senza timeout."""
+        self._before_call()
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException as exc:
+            self._after_call(time.monotonic() - started, exc)
+            raise
+        self._after_call(time.monotonic() - started, None)
+        return result
+
+    def record_fallback(self) -> None:
+        with self._lock:
+            self.stats["fallbacks"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        p95 = self._p95()
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self._consecutive_failures,
+                "p95_ms": None if p95 is None else round(p95 * 1000, 1),
+                "timeout_s": round(self._adaptive_timeout(p95), 2),
+                **self.stats,
+            }
+
+
+_BREAKERS: Dict[str, CircuitBreaker] = {}
+
+
+def breaker(name: str, **config: Any) -> CircuitBreaker:
+    """Breaker condiviso per upstream (creato alla prima richiesta)."""
+    existing = _BREAKERS.get(name)
+    if existing is None:
+        existing = _BREAKERS[name] = CircuitBreaker(name, **config)
+    return existing
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    return {name: item.snapshot() for name, item in _BREAKERS.items()}
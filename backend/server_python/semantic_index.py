@@ -0,0 +1,144 @@
+"""Ricerca semantica locale sul catalogo per l'argomento `query` del carousel.
+
+Ogni prodotto diventa un vettore di feature hashing (dimensione fissa) su nome,
+categorie e inizio della descrizione: parole normalizzate e ridotte a radice
+più trigrammi di caratteri, così "gaming", "gamer" e "videogame" si
+avvicinano e gli errori di battitura pesano poco. I pesi sono TF sublineare ×
+IDF e i vettori sono normalizzati: il punteggio è il coseno, calcolato per
+tutto il catalogo con un solo prodotto matrice-vettore NumPy. Nessun modello
+da scaricare, nessuna chiamata esterna.
+
+Brand, categoria e prezzo filtrano con maschere vettoriali prima del top-k,
+così la ricerca si combina con gli stessi filtri della query SQL.
+"""
+
+from __future__ import annotations
+
+import time
+import zlib
+from functools import lru_cache
+from typing import Any, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from .category_matcher import normalize_text, stem
+except ImportError:  # avvio come script (python main.py)
+    from category_matcher import normalize_text, stem
+
+# 512 float32 per prodotto: 2 KB, ~200 MB per 100k prodotti.
+DEFAULT_DIM = 512
+# Caratteri di descrizione indicizzati: l'inizio descrive il prodotto, il resto è rumore.
+DESCRIPTION_CHARS = 400
+# Pesi dei campi nel vettore del prodotto.
+_FIELD_WEIGHTS = (("name", 2.0), ("categories", 2.0), ("brand", 1.0), ("description", 1.0))
+_TRIGRAM_WEIGHT = 0.35
+
+
+@lru_cache(maxsize=1 << 16)
+def _word_features(word: str, dim: int) -> Tuple[Tuple[int, float], ...]:
+    """(bucket, peso con segno) della parola: radice più trigrammi di caratteri."""
+    padded = f"#{word}#"
+    features = [("w:" + stem(word), 1.0)]
+    features += [("t:" + padded[i : i + 3], _TRIGRAM_WEIGHT) for i in range(len(padded) - 2)]
+    out = []
+    for feature, weight in features:
+        # crc32 è stabile tra processi (hash() no): worker diversi producono gli stessi vettori.
+        h = zlib.crc32(feature.encode())
+        out.append((h % dim, weight if (h >> 31) & 1 else -weight))
+    return tuple(out)
+
+
+def _vectorize(fields: Iterable[Tuple[str, float]], dim: int) -> np.ndarray:
+    buckets: dict = {}
+    for text, weight in fields:
+        for word in normalize_text(text).split():
+            if len(word) < 2:
+                continue
+            for bucket, value in _word_features(word, dim):
+                buckets[bucket] = buckets.get(bucket, 0.0) + weight * value
+    vector = np.zeros(dim, dtype=np.float32)
+    if buckets:
+        index = np.fromiter(buckets.keys(), dtype=np.int64, count=len(buckets))
+        values = np.fromiter(buckets.values(), dtype=np.float32, count=len(buckets))
+        vector[index] = np.sign(values) * np.log1p(np.abs(values))  # TF sublineare
+    return vector
+
+
+class SemanticIndex:
+    def __init__(self, products: Sequence[Any], dim: int = DEFAULT_DIM):
+        started = time.perf_counter()
+        self.dim = dim
+        self.products = list(products)
+        self.built_at = time.monotonic()
+        matrix = np.zeros((len(self.products), dim), dtype=np.float32)
+        for row, product in enumerate(self.products):
+            fields = []
+            for field, weight in _FIELD_WEIGHTS:
+                value = str(getattr(product, field, "") or "")
+                if field == "description":
+                    value = value[:DESCRIPTION_CHARS]
+                fields.append((value, weight))
+            matrix[row] = _vectorize(fields, dim)
+        # IDF per bucket: le feature presenti in quasi tutto il catalogo contano poco.
+        df = np.count_nonzero(matrix, axis=0).astype(np.float32)
+        self._idf = np.log((1 + len(self.products)) / (1 + df)).astype(np.float32) + 1.0
+        matrix *= self._idf
+        matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-9)
+        self._matrix = matrix
+        self._prices = np.array(
+            [p.price if p.price is not None else np.nan for p in self.products], dtype=np.float64
+        )
+        self._brands = np.array([str(p.brand or "").casefold() for p in self.products], dtype=object)
+        self._categories = np.array([str(p.categories or "").casefold() for p in self.products], dtype=object)
+        self.build_seconds = time.perf_counter() - started
+        # Le feature per parola servono solo alla costruzione: fuori dal budget delle cache.
+        _word_features.cache_clear()
+
+    def __len__(self) -> int:
+        return len(self.products)
+
+    def search(
+        self,
+        query: str,
+        k: int,
+        offset: int = 0,
+        brand: str | None = None,
+        min_price: float | None = None,
+        max_price: float | None = None,
+        categories: Sequence[str] | None = None,
+        category_in_description: bool = False,
+        min_score: float = 0.05,
+    ) -> List[Tuple[Any, float]]:
+        """I prodotti più simili a `query` (rank `offset`..`offset + k`) con i filtri dati."""
+        if not self.products or k <= 0:
+            return []
+        vector = _vectorize([(query, 1.0)], self.dim) * self._idf
+        norm = float(np.linalg.norm(vector))
+        if norm == 0:
+            return []
+        scores = self._matrix @ (vector / norm)
+        mask = scores >= min_score
+        if brand:
+            mask &= self._brands == str(brand).casefold()
+        if min_price is not None:
+            mask &= self._prices >= float(min_price)
+        if max_price is not None:
+            mask &= self._prices <= float(max_price)
+        terms = list({str(c).strip().casefold() for c in categories or () if str(c).strip()})
+        if terms:
+            in_category = np.isin(self._categories, terms)
+            if category_in_description:
+                # Come MATCH_IN_OR_DESCRIPTION in SQL: termine tra spazi nella descrizione (parte indicizzata).
+                for i in np.flatnonzero(mask & ~in_category):
+                    description = str(self.products[i].description or "").casefold()
+                    in_category[i] = any(f" {term} " in description for term in terms)
+            mask &= in_category
+        candidates = np.flatnonzero(mask)
+        wanted = offset + k
+        if len(candidates) > wanted:
+            # Top-k senza ordinare tutto il catalogo
+            top = np.argpartition(-scores[candidates], wanted - 1)[:wanted]
+            candidates = candidates[top]
+        ranked = candidates[np.argsort(-scores[candidates], kind="stable")][offset:wanted]
+        return [(self.products[i], float(scores[i])) for i in ranked]
@@ -0,0 +1,92 @@
+"""Contesto per sessione MCP, usato solo in modalità stateful (`MCP_STATEFUL=1`).
+
+In modalità stateless ogni chiamata rilegge `proj`, risolve il modulo del
+progetto e riceve di nuovo carrello e prodotti già visti. Con sessioni MCP
+(header `mcp-session-id`) il server tiene per sessione:
+- il progetto risolto e il suo modulo database, più lista tool e prompt di `min`;
+- gli ultimi risultati di carousel/list, con un `result_id` che il modello può
+  passare a `compare_enrich` e `products_by_ids` al posto degli id;
+- l'ultimo carrello ricevuto, riusato quando una chiamata non lo rimanda.
+
+Le sessioni stanno in una cache del registro (budget di memoria comune) e
+scadono dopo `idle_seconds` senza richieste.
+"""
+
+from __future__ import annotations
+
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List
+
+# Campi tenuti per ogni prodotto di un risultato: bastano per riferirsi ai prodotti.
+RESULT_FIELDS = ("id", "name", "brand", "categories", "price")
+
+
+@dataclass
+class SessionContext:
+    session_id: str
+    project: str
+    db: Any
+    last_seen: float = field(default_factory=time.monotonic)
+    results: "OrderedDict[str, List[Dict[str, Any]]]" = field(default_factory=OrderedDict)
+    cart: List[Dict[str, Any]] = field(default_factory=list)
+    tools: Any = None
+    prompts: Any = None
+    _result_seq: int = 0
+
+    def add_result(self, products: List[Any], max_results: int) -> str:
+        """Memorizza i prodotti mostrati (campi essenziali) e ne restituisce il `result_id`."""
+        self._result_seq += 1
+        result_id = f"r{self._result_seq}"
+        self.results[result_id] = [
+            {name: getattr(p, name, None) if not isinstance(p, dict) else p.get(name) for name in RESULT_FIELDS}
+            for p in products
+        ]
+        while len(self.results) > max_results:
+            self.results.popitem(last=False)
+        return result_id
+
+    def result_ids(self, result_id: str) -> List[Any] | None:
+        rows = self.results.get(str(result_id))
+        return None if rows is None else [row["id"] for row in rows]
+
+
+class SessionStore:
+    def __init__(self, cache: Any, idle_seconds: float = 1800.0, max_results: int = 8):
+        self._cache = cache
+        self.idle_seconds = idle_seconds
+        self.max_results = max_results
+        self.stats: Dict[str, int] = {"created": 0, "reused": 0, "expired": 0}
+
+    def get(self, session_id: str, project: str, resolve: Callable[[str], Any]) -> SessionContext:
+        """Contesto della sessione; nuovo se assente, scaduto o di un altro progetto."""
+        now = time.monotonic()
+        context = self._cache.get(session_id)
+        if context is not None and (now - context.last_seen > self.idle_seconds or context.project != project):
+            self._cache.pop(session_id)  # tolta subito: _sweep non la conta una seconda volta
+            self.stats["expired"] += 1
+            context = None
+        if context is None:
+            self._sweep(now)
+            context = SessionContext(session_id, project, resolve(project))
+            self._cache.set(session_id, context)
+            self.stats["created"] += 1
+        else:
+            self.stats["reused"] += 1
+        context.last_seen = now
+        return context
+
+    def save(self, context: SessionContext) -> None:
+        """Da chiamare dopo aver aggiunto risultati o carrello: aggiorna la dimensione nel budget."""
+        self._cache.set(context.session_id, context)
+
+    def _sweep(self, now: float) -> None:
+        for session_id in self._cache:
+            context = self._cache.peek(session_id)
+            if context is not None and now - context.last_seen > self.idle_seconds:
+                self._cache.pop(session_id)
+                self.stats["expired"] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"active": len(self._cache), "idle_seconds": self.idle_seconds, **self.stats}
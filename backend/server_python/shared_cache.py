@@ -0,0 +1,198 @@
+"""Cache chiave/valore condivisa tra i worker, su un file SQLite locale.
+
+Con `WEB_CONCURRENCY` > 1 ogni worker uvicorn è un processo separato: una
+cache solo in memoria andrebbe riscaldata N volte. Qui i valori (JSON) stanno
+in un file SQLite in WAL, così quello che un worker calcola (categorie,
+risultati prodotti, ricette, risposte LLM) è subito disponibile agli altri.
+
+Senza percorso (`SHARED_CACHE_PATH=off`, default con un solo worker) si ripiega
+su una cache in memoria del processo: quella passata come `memory` (in main.py
+registrata nel budget comune, vedi cache_registry.py) oppure una propria con
+budget fisso. La cache è best-effort: un errore SQLite (file bloccato, disco
+pieno) vale come miss e non fa mai fallire la richiesta.
+
+Dall'event loop si usano `aget`/`aget_with_age`/`aset`: attese sul lock SQLite,
+codifica JSON e decodifica dei valori grandi girano in un thread.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterable, Tuple
+
+try:
+    from .cache_registry import CacheRegistry
+except ImportError:  # avvio come script (python main.py)
+    from cache_registry import CacheRegistry
+
+# Budget del ripiego in memoria quando non si passa una cache (byte).
+_MEMORY_MAX_BYTES = 64 * 2**20
+# In memoria, JSON fino a questa dimensione si decodifica sul loop: un thread costerebbe di più.
+_INLINE_JSON_BYTES = 64 * 1024
+
+
+def _json_default(value: Any) -> Any:
+    if hasattr(value, "item"):  # scalari numpy da fetchdf()
+        return value.item()
+    if hasattr(value, "__dataclass_fields__"):
+        return {name: getattr(value, name) for name in value.__dataclass_fields__}
+    return str(value)
+
+
+def entry_size(entry: Tuple[str, float, float]) -> int:
+    """Byte di una voce in memoria (payload JSON, timestamp, tupla e chiave)."""
+    return len(entry[0]) + 200
+
+
+def make_key(*parts: Any) -> str:
+    """Chiave compatta e stabile da argomenti arbitrari (dict ordinati)."""
+    raw = json.dumps(parts, sort_keys=True, default=_json_default)
+    return hashlib.sha256(raw.encode()).hexdigest()[:32]
+
+
+class SharedCache:
+    def __init__(self, path: str | None, default_ttl: float = 300.0, memory: Any = None):
+        self.path = path
+        self.default_ttl = default_ttl
+        self._local = threading.local()
+        self._writes = 0
+        # (namespace, chiave) -> (payload, stored, expires); LRU con limite in byte
+        if memory is None:  # non `or`: una BoundedCache vuota è falsa
+            memory = CacheRegistry(_MEMORY_MAX_BYTES).register("shared_cache", sizeof=entry_size)
+        self._memory = memory
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "errors": 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, name: str) -> None:
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS cache (namespace TEXT NOT NULL, key TEXT NOT NULL, "
+                "value TEXT NOT NULL, stored REAL NOT NULL, expires REAL NOT NULL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _read(self, namespace: str, key: str, now: float) -> Tuple[str, float] | None:
+        if not self.path:
+            entry = self._memory.get((namespace, key))
+            if entry is None or entry[2] <= now:
+                return None
+            return entry[0], entry[1]
+        return self._connection().execute(
+            "SELECT value, stored FROM cache WHERE namespace = ? AND key = ? AND expires > ?",
+            (namespace, key, now),
+        ).fetchone()
+
+    def _write(self, namespace: str, key: str, payload: str, now: float, expires: float) -> None:
+        if not self.path:
+            self._memory.set((namespace, key), (payload, now, expires))
+            return
+        conn = self._connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO cache (namespace, key, value, stored, expires) VALUES (?, ?, ?, ?, ?)",
+            (namespace, key, payload, now, expires),
+        )
+        self._writes += 1
+        if self._writes % 500 == 0:
+            conn.execute("DELETE FROM cache WHERE expires <= ?", (now,))
+
+    def _lookup(self, namespace: str, key: str) -> Tuple[str | None, float]:
+        """(payload JSON, età in secondi) oppure (None, inf) se assente o scaduto."""
+        now = time.time()
+        try:
+            row = self._read(namespace, key, now)
+        except sqlite3.Error as exc:
+            self._count("errors")
+            print(f"Shared cache read failed: {exc}")
+            return None, float("inf")
+        if row is None:
+            self._count("misses")
+            return None, float("inf")
+        self._count("hits")
+        return row[0], now - row[1]
+
+    def get_with_age(self, namespace: str, key: str) -> Tuple[Any, float]:
+        """(valore, età in secondi) oppure (None, inf) se assente o scaduto."""
+        payload, age = self._lookup(namespace, key)
+        return (json.loads(payload) if payload is not None else None), age
+
+    def get(self, namespace: str, key: str, max_age: float | None = None) -> Any:
+        value, age = self.get_with_age(namespace, key)
+        if max_age is not None and age > max_age:
+            return None
+        return value
+
+    def set(self, namespace: str, key: str, value: Any, ttl: float | None = None) -> None:
+        if value is None:
+            return
+        now = time.time()
+        expires = now + (ttl if ttl is not None else self.default_ttl)
+        try:
+            self._write(namespace, key, json.dumps(value, default=_json_default), now, expires)
+            self._count("writes")
+        except (sqlite3.Error, TypeError, ValueError) as exc:
+            self._count("errors")
+            print(f"Shared cache write failed: {exc}")
+
+    def get_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """Valori presenti tra `keys` (le chiavi mancanti o scadute sono omesse)."""
+        found = {}
+        for key in keys:
+            value = self.get(namespace, key)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set_many(self, namespace: str, items: Dict[str, Any], ttl: float | None = None) -> None:
+        for key, value in items.items():
+            self.set(namespace, key, value, ttl)
+
+    async def aget_with_age(self, namespace: str, key: str) -> Tuple[Any, float]:
+        """Come `get_with_age`, dall'event loop."""
+        if self.path:
+            return await asyncio.to_thread(self.get_with_age, namespace, key)
+        payload, age = self._lookup(namespace, key)
+        if payload is None:
+            return None, age
+        if len(payload) > _INLINE_JSON_BYTES:
+            return await asyncio.to_thread(json.loads, payload), age
+        return json.loads(payload), age
+
+    async def aget(self, namespace: str, key: str, max_age: float | None = None) -> Any:
+        value, age = await self.aget_with_age(namespace, key)
+        if max_age is not None and age > max_age:
+            return None
+        return value
+
+    async def aset(self, namespace: str, key: str, value: Any, ttl: float | None = None) -> None:
+        """Come `set`, dall'event loop: le scritture seguono un miss, il thread costa poco."""
+        if value is None:
+            return
+        await asyncio.to_thread(self.set, namespace, key, value, ttl)
+
+    async def aget_many(self, namespace: str, keys: Iterable[str]) -> Dict[str, Any]:
+        """Come `get_many`, dall'event loop: un solo passaggio di thread per tutte le chiavi."""
+        if self.path:
+            return await asyncio.to_thread(self.get_many, namespace, list(keys))
+        return self.get_many(namespace, keys)
+
+    async def aset_many(self, namespace: str, items: Dict[str, Any], ttl: float | None = None) -> None:
+        await asyncio.to_thread(self.set_many, namespace, items, ttl)
+
+    def snapshot(self) -> dict:
+        with self._stats_lock:
+            return {"path": self.path or "memory", **self.stats}
@@ -0,0 +1,6 @@
+"""I test importano i moduli del server come fa main.py eseguito dalla sua cartella."""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,29 @@
+import asyncio
+
+import admission
+
+
+def test_untrusted_names_share_one_bucket():
+    controller = admission.AdmissionController(
+        max_in_flight=8,
+        max_queue=8,
+        queue_timeout=1,
+        tool_limits={"compare_enrich": 2},
+        project_limit=4,
+        tools=["carousel", "compare_enrich"],
+        projects=["gdo", "electronics"],
+    )
+
+    async def scenario() -> dict:
+        for i in range(1000):
+            async with controller.admit(f"tool-{i}", f"proj-{i}"):
+                pass
+        async with controller.admit("compare_enrich", "gdo"):
+            async with controller.admit("no-such-tool", "no-such-project"):
+                return controller.snapshot()
+
+    snapshot = asyncio.run(scenario())
+    assert set(controller._per_project) == {"gdo", admission.UNKNOWN}
+    assert set(controller._per_tool) == {"compare_enrich"}
+    assert snapshot["in_flight_by_tool"] == {"compare_enrich": 1, admission.UNKNOWN: 1}
+    assert controller.snapshot()["in_flight_by_tool"] == {}
@@ -0,0 +1,91 @@
+import os
+import time
+
+import duckdb
+import pytest
+
+import catalog_ingest
+
+# Budget del benchmark da 1M righe (secondi), alzabile su macchine lente.
+INGEST_BUDGET = float(os.getenv("INGEST_BUDGET_SECONDS", "60"))
+
+FULL = "id,name,brand,categories,price,description,image\n1,A,BA,C1,10.5,dA,ia\n2,B,BB,C1,20,dB,ib\n3,C,BC,C2,30,dC,ic\n"
+PARTIAL = "id,name,price\n2,B2,21\n4,New,5\n"
+
+
+def _rows(uri: str, columns: str = "id, name, brand, price, description", order: str = "ORDER BY id") -> list:
+    scheme, _, location = uri.partition(":")
+    if scheme == "parquet":
+        return duckdb.execute(f"SELECT {columns} FROM read_parquet('{location}/*.parquet') {order}").fetchall()
+    with duckdb.connect(location, read_only=True) as con:
+        return con.execute(f"SELECT {columns} FROM products {order}").fetchall()
+
+
+@pytest.fixture(params=["parquet", "duckdb"])
+def target(request, tmp_path):
+    (tmp_path / "full.csv").write_text(FULL)
+    (tmp_path / "partial.csv").write_text(PARTIAL)
+    location = tmp_path / ("catalog" if request.param == "parquet" else "catalog.duckdb")
+    uri = f"{request.param}:{location}"
+    catalog_ingest.main([str(tmp_path / "full.csv"), "--target", uri])
+    return uri, tmp_path
+
+
+def test_partial_csv_updates_only_its_columns_and_rows(target):
+    uri, tmp_path = target
+    catalog_ingest.main([str(tmp_path / "partial.csv"), "--target", uri])
+    assert _rows(uri) == [
+        (1, "A", "BA", 10.5, "dA"),
+        (2, "B2", "BB", 21.0, "dB"),
+        (3, "C", "BC", 30.0, "dC"),
+        (4, "New", None, 5.0, None),
+    ]
+
+
+def test_delete_missing_is_opt_in(target):
+    uri, tmp_path = target
+    catalog_ingest.main([str(tmp_path / "partial.csv"), "--target", uri, "--delete-missing"])
+    assert [row[0] for row in _rows(uri)] == [2, 4]
+
+
+def test_ids_keep_the_catalog_type(target):
+    uri, tmp_path = target
+    (tmp_path / "zeros.csv").write_text("id,name,price\n0003,C3,31\nabc,Bad,1\n")
+    catalog_ingest.main([str(tmp_path / "zeros.csv"), "--target", uri])
+    assert _rows(uri, "typeof(id)")[0] == ("BIGINT",)
+    # "0003" è l'id intero 3; "abc" non può esserlo e viene scartato.
+    assert _rows(uri, "id, name") == [(1, "A"), (2, "B"), (3, "C3")]
+
+
+def test_million_row_ingest(tmp_path, capsys):
+    rows = 1_000_000
+    csv = tmp_path / "products.csv"
+    duckdb.execute(
+        f"""
+        COPY (
+            SELECT i AS id, 'Prodotto ' || i AS name, 'Brand ' || (i % 300) AS brand,
+                   'Categoria ' || (i % 120) AS categories, 1 + (i % 900) * 0.75 AS price,
+                   'Descrizione ' || i AS description, 'https://img/' || i || '.jpg' AS image
+            FROM range({rows}) t(i)
+        ) TO '{csv}' (HEADER)
+        """
+    )
+    # Aggiornamento parziale: solo i prezzi dell'1% dei prodotti.
+    prices = tmp_path / "prices.csv"
+    duckdb.execute(
+        f"COPY (SELECT i AS id, 2 + (i % 900) * 0.75 AS price, 'Prodotto ' || i AS name FROM range(0, {rows}, 100) t(i)) "
+        f"TO '{prices}' (HEADER)"
+    )
+    uri = f"parquet:{tmp_path / 'catalog'}"
+    timings = {}
+    for label, path in (("initial load", csv), ("unchanged reload", csv), ("1% price update", prices)):
+        started = time.perf_counter()
+        catalog_ingest.main([str(path), "--target", uri])
+        timings[label] = time.perf_counter() - started
+    output = capsys.readouterr().out
+    with capsys.disabled():
+        print("\n" + ", ".join(f"{label} {seconds:.1f}s" for label, seconds in timings.items()))
+    assert "Catalog already up to date" in output
+    assert "~10000 changed, -0 removed" in output
+    assert _rows(uri, "count(*), count(description)", order="") == [(rows, rows)]
+    assert sum(timings.values()) < INGEST_BUDGET
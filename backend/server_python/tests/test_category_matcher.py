@@ -0,0 +1,81 @@
+import itertools
+import time
+
+import category_matcher
+import main
+
+
+def test_same_stem_prefers_unstemmed_form():
+    matcher = category_matcher.CategoryMatcher(["Pasta", "Paste", "Latte", "Latta"])
+    assert matcher.match("pasta")[0] == "Pasta"
+    assert matcher.match("paste")[0] == "Paste"
+    assert matcher.match("latte")[0] == "Latte"
+    assert matcher.match("milk")[0] == "Latte"
+    assert matcher.match("latta")[0] == "Latta"
+    assert len(matcher) == 4
+
+
+def _catalog_categories(count: int) -> list:
+    heads = [
+        "Pasta", "Paste", "Latte", "Latta", "Formaggi", "Salumi", "Pomodori", "Olio", "Aceto", "Farina",
+        "Zucchero", "Biscotti", "Caffè", "Tè", "Acqua", "Vino", "Birra", "Succhi", "Uova", "Pane",
+        "Riso", "Legumi", "Surgelati", "Gelati", "Carne", "Pesce", "Frutta", "Verdura", "Snack", "Dolci",
+    ]
+    modifiers = [
+        "", "fresca", "secca", "biologica", "integrale", "senza glutine", "da forno", "in scatola",
+        "ripiena", "al naturale", "light", "per bambini", "gourmet", "surgelata", "UHT", "di montagna",
+    ]
+    brands_like = ["", "e condimenti", "e derivati", "speciali", "tipici regionali", "internazionali", "premium"]
+    names = (" ".join(p for p in parts if p) for parts in itertools.product(heads, modifiers, brands_like))
+    return list(itertools.islice(dict.fromkeys(names), count))
+
+
+def test_full_category_list_benchmark():
+    # Benchmark: ~3000 categorie (ordine di grandezza del catalogo gdo), 300 ingredienti misti it/en.
+    categories = _catalog_categories(3000)
+    started = time.perf_counter()
+    matcher = category_matcher.CategoryMatcher(categories)
+    build = time.perf_counter() - started
+    ingredients = [
+        "200 g di pasta", "spaghetti", "milk", "latte intero", "2 eggs", "parmesan cheese", "olio extravergine",
+        "chopped tomatoes", "farina 00", "zucchero di canna", "salt", "vino bianco", "riso carnaroli",
+        "ceci in scatola", "frozen peas", "biscotti integrali", "caffè macinato", "pane raffermo",
+        "pecorino romano", "guanciale", "black pepper", "butter", "chicken stock", "succo di limone",
+        "gelato alla vaniglia", "yogurt", "prosciutto crudo", "salmone affumicato", "frutta secca", "acqua frizzante",
+    ] * 10
+    started = time.perf_counter()
+    matched = [matcher.match(name)[0] for name in ingredients]
+    per_match_ms = (time.perf_counter() - started) * 1000 / len(ingredients)
+    print(f"{len(matcher)} categories: build {build * 1000:.0f} ms, {per_match_ms:.2f} ms per ingredient")
+    assert sum(m is not None for m in matched) > len(ingredients) * 0.6
+    assert per_match_ms < 5
+
+
+def test_size_words_are_kept_outside_the_food_vocabulary():
+    categories = ["Small Appliances", "Large Appliances", "Red Wine"]
+    normalizer = category_matcher.CategoryNormalizer(categories)
+    assert normalizer.normalize(["small appliances"]) == (["Small Appliances"], [])
+    assert normalizer.normalize(["Large appliance"]) == (["Large Appliances"], [])
+    # Senza glossario alimentare "wine" non diventa "vino".
+    assert normalizer.normalize(["vino rosso"]) == ([], ["vino rosso"])
+
+
+def test_food_vocabulary_translates_and_drops_recipe_words():
+    normalizer = category_matcher.CategoryNormalizer(["Uova", "Pomodori"], food_vocabulary=True)
+    assert normalizer.normalize(["eggs", "fresh tomatoes"]) == (["Uova", "Pomodori"], [])
+
+
+def test_same_stem_categories_prefer_the_exact_form():
+    categories = ["Latte", "Latta", "Pasta", "Paste", "Pane", "Pani"]
+    normalizer = category_matcher.CategoryNormalizer(categories, food_vocabulary=True)
+    assert normalizer.normalize(["Latte"]) == (["Latte"], [])
+    assert normalizer.normalize(["pasta"]) == (["Pasta"], [])
+    assert normalizer.normalize(["pane"]) == (["Pane"], [])
+    assert normalizer.normalize(["milk", "PANI"]) == (["Latte", "Pani"], [])
+    # Nessuna forma esatta: tutte le categorie con la stessa radice.
+    assert normalizer.normalize(["pasti"]) == (["Pasta", "Paste"], [])
+
+
+def test_only_gdo_uses_the_food_vocabulary():
+    enabled = {p for p in main.PROJECTS if main.get_object_by_project(p, "database").CATALOG.config.food_vocabulary}
+    assert enabled == {"gdo"}
@@ -0,0 +1,93 @@
+import asyncio
+
+import mcp.types as types
+
+import catalog
+import cross_sell
+import main
+
+
+def _product(product_id, name, brand, category, price):
+    return catalog.Product(
+        id=product_id, name=name, brand=brand, categories=category, price=price, rate=4.0, description="", image=""
+    )
+
+
+def _grocery():
+    """Catalogo da supermercato: nessuna parola di elettronica."""
+    rows = [
+        ("Pasta", ["Spaghetti", "Penne rigate", "Fusilli", "Rigatoni"], ["Barilla", "De Cecco"], 0.9),
+        ("Sughi pronti", ["Sugo al pomodoro", "Pesto alla genovese", "Sugo per pasta all'arrabbiata"], ["Barilla", "Mutti"], 1.8),
+        ("Formaggi", ["Parmigiano Reggiano", "Pecorino romano", "Grana Padano"], ["Zanetti"], 4.5),
+        ("Detersivi", ["Detersivo lavatrice", "Ammorbidente", "Sgrassatore"], ["Dash", "Dixan"], 6.0),
+        ("Acqua", ["Acqua naturale", "Acqua frizzante"], ["Levissima", "Sant'Anna"], 0.4),
+    ]
+    products = []
+    for category, names, brands, price in rows:
+        for i in range(12):
+            products.append(
+                _product(len(products), f"{names[i % len(names)]} {brands[i % len(brands)]}", brands[i % len(brands)], category, price + i * 0.1)
+            )
+    return products
+
+
+def test_grocery_cart_gets_complements_from_related_categories():
+    products = _grocery()
+    index = cross_sell.CrossSellIndex(products)
+    spaghetti = products[0]
+    suggestions = index.recommend([{"id": str(spaghetti.id), "name": spaghetti.name}], 4)
+    assert suggestions
+    by_id = {str(p.id): p for p in products}
+    categories = {by_id[s["id"]].categories for s in suggestions}
+    assert "Pasta" not in categories  # alternative, non complementi
+    assert by_id[suggestions[0]["id"]].categories == "Sughi pronti"
+    assert all(s["tags"] == ["recommended"] and 0 <= s["priority"] <= 100 for s in suggestions)
+
+
+def test_cart_item_outside_the_catalog_is_placed_by_its_words():
+    index = cross_sell.CrossSellIndex(_grocery())
+    suggestions = index.recommend([{"id": "esterno-1", "name": "Fusilli integrali 500g"}], 4)
+    assert suggestions and all(not s["name"].startswith(("Fusilli", "Spaghetti")) for s in suggestions)
+
+
+def test_indexes_are_built_at_startup_for_every_project(monkeypatch):
+    products = _grocery()
+    built = []
+
+    def build(project):
+        built.append(project)
+        return cross_sell.CrossSellIndex(products)
+
+    monkeypatch.setattr(main, "_build_cross_sell_index", build)
+    monkeypatch.setattr(main, "_session_context", lambda: None)
+    for project in main.PROJECTS:
+        main._cross_sell_indexes.pop(project)
+
+    async def scenario():
+        refresher = asyncio.ensure_future(main._keep_cross_sell_indexes_fresh())
+        while len(built) < len(main.PROJECTS):
+            await asyncio.sleep(0.01)
+        await asyncio.sleep(0.05)
+        # La prima chiamata di ogni progetto trova l'indice pronto, senza altre build.
+        results = {}
+        for project in sorted(main.PROJECTS):
+            monkeypatch.setattr(main, "get_current_query_params", lambda project=project: {"proj": project})
+            request = types.CallToolRequest(
+                method="tools/call",
+                params=types.CallToolRequestParams(
+                    name="cross_sell_recommendations", arguments={"cartItems": [{"id": "0", "name": "Spaghetti"}]}
+                ),
+            )
+            results[project] = (await main._dispatch_tool_request(request)).root
+        refresher.cancel()
+        return results
+
+    try:
+        results = asyncio.run(scenario())
+    finally:
+        for project in main.PROJECTS:
+            main._cross_sell_indexes.pop(project)
+    assert sorted(built) == sorted(main.PROJECTS)
+    for project, result in results.items():
+        assert not result.isError, project
+        assert result.structuredContent["suggestions"], project
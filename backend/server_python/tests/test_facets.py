@@ -0,0 +1,93 @@
+import asyncio
+import os
+import time
+
+import duckdb
+import mcp.types as types
+
+import catalog
+import facets
+
+# Costo in più (ms, p50) di `facets: true` su una chiamata carousel, alzabile su macchine lente.
+FACET_OVERHEAD_BUDGET_MS = float(os.getenv("FACET_OVERHEAD_BUDGET_MS", "15"))
+
+
+def test_price_filters_match_sql_to_the_cent(tmp_path):
+    directory = tmp_path / "catalog"
+    directory.mkdir()
+    duckdb.execute(
+        f"""
+        COPY (
+            SELECT * FROM (VALUES (1, 'Cuffie', 'Acme', 9.99), (2, 'Cuffie', 'Acme', 10.0), (3, 'Cuffie', 'Acme', 10.5),
+                                  (4, 'Mouse', 'Zeta', 4.99), (5, 'Mouse', 'Zeta', 5.0))
+                t(id, categories, brand, price)
+        ) TO '{directory / "products.parquet"}' (FORMAT parquet)
+        """
+    )
+    db = catalog.Catalog(catalog.CatalogConfig(project="test", database="test"), catalog.ParquetBackend(str(directory)))
+    index = facets.FacetIndex(db.facet_rows())
+    for bounds in ({"max_price": 10}, {"min_price": 10.25}, {"min_price": 5, "max_price": 10.5}, {"max_price": 4.99}):
+        expected = len(db.search(bounds))
+        assert index.compute(bounds)["total"] == expected, bounds
+    histogram = {band["min"]: band["count"] for band in index.compute({})["price"]}
+    assert histogram == {0: 1, 5: 2, 10: 2}
+
+
+def test_carousel_facets_overhead_benchmark(tmp_path, monkeypatch):
+    # Benchmark: carousel con e senza `facets` su ~150k prodotti (ordine di grandezza del catalogo
+    # gdo), 400 categorie e 250 brand; filtri diversi a ogni chiamata, così la cache non risponde.
+    import main
+    import shared_cache
+
+    directory = tmp_path / "catalog"
+    directory.mkdir()
+    duckdb.execute(
+        f"""
+        COPY (
+            SELECT i AS id, 'Prodotto ' || i AS name, 'Brand ' || (i % 250) AS brand,
+                   'Categoria ' || (i % 400) AS categories, 0.5 + (i % 2000) * 0.37 AS price, 4.0 AS rate,
+                   'Descrizione del prodotto ' || i AS description, 'https://img.example/' || i || '.jpg' AS image
+            FROM range(150000) t(i)
+        ) TO '{directory / "products.parquet"}' (FORMAT parquet)
+        """
+    )
+    db = main.get_object_by_project("gdo", "database")
+    monkeypatch.setattr(db, "CATALOG", catalog.Catalog(db.CATALOG.config, catalog.ParquetBackend(str(directory))))
+    monkeypatch.setattr(main, "SHARED_CACHE", shared_cache.SharedCache(None))
+    monkeypatch.setattr(main, "get_current_query_params", lambda: {"proj": "gdo"})
+    monkeypatch.setattr(main, "_session_context", lambda: None)
+    for cache in (main._facet_indexes, main._category_normalizers):
+        cache.pop("gdo")
+
+    def carousel(i: int, with_facets: bool) -> float:
+        # Categoria diversa nelle due serie: la cache dei prodotti ignora `facets`.
+        category = f"Categoria {(i + 200 * with_facets) % 400}"
+        arguments = {"category": [category], "max_price": 100 + i, "limit": 12}
+        if with_facets:
+            arguments["facets"] = True
+        request = types.CallToolRequest(
+            method="tools/call", params=types.CallToolRequestParams(name="carousel", arguments=arguments)
+        )
+        started = time.perf_counter()
+        result = asyncio.run(main._dispatch_tool_request(request)).root
+        elapsed = (time.perf_counter() - started) * 1000
+        assert not result.isError and result.structuredContent["places"]
+        if with_facets:
+            assert result.structuredContent["facets"]["total"] > 0
+        else:
+            assert "facets" not in result.structuredContent
+        return elapsed
+
+    carousel(0, True)  # warm-up: connessione, normalizzatore e indice delle faccette
+    plain, faceted = [], []
+    for i in range(1, 61):
+        plain.append(carousel(i, False))
+        faceted.append(carousel(i, True))
+    plain.sort()
+    faceted.sort()
+    plain_ms, faceted_ms = plain[len(plain) // 2], faceted[len(faceted) // 2]
+    print(
+        f"\ncarousel over 150k products: p50 {plain_ms:.1f} ms plain, {faceted_ms:.1f} ms with facets "
+        f"(+{faceted_ms - plain_ms:.1f} ms)"
+    )
+    assert faceted_ms - plain_ms < FACET_OVERHEAD_BUDGET_MS
@@ -0,0 +1,67 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import pytest
+
+import image_proxy
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\x00" * 1000
+
+
+def _proxy(tmp_path, handler, max_bytes: int = 10 * 2**20) -> image_proxy.ImageProxy:
+    client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return image_proxy.ImageProxy(
+        client_factory=lambda: client,
+        cache=image_proxy.ImageDiskCache(tmp_path, max_bytes=max_bytes),
+        is_safe_url=lambda url: True,
+        max_image_bytes=2**20,
+        ttl_seconds=3600,
+    )
+
+
+def test_svg_is_refused(tmp_path):
+    svg = b'<svg xmlns="http://www.w3.org/2000/svg"><script>alert(1)</script></svg>'
+    proxy = _proxy(tmp_path, lambda request: httpx.Response(200, headers={"content-type": "image/svg+xml"}, content=svg))
+    with pytest.raises(image_proxy.ImageProxyError) as exc:
+        asyncio.run(proxy.get("https://shop.example/logo.svg"))
+    assert exc.value.status_code == 415
+    assert not list(tmp_path.glob("*.bin"))
+
+
+def test_cached_svg_from_older_version_is_not_served(tmp_path):
+    cache = image_proxy.ImageDiskCache(tmp_path, max_bytes=2**20)
+    key = cache.key("https://shop.example/logo.svg")
+    (tmp_path / f"{key}.bin").write_bytes(b"<svg/>")
+    (tmp_path / f"{key}.json").write_text('{"content_type": "image/svg+xml"}')
+    assert cache.get(key) is None
+
+
+def test_concurrent_puts_of_same_key(tmp_path):
+    cache = image_proxy.ImageDiskCache(tmp_path, max_bytes=2**20)
+    key = cache.key("https://shop.example/a.png")
+    with ThreadPoolExecutor(8) as pool:
+        results = list(pool.map(lambda i: cache.put(key, PNG + bytes([i]), "image/png"), range(64)))
+    assert all(r.path.exists() for r in results)
+    assert not list(tmp_path.glob("*.tmp"))
+    assert cache.read(cache.get(key)) in {PNG + bytes([i]) for i in range(64)}
+
+
+def test_read_refetches_evicted_image(tmp_path):
+    calls = []
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(request.url)
+        return httpx.Response(200, headers={"content-type": "image/png"}, content=PNG)
+
+    proxy = _proxy(tmp_path, handler)
+
+    async def scenario() -> bytes:
+        image = await proxy.get("https://shop.example/a.png")
+        image.path.unlink()  # come se l'LRU di un altro worker l'avesse appena rimossa
+        (tmp_path / image.path.with_suffix(".json").name).unlink()
+        _, data = await proxy.read("https://shop.example/a.png", None, image)
+        return data
+
+    assert asyncio.run(scenario()) == PNG
+    assert len(calls) == 2
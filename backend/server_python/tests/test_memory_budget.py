@@ -0,0 +1,198 @@
+import gc
+import multiprocessing
+import os
+import sys
+
+import pytest
+
+BUDGET_MB = 64
+# Margine sul budget per ciò che le cache non contano: arene del malloc, costruzione
+# dell'indice successivo mentre il vecchio è ancora in cache, stime approssimate.
+RSS_SLACK = float(os.getenv("MEMORY_STRESS_SLACK", "1.5"))
+PROJECTS = ("bricofer", "electronics", "gdo")
+ROUNDS = 8
+
+
+def _rss_bytes() -> int:
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _write_catalogs(base: str, rows: int) -> None:
+    import duckdb
+
+    for project in PROJECTS:
+        os.makedirs(os.path.join(base, project))
+        duckdb.execute(
+            f"""
+            COPY (
+                SELECT i AS id, 'Prodotto ' || i || ' {project}' AS name, 'Brand ' || (i % 90) AS brand,
+                       'Categoria ' || (i % 150) AS categories, 1 + (i % 700) * 0.85 AS price, 4.5 AS rate,
+                       'Descrizione del prodotto ' || i || ' con dettagli tecnici e materiali' AS description,
+                       'https://img.example/' || i || '.jpg' AS image
+                FROM range({rows}) t(i)
+            ) TO '{os.path.join(base, project, "products.parquet")}' (FORMAT parquet)
+            """
+        )
+
+
+def _fill(main, round_: int) -> None:
+    """Un giro su tutte le cache: indici per progetto e risultati in memoria."""
+    import category_matcher
+    import facets
+
+    for project in PROJECTS:
+        key = (project, round_)
+        db = main.get_object_by_project(project, "database")
+        main._semantic_indexes.set(key, main._build_semantic_index(project))
+        main._cross_sell_indexes.set(key, main._build_cross_sell_index(project))
+        main._facet_indexes.set(key, facets.FacetIndex(db.CATALOG.facet_rows()))
+        categories = db.CATALOG.categories()
+        main._category_normalizers.set(key, category_matcher.CategoryNormalizer(categories))
+        main._category_matchers.set(key, category_matcher.CategoryMatcher(categories))
+        main._additional_information_cache.set(key, categories)
+        for page in range(200):
+            products = db.CATALOG.search({}, limit=24, after_id=page * 24)
+            main.SHARED_CACHE.set("products", f"{project}:{round_}:{page}", products)
+
+
+def _stress(base: str, queue) -> None:
+    sys.stdout = open(os.devnull, "w")  # i build stampano a ogni giro
+    os.environ.update(
+        CACHE_MEMORY_BUDGET_MB=str(BUDGET_MB),
+        CATALOG_URI=f"parquet:{base}/{{project}}",
+        SHARED_CACHE_PATH="off",
+    )
+    import main
+
+    # Warm-up: moduli (numpy, duckdb), connessioni e buffer allocati una volta per processo.
+    _fill(main, -1)
+    for cache in main.CACHES._caches.values():
+        cache.clear()
+    gc.collect()
+    baseline = _rss_bytes()
+    used, rss = [], []
+    for round_ in range(ROUNDS):
+        _fill(main, round_)
+        gc.collect()
+        used.append(main.CACHES.used_bytes)
+        rss.append(_rss_bytes() - baseline)
+    queue.put({"used": used, "rss": rss, "snapshot": main.CACHES.snapshot()})
+
+
+@pytest.mark.skipif(not os.path.exists("/proc/self/statm"), reason="resident memory is read from /proc")
+def test_resident_memory_stays_under_budget(tmp_path):
+    _write_catalogs(str(tmp_path), rows=12_000)
+    context = multiprocessing.get_context("spawn")  # processo pulito: l'RSS non dipende dagli altri test
+    queue = context.Queue()
+    process = context.Process(target=_stress, args=(str(tmp_path), queue))
+    process.start()
+    result = queue.get(timeout=600)
+    process.join(timeout=60)
+    budget = BUDGET_MB * 2**20
+    caches = result["snapshot"]["caches"]
+    print(
+        "\nRSS growth per round (MB): " + ", ".join(f"{r / 2**20:.0f}" for r in result["rss"])
+        + f"; accounted {result['used'][-1] / 2**20:.0f} MB; evictions {result['snapshot']['evictions']}"
+    )
+    assert all(used <= budget for used in result["used"])
+    assert result["snapshot"]["evictions"] > 0
+    assert all(caches[name]["entries"] for name in ("semantic_index", "category_normalizer"))
+    assert max(result["rss"]) < budget * RSS_SLACK
+
+
+def test_unread_entries_age_out_of_high_priority_caches():
+    import cache_registry
+
+    registry = cache_registry.CacheRegistry(10_000)
+    indexes = registry.register("index", priority=60, sizeof=lambda v: 4_000)
+    results = registry.register("results", priority=10, sizeof=lambda v: 1_000)
+    indexes.set("old", "x")
+    indexes.set("hot", "x")
+    for i in range(200):
+        indexes.get("hot")
+        results.set(i, "x")
+    # I risultati escono per primi, ma l'indice che nessuno legge alla fine esce anche lui.
+    assert "hot" in indexes and "old" not in indexes
+    assert registry.used_bytes <= registry.budget_bytes
+    # Una voce appena scritta non sfratta se stessa; oltre il budget non si memorizza.
+    assert results.set("fresh", "x") and "fresh" in results
+    too_big = registry.register("too_big", sizeof=lambda v: 20_000)
+    assert not too_big.set("k", "x")
+
+
+def test_make_room_frees_space_before_a_build():
+    import cache_registry
+
+    registry = cache_registry.CacheRegistry(10_000)
+    indexes = registry.register("index", priority=60, sizeof=lambda v: 6_000)
+    results = registry.register("results", priority=10, sizeof=lambda v: 1_000)
+    indexes.set("a", "x")
+    for i in range(4):
+        results.set(i, "x")
+    indexes.make_room()
+    assert registry.used_bytes + indexes.largest <= registry.budget_bytes
+
+
+def test_shared_cache_uses_the_registered_cache():
+    import cache_registry
+    import shared_cache
+
+    registry = cache_registry.CacheRegistry(2**20)
+    cache = shared_cache.SharedCache(None, memory=registry.register("shared_cache", sizeof=shared_cache.entry_size))
+    cache.set("ns", "k", [1, 2, 3])
+    assert registry.snapshot()["caches"]["shared_cache"]["entries"] == 1
+
+
+def test_catalog_connection_is_reopened_after_recycle_queries(tmp_path):
+    import catalog
+
+    _write_catalogs(str(tmp_path), rows=100)
+    backend = catalog.create_backend(f"parquet:{tmp_path}/gdo")
+    backend.recycle_after = 3
+    databases = []
+    for _ in range(7):
+        with backend.cursor() as cur:
+            assert cur.execute("SELECT count(*) FROM main.products").fetchone()[0] == 100
+            databases.append(backend._connection)
+    assert databases[:3] == [databases[0]] * 3
+    assert databases[3:6] == [databases[3]] * 3 and databases[3] is not databases[0]
+    assert databases[6] is not databases[3]
+    # MotherDuck non si ricicla: ogni riconnessione è un nuovo handshake remoto.
+    assert catalog.create_backend("md:demo").recycle_after == 0
+
+
+def test_catalog_queries_do_not_wait_for_a_reconnect(tmp_path):
+    import threading
+    import time
+
+    import catalog
+
+    _write_catalogs(str(tmp_path), rows=100)
+    backend = catalog.create_backend(f"parquet:{tmp_path}/gdo")
+    backend.recycle_after = 2
+    connect = backend._connect
+    reconnecting = threading.Event()
+
+    def slow_connect():
+        if backend._connection is not None:
+            reconnecting.set()
+            time.sleep(0.5)
+        return connect()
+
+    backend._connect = slow_connect
+
+    def query() -> None:
+        with backend.cursor() as cur:
+            cur.execute("SELECT count(*) FROM main.products").fetchone()
+
+    query()
+    query()
+    recycler = threading.Thread(target=query)
+    recycler.start()
+    assert reconnecting.wait(5)
+    # Mentre un thread apre la connessione nuova, le altre query usano quella attuale.
+    started = time.perf_counter()
+    query()
+    assert time.perf_counter() - started < 0.3
+    recycler.join()
@@ -0,0 +1,77 @@
+import json
+from dataclasses import asdict
+
+import duckdb
+import pytest
+
+import catalog
+
+
+def _parquet_catalog(directory, rows: int) -> catalog.Catalog:
+    directory.mkdir()
+    duckdb.execute(
+        f"""
+        COPY (
+            SELECT i AS id, 'Prodotto ' || i AS name, 'Brand ' || (i % 40) AS brand,
+                   'Categoria ' || (i % 25) AS categories, 1 + (i % 500) * 1.25 AS price, (i % 5) + 0.5 AS rate,
+                   repeat('Descrizione lunga del prodotto. ', 20) AS description, 'https://img/' || i || '.jpg' AS image
+            FROM range({rows}) t(i)
+        ) TO '{directory / "products.parquet"}' (FORMAT parquet)
+        """
+    )
+    return catalog.Catalog(catalog.CatalogConfig(project="test", database="test"), catalog.ParquetBackend(str(directory)))
+
+
+@pytest.fixture(scope="module")
+def catalogs(tmp_path_factory):
+    base = tmp_path_factory.mktemp("catalogs")
+    return {rows: _parquet_catalog(base / str(rows), rows) for rows in (1_000, 200_000)}
+
+
+def _page_bytes(db: catalog.Catalog, limit: int, **kwargs) -> int:
+    products = db.search({}, limit=limit, **kwargs)
+    assert len(products) == limit
+    return len(json.dumps([asdict(p) for p in products]).encode())
+
+
+def test_page_bytes_scale_with_page_size_not_catalog_size(catalogs):
+    small, large = catalogs[1_000], catalogs[200_000]
+    for limit in (5, 50):
+        # Stessa pagina su un catalogo 200 volte più grande: stessi byte, a meno delle cifre degli id.
+        assert _page_bytes(large, limit) <= _page_bytes(small, limit) * 1.05
+    ratio = _page_bytes(large, 50) / _page_bytes(large, 5)
+    assert 8 < ratio < 12
+
+
+def test_compact_projection_shrinks_page(catalogs):
+    db = catalogs[1_000]
+    full = _page_bytes(db, 20)
+    compact = _page_bytes(db, 20, columns=("id", "name", "price", "image"), description_chars=40)
+    assert compact < full / 3
+
+
+def test_keyset_pages_cover_catalog_without_duplicates(catalogs):
+    db = catalogs[1_000]
+    seen, after_id = [], None
+    while True:
+        page = db.search({"category": ["Categoria 3"]}, limit=7, after_id=after_id, columns=("id",))
+        if not page:
+            break
+        seen += [p.id for p in page]
+        after_id = page[-1].id
+    assert seen == sorted(set(seen)) and len(seen) == 40
+
+
+def test_products_by_ids_filters_on_the_native_id_column(catalogs, monkeypatch):
+    db = catalogs[200_000]
+    assert db.id_type() == "BIGINT"
+    queries = []
+    fetch = db._fetch
+    monkeypatch.setattr(db, "_fetch", lambda query, params=(): queries.append((query, params)) or fetch(query, params))
+    products = db.products_by_ids(["150000", 7, "007", "abc", "7"], columns=("id", "name"))
+    assert [p.id for p in products] == [150000, 7]
+    query, params = queries[0]
+    with db.backend.cursor() as cur:
+        plan = "".join(row[1] for row in cur.execute("EXPLAIN " + query, list(params)).fetchall())
+    # Il filtro arriva al lettore Parquet sulla colonna, senza CAST(id AS VARCHAR).
+    assert "CAST(id" not in plan and "150000" in plan
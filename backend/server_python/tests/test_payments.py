@@ -0,0 +1,65 @@
+import asyncio
+import os
+import urllib.error
+import urllib.request
+
+import pytest
+
+import main
+
+# stripe-mock (https://github.com/stripe/stripe-mock): `stripe-mock -http-port 12111`
+STRIPE_MOCK_URL = os.getenv("STRIPE_MOCK_URL", "http://localhost:12111")
+CART = [{"id": "42", "quantity": 1}]
+
+
+def _stripe_mock_running() -> bool:
+    try:
+        urllib.request.urlopen(STRIPE_MOCK_URL + "/v1/payment_intents", timeout=1)
+    except urllib.error.HTTPError:
+        return True  # risponde (401 senza chiave)
+    except OSError:
+        return False
+    return True
+
+
+def test_no_checkout_id_means_no_idempotency_key():
+    assert main._payment_idempotency_key({"cart": CART}, 1999, "eur") is None
+    assert main._payment_idempotency_key({"checkout_id": " ", "cart": CART}, 1999, "eur") is None
+
+
+def test_each_checkout_attempt_gets_its_own_key():
+    first = main._payment_idempotency_key({"checkout_id": "attempt-1", "cart": CART}, 1999, "eur")
+    retry = main._payment_idempotency_key({"checkout_id": "attempt-1", "cart": CART}, 1999, "eur")
+    second = main._payment_idempotency_key({"checkout_id": "attempt-2", "cart": CART}, 1999, "eur")
+    assert first == retry
+    assert second != first
+
+
+@pytest.fixture
+def stripe_mock(monkeypatch):
+    if not _stripe_mock_running():
+        pytest.skip(f"stripe-mock not reachable at {STRIPE_MOCK_URL}")
+    monkeypatch.setenv("STRIPE_API_BASE", STRIPE_MOCK_URL)
+    monkeypatch.setenv("STRIPE_SECRET_KEY", "sk_test_123")
+    monkeypatch.setattr(main, "MOCK_UPSTREAMS", False)
+    main._stripe.cache_clear()
+    main._payment_results.clear()
+    yield
+    main._stripe.cache_clear()
+    main._payment_results.clear()
+
+
+def test_retry_replays_but_new_attempt_pays_again(stripe_mock):
+    async def scenario():
+        retry_key = main._payment_idempotency_key({"checkout_id": "attempt-1", "cart": CART}, 1999, "eur")
+        first = await main._create_payment_intent(1999, "eur", retry_key)
+        retried = await main._create_payment_intent(1999, "eur", retry_key)
+        new_key = main._payment_idempotency_key({"checkout_id": "attempt-2", "cart": CART}, 1999, "eur")
+        second = await main._create_payment_intent(1999, "eur", new_key)
+        anonymous = await main._create_payment_intent(1999, "eur", None)
+        return first, retried, second, anonymous
+
+    first, retried, second, anonymous = asyncio.run(scenario())
+    assert first["payment_intent_id"].startswith("pi_")
+    assert retried["replayed"] and retried["payment_intent_id"] == first["payment_intent_id"]
+    assert not second.get("replayed") and not anonymous.get("replayed")
@@ -0,0 +1,96 @@
+import asyncio
+import time
+
+import pytest
+from starlette.testclient import TestClient
+
+import main
+import profiler
+
+
+def _busy(seconds: float) -> None:
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+async def _tool_call() -> str:
+    _busy(0.05)
+    await asyncio.sleep(0.05)
+    return "ok"
+
+
+def test_folded_stacks_are_written_with_escaped_root(tmp_path):
+    prof = profiler.Profiler(tmp_path, interval=0.001)
+    prof.arm(calls=1)
+    assert prof.should_profile("search;x", "shop one\nproj=evil")
+
+    async def scenario():
+        return await prof.run(_tool_call(), "search;x", "shop one\nproj=evil")
+
+    # asyncio.run attende l'executor, quindi anche la scrittura del file.
+    assert asyncio.run(scenario()) == "ok"
+    lines = prof.path.read_text(encoding="utf8").splitlines()
+    assert lines and prof.stats["profiled"] == 1
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        frames = stack.split(";")
+        assert frames[:2] == ["proj=shop_one_proj=evil", "tool=search:x"]
+        assert int(count) > 0
+    assert any("_tool_call" in line for line in lines)
+    assert any("_busy" in line for line in lines)
+    assert any("[await]" in line for line in lines)
+
+
+def test_arming_expires_after_calls_or_seconds(tmp_path):
+    prof = profiler.Profiler(tmp_path)
+    prof.arm(calls=1)
+    assert prof.should_profile("search", None)
+    assert not prof.should_profile("search", None)
+    assert prof.snapshot()["armed"] is None
+
+    prof.arm(rate=1.0, seconds=0.05, tool="search", project="shop")
+    assert not prof.should_profile("other", "shop")
+    assert prof.should_profile("search", "shop")
+    time.sleep(0.1)
+    assert not prof.should_profile("search", "shop")
+    assert prof.snapshot()["armed"] is None
+
+
+def test_busy_profiler_lets_calls_through(tmp_path):
+    prof = profiler.Profiler(tmp_path, max_active=0)
+    prof.arm(calls=5)
+    assert not prof.should_profile("search", None)
+    assert not prof.should_profile("search", None, forced=True)
+    assert prof.stats["skipped_busy"] == 2
+
+
+@pytest.fixture
+def admin(monkeypatch):
+    monkeypatch.setattr(main, "PROFILER_SECRET", "s3cret")
+    main.PROFILER.disarm()
+    yield TestClient(main.app)
+    main.PROFILER.disarm()
+
+
+def test_admin_profile_requires_the_secret(admin):
+    for headers in ({}, {"Authorization": "Bearer wrong"}, {"Authorization": "s3cret"}):
+        assert admin.post("/admin/profile?calls=3", headers=headers).status_code == 404
+        assert admin.get("/admin/profile", headers=headers).status_code == 404
+    assert main.PROFILER.snapshot()["armed"] is None
+
+    ok = {"Authorization": "Bearer s3cret"}
+    response = admin.post("/admin/profile", json={"calls": 3, "tool": "search"}, headers=ok)
+    assert response.status_code == 200
+    assert response.json()["armed"]["calls"] == 3
+
+    assert admin.delete("/admin/profile", headers={"Authorization": "Bearer wrong"}).status_code == 404
+    assert main.PROFILER.snapshot()["armed"] is not None
+    response = admin.delete("/admin/profile", headers=ok)
+    assert response.status_code == 200 and response.json()["armed"] is None
+
+
+def test_admin_profile_is_off_without_a_secret(admin, monkeypatch):
+    monkeypatch.setattr(main, "PROFILER_SECRET", "")
+    assert admin.post("/admin/profile?calls=3", headers={"Authorization": "Bearer "}).status_code == 404
+    assert main.PROFILER.snapshot()["armed"] is None
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import ratelimit
+
+
+def _scope(peer="10.0.0.1", forwarded=None, session=None, proj=None) -> dict:
+    headers = []
+    if forwarded:
+        headers.append((b"x-forwarded-for", forwarded.encode()))
+    if session:
+        headers.append((b"mcp-session-id", session.encode()))
+    return {
+        "type": "http",
+        "method": "POST",
+        "path": "/mcp",
+        "headers": headers,
+        "client": (peer, 1234),
+        "query_string": f"proj={proj}".encode() if proj else b"",
+    }
+
+
+def test_client_key_ignores_spoofable_inputs():
+    limiter = ratelimit.RateLimiter(ratelimit.InMemoryBucketStore(), {}, key_by="session", projects=["gdo"])
+    assert limiter.client_key(_scope(forwarded="1.2.3.4", session="made-up")) == "ip:10.0.0.1"
+    behind_proxy = ratelimit.RateLimiter(ratelimit.InMemoryBucketStore(), {}, trusted_proxies=1)
+    # Il client scrive "1.2.3.4", il proxy fidato aggiunge a destra il vero indirizzo.
+    assert behind_proxy.client_key(_scope(peer="10.9.9.9", forwarded="1.2.3.4, 203.0.113.7")) == "ip:203.0.113.7"
+    by_proj = ratelimit.RateLimiter(ratelimit.InMemoryBucketStore(), {}, key_by="proj", projects=["gdo"])
+    assert by_proj.client_key(_scope(proj="gdo")) == "proj:gdo"
+    assert by_proj.client_key(_scope(proj="random-123")) == "ip:10.0.0.1"
+    stateful = ratelimit.RateLimiter(ratelimit.InMemoryBucketStore(), {}, key_by="session", sessions_validated=True)
+    assert stateful.client_key(_scope(session="abc")) == "session:abc"
+
+
+def test_rejected_batch_spends_no_tokens():
+    limits = {"cheap": ratelimit.Limit(10, 60), "costly": ratelimit.Limit(1, 60)}
+    limiter = ratelimit.RateLimiter(ratelimit.InMemoryBucketStore(), limits)
+
+    async def scenario():
+        assert (await limiter.check(["costly"], _scope()))[0]
+        allowed, _, tool = await limiter.check(["cheap"] * 5 + ["costly"], _scope())
+        assert not allowed and tool == "costly"
+        # I 5 gettoni di "cheap" sono tornati: ne restano 10.
+        assert (await limiter.check(["cheap"] * 10, _scope()))[0]
+
+    asyncio.run(scenario())
+
+
+def test_unregistered_tools_share_the_unknown_bucket():
+    limits = {"*": ratelimit.Limit(2, 60)}
+    store = ratelimit.InMemoryBucketStore()
+    limiter = ratelimit.RateLimiter(store, limits, tools=["search"])
+
+    async def scenario():
+        assert (await limiter.check(["junk-1"], _scope()))[0]
+        assert (await limiter.check(["junk-2"], _scope()))[0]
+        allowed, _, tool = await limiter.check(["junk-3"], _scope())
+        # Il nome restituito è quello della chiamata, il conteggio sta sotto "unknown".
+        assert not allowed and tool == "junk-3"
+        assert (await limiter.check(["search"], _scope()))[0]
+
+    asyncio.run(scenario())
+    assert limiter.stats["rejected_by_tool"] == {"unknown": 1}
+    assert {key.split("|")[0] for key in store._buckets} == {"unknown", "search"}
+
+
+def test_store_stays_fast_when_full():
+    store = ratelimit.InMemoryBucketStore(max_keys=1000)
+    limit = ratelimit.Limit(5, 60)
+    started = time.perf_counter()
+    for i in range(50_000):
+        store.take(f"t|ip:{i}", limit)
+    assert len(store._buckets) == 1000
+    assert time.perf_counter() - started < 2
+
+
+def test_oversized_body_is_rejected():
+    called = []
+
+    async def app(scope, receive, send):
+        called.append(True)
+
+    middleware = ratelimit.RateLimitMiddleware(
+        app, ratelimit.RateLimiter(ratelimit.InMemoryBucketStore(), {"*": ratelimit.Limit(1, 60)})
+    )
+    chunk = json.dumps({"jsonrpc": "2.0", "method": "tools/call", "params": {"name": "x"}}).encode()
+    chunks = [chunk + b" " * 65536] * 20
+    sent = []
+
+    async def receive():
+        body = chunks.pop(0)
+        return {"type": "http.request", "body": body, "more_body": bool(chunks)}
+
+    async def send(message):
+        sent.append(message)
+
+    asyncio.run(middleware(_scope(), receive, send))
+    assert not called and sent[0]["status"] == 413
+
+
+_DEFAULT_CONFIG_PROBE = """
+import asyncio, json, main
+
+def scope(session):
+    return {"type": "http", "client": ("203.0.113.9", 1234), "query_string": b"proj=gdo",
+            "headers": [(b"mcp-session-id", session.encode())]}
+
+async def calls():
+    # Due conversazioni dallo stesso IP di uscita, 5 pagamenti ciascuna (limite 5/60).
+    return [(await main.RATE_LIMITER.check(["create_payment_intent"], scope(s)))[0] for s in ("a", "b") for _ in range(5)]
+
+print(json.dumps({"enabled": main.RATE_LIMIT_ENABLED, "key": main.RATE_LIMITER.key_by, "allowed": asyncio.run(calls())}))
+"""
+
+
+def _default_limiter(**env) -> dict:
+    clean = {k: v for k, v in os.environ.items() if not k.startswith(("RATE_LIMIT", "MCP_STATEFUL"))}
+    result = subprocess.run(
+        [sys.executable, "-c", _DEFAULT_CONFIG_PROBE],
+        cwd=Path(__file__).resolve().parent.parent, env={**clean, **env}, capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_sessions_behind_one_egress_ip_do_not_share_a_bucket_by_default():
+    stateless = _default_limiter()
+    assert not stateless["enabled"]
+    stateful = _default_limiter(MCP_STATEFUL="1")
+    assert stateful["enabled"] and stateful["key"] == "session"
+    assert all(stateful["allowed"])
+    # Con RATE_LIMIT_KEY=ip esplicito la seconda conversazione trova il bucket già vuoto.
+    by_ip = _default_limiter(RATE_LIMIT_KEY="ip")
+    assert by_ip["enabled"] and by_ip["allowed"] == [True] * 5 + [False] * 5
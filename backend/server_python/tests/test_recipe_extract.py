@@ -0,0 +1,169 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+
+import httpx
+
+import recipe_extract
+
+# Pagina stile Next.js: CSS inline, menu, commenti, `__NEXT_DATA__` da ~150 KB prima del JSON-LD.
+NEXTJS_PAGE = Path(__file__).parent / "fixtures" / "recipe_nextjs.html"
+
+
+def _large_recipe_page(filler_kb: int, with_json_ld: bool = True) -> str:
+    """Pagina ricetta realistica: menu, commenti, script, testo lungo; JSON-LD in fondo."""
+    block = (
+        '<div class="post"><p>Una ricetta della tradizione, con <a href="/x">link</a>, '
+        "<b>grassetto</b> e <i>corsivo</i> &amp; entità.</p>"
+        '<script>window.dataLayer=window.dataLayer||[];dataLayer.push({"a":1});</script>'
+        '<img src="/img.jpg" alt="foto"><ul><li>voce</li><li>voce</li></ul></div>\n'
+    )
+    filler = block * (filler_kb * 1024 // len(block))
+    recipe = {
+        "@context": "https://schema.org",
+        "@graph": [
+            {"@type": "WebPage", "name": "Carbonara"},
+            {"@type": "Recipe", "name": "Spaghetti alla carbonara", "recipeIngredient": ["320 g di spaghetti", "150 g di guanciale", "4 tuorli", "pecorino q.b."]},
+        ],
+    }
+    json_ld = f'<script type="application/ld+json">{json.dumps(recipe)}</script>' if with_json_ld else ""
+    return f"<html><head><title>Carbonara</title></head><body>{filler}{json_ld}</body></html>"
+
+
+def test_microdata_ingredients_are_split_and_spaced():
+    page = recipe_extract.parse_recipe_html(
+        "<ul><li itemprop=recipeIngredient>200 g <b>pasta</li>"
+        '<li itemprop="recipeIngredient">sale</li>'
+        '<li itemprop="recipeIngredient"><span>2</span> uova</li></ul>'
+    )
+    assert page.microdata_ingredients == ["200 g pasta", "sale", "2 uova"]
+
+
+def test_hostile_pages_are_bounded():
+    for hostile in ("<a " + "x" * 2_000_000, "<" * 2_000_000, "<!--" + "x" * 2_000_000):
+        started = time.perf_counter()
+        recipe_extract.parse_recipe_html(hostile)
+        assert time.perf_counter() - started < recipe_extract.PARSE_BUDGET_SECONDS + 0.5
+
+
+def test_large_page_benchmark():
+    # Benchmark: pagina da ~1.9 MB con la ricetta solo alla fine (caso peggiore realistico).
+    html = _large_recipe_page(1900)
+    started = time.perf_counter()
+    page = recipe_extract.parse_recipe_html(html)
+    elapsed = time.perf_counter() - started
+    print(f"parse of {len(html) / 2**20:.1f} MB page: {elapsed * 1000:.0f} ms")
+    recipe = page.structured_recipe()
+    assert recipe is not None and recipe["title"] == "Spaghetti alla carbonara"
+    assert [i["name"] for i in recipe["ingredients"]][:2] == ["spaghetti", "guanciale"]
+
+
+def test_large_inline_script_before_json_ld():
+    json_ld = '<script type="application/ld+json">{"@type": "Recipe", "name": "Carbonara", "recipeIngredient": ["4 tuorli"]}</script>'
+    for size in (200_000, 600_000):
+        html = (
+            "<html><body><p>prima</p>"
+            f'<script id="__NEXT_DATA__" type="application/json">{{"blob": "{"x" * size}"}}</script>'
+            f"<p>dopo lo script</p>{json_ld}</body></html>"
+        )
+        page = recipe_extract.parse_recipe_html(html)
+        assert page.structured_recipe()["ingredients"] == [{"name": "tuorli", "measure": "4"}]
+        assert "dopo lo script" in page.text
+
+
+def test_realistic_page_fixture():
+    html = NEXTJS_PAGE.read_text(encoding="utf-8")
+    started = time.perf_counter()
+    page = recipe_extract.parse_recipe_html(html)
+    print(f"parse of {len(html) / 1024:.0f} KB Next.js page: {(time.perf_counter() - started) * 1000:.0f} ms")
+    recipe = page.structured_recipe()
+    assert recipe["title"] == "Spaghetti alla carbonara" and recipe["source"] == "json-ld"
+    assert [i["name"] for i in recipe["ingredients"]] == [
+        "spaghetti", "guanciale", "tuorli", "Pecorino Romano DOP", "Pepe nero",
+    ]
+    # Il testo visibile c'è, CSS e script no.
+    assert "Fatta ieri sera" in page.text and "googletag" not in page.text and "margin:" not in page.text
+
+
+def test_fetch_realistic_page():
+    async def scenario() -> recipe_extract.RecipePage:
+        async with _serve(NEXTJS_PAGE.read_text(encoding="utf-8")) as client:
+            return await recipe_extract.fetch_recipe_page(client, "https://example.com/r")
+
+    assert asyncio.run(scenario()).structured_recipe()["title"] == "Spaghetti alla carbonara"
+
+
+def _serve(body: str) -> httpx.AsyncClient:
+    def handler(request: httpx.Request) -> httpx.Response:
+        return httpx.Response(200, headers={"content-type": "text/html; charset=utf-8"}, content=body.encode())
+
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler))
+
+
+def test_fetch_does_not_block_event_loop():
+    async def scenario(body: str) -> float:
+        gaps = []
+
+        async def ticker() -> None:
+            last = time.perf_counter()
+            while True:
+                await asyncio.sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.create_task(ticker())
+        async with _serve(body) as client:
+            await recipe_extract.fetch_recipe_page(client, "https://example.com/r")
+        tick.cancel()
+        return max(gaps, default=0.0)
+
+    for body in ("<" * 2_000_000, _large_recipe_page(1900, with_json_ld=False)):
+        # Il loop resta reattivo (il GIL passa al più ogni switch interval).
+        assert asyncio.run(scenario(body)) < 0.25
+
+
+def test_pasted_html_is_parsed_off_the_event_loop(monkeypatch):
+    import main
+
+    parse = recipe_extract.parse_recipe_html
+
+    def slow_parse(html: str) -> recipe_extract.RecipePage:
+        time.sleep(0.3)  # pagina al limite del budget di parsing
+        return parse(html)
+
+    monkeypatch.setattr(recipe_extract, "parse_recipe_html", slow_parse)
+
+    async def scenario(text: str):
+        gaps = []
+
+        async def ticker() -> None:
+            last = time.perf_counter()
+            while True:
+                await asyncio.sleep(0.005)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        tick = asyncio.create_task(ticker())
+        await asyncio.sleep(0.01)
+        recipe = await main._parse_recipe(text)
+        await asyncio.sleep(0.01)  # il ticker registra l'intervallo in corso
+        tick.cancel()
+        return recipe, max(gaps, default=0.0)
+
+    recipe, gap = asyncio.run(scenario(_large_recipe_page(200)))
+    assert recipe["source"] == "json-ld"
+    assert gap < 0.2
+
+
+def test_fetch_stops_at_json_ld():
+    async def scenario() -> recipe_extract.RecipePage:
+        async with _serve(_large_recipe_page(200) + "<p>coda</p>" * 100_000) as client:
+            return await recipe_extract.fetch_recipe_page(client, "https://example.com/r", max_bytes=4 * 2**20)
+
+    page = asyncio.run(scenario())
+    assert page.structured_recipe()["source"] == "json-ld"
+    # Dopo il JSON-LD si analizza al più il blocco corrente, non le 100k righe di coda.
+    assert page.text.count("coda") < recipe_extract._FEED_CHARS // len("<p>coda</p>")
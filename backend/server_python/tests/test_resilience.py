@@ -0,0 +1,95 @@
+import asyncio
+import threading
+import time
+
+import duckdb
+import httpx
+import pytest
+
+import catalog
+import main
+import resilience
+
+
+def test_timeout_interrupts_query_and_holds_slot_until_thread_ends(tmp_path):
+    backend = catalog.DuckDBFileBackend(str(tmp_path / "empty.duckdb"))
+    duckdb.connect(backend.path).close()
+    breaker = resilience.CircuitBreaker("test", min_timeout=0.3, max_timeout=0.3, interrupt=catalog.interrupt_thread)
+    finished = threading.Event()
+
+    def slow_query() -> None:
+        try:
+            with backend.cursor() as cur:
+                cur.execute("SELECT count(*) FROM range(100000000000) a").fetchall()
+        finally:
+            finished.set()
+
+    started = time.perf_counter()
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(breaker.run_in_thread(slow_query))
+    # Il chiamante riprende solo a thread finito, e la query interrotta finisce subito.
+    assert finished.is_set()
+    assert time.perf_counter() - started < 2
+    assert breaker.snapshot()["timeouts"] == 1
+
+
+def test_metrics_requires_admin_secret(monkeypatch):
+    monkeypatch.setattr(main, "PROFILER_SECRET", "s3cret")
+
+    async def get(headers):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://127.0.0.1") as client:
+            return await client.get("/metrics", headers=headers)
+
+    assert asyncio.run(get({})).status_code == 404
+    assert asyncio.run(get({"Authorization": "Bearer wrong"})).status_code == 404
+    response = asyncio.run(get({"Authorization": "Bearer s3cret"}))
+    assert response.status_code == 200 and "upstreams" in response.json()
+
+
+def test_only_connection_errors_drop_the_shared_connection(tmp_path):
+    backend = catalog.DuckDBFileBackend(str(tmp_path / "empty.duckdb"))
+    duckdb.connect(backend.path).close()
+    with pytest.raises(duckdb.CatalogException):
+        with backend.cursor() as cur:
+            cur.execute("SELECT * FROM missing_table")
+    base = backend._connection
+    assert base is not None
+
+    def interrupted() -> None:
+        with backend.cursor() as cur:
+            threading.Timer(0.2, catalog.interrupt_thread, [threading.get_ident()]).start()
+            cur.execute("SELECT count(*) FROM range(100000000000) a").fetchall()
+
+    with pytest.raises(duckdb.InterruptException):
+        interrupted()
+    assert backend._connection is base
+    with pytest.raises(duckdb.ConnectionException):
+        with backend.cursor():
+            raise duckdb.ConnectionException("connection lost")
+    assert backend._connection is None
+
+
+def test_index_builds_do_not_open_the_search_breaker(monkeypatch):
+    products = [
+        catalog.Product(id=i, name=f"cavo usb {i}", brand="B", categories="Cavi", price=9.0, rate=4.0, description="", image="")
+        for i in range(30)
+    ]
+
+    class FakeCatalog:
+        def search(self, filters, **kwargs):
+            time.sleep(0.02)  # più lento di slow_call_seconds del breaker delle ricerche
+            return products
+
+    class FakeDb:
+        CATALOG = FakeCatalog()
+
+    search = resilience.CircuitBreaker("catalog-test", failure_threshold=1, slow_call_seconds=0.01)
+    bulk = resilience.CircuitBreaker("catalog-bulk-test", failure_threshold=1)
+    monkeypatch.setattr(main, "CATALOG_BREAKER", search)
+    monkeypatch.setattr(main, "CATALOG_BULK_BREAKER", bulk)
+    monkeypatch.setattr(main, "get_object_by_project", lambda project, name: FakeDb())
+    for _ in range(3):
+        assert len(main._build_cross_sell_index("electronics")) == 30
+    assert search.snapshot()["calls"] == 0 and search.state == resilience.CLOSED
+    assert bulk.snapshot()["calls"] == 3 and bulk.state == resilience.CLOSED
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import time
+
+import catalog
+import main
+import semantic_index
+
+# Budget del top-k (ms, p95), alzabile su macchine lente.
+TOPK_BUDGET_MS = float(os.getenv("SEMANTIC_TOPK_BUDGET_MS", "50"))
+WORDS = ["cuffie", "wireless", "gaming", "tastiera", "monitor", "mouse", "tv", "soundbar", "smartphone", "tablet"]
+
+
+def _product(i: int, categories: str = "", brand: str = "", description: str = "") -> catalog.Product:
+    name = f"{WORDS[i % len(WORDS)]} {WORDS[(i * 7) % len(WORDS)]} modello {i}"
+    return catalog.Product(
+        id=i,
+        name=name,
+        brand=brand or f"Brand {i % 50}",
+        categories=categories or f"Categoria {i % 40}",
+        price=5.0 + i % 300,
+        rate=4.0,
+        description=description or f"Descrizione di {name}",
+        image="",
+    )
+
+
+def test_category_is_a_filter_not_a_hint():
+    products = [
+        _product(1, categories="Cuffie", description="cuffie gaming con microfono"),
+        _product(2, categories="Accessori", description="supporto per cuffie gaming"),
+        _product(3, categories="Audio", description="altoparlante"),
+    ]
+    index = semantic_index.SemanticIndex(products, dim=256)
+    assert [p.id for p, _ in index.search("cuffie gaming", 5, categories=["cuffie"])] == [1]
+    # Come MATCH_IN_OR_DESCRIPTION: basta il termine tra spazi nella descrizione.
+    hits = index.search("cuffie gaming", 5, categories=["Cuffie"], category_in_description=True)
+    assert {p.id for p, _ in hits} == {1, 2}
+    assert index.search("cuffie gaming", 5, categories=["Audio"], brand="Brand 1") == []
+
+
+def test_index_over_budget_disables_only_its_project(monkeypatch):
+    monkeypatch.setattr(main, "_semantic_disabled", {})
+    monkeypatch.setattr(main._semantic_indexes, "set", lambda key, value: key != "electronics")
+
+    async def scenario():
+        for project in ("electronics", "gdo"):
+            task = asyncio.ensure_future(asyncio.sleep(0, result=object()))
+            await task
+            main._semantic_build_done(project, task)
+
+    asyncio.run(scenario())
+    assert main.SEMANTIC_SEARCH_ENABLED
+    assert not main._semantic_search_enabled("electronics")
+    assert main._semantic_search_enabled("gdo")
+
+
+def test_topk_latency():
+    products = [_product(i) for i in range(50_000)]
+    started = time.perf_counter()
+    index = semantic_index.SemanticIndex(products)
+    build = time.perf_counter() - started
+    queries = ["cuffie wireless", "tastiera gaming", "monitor per ufficio", "smartphone economico"]
+    timings = []
+    for i in range(200):
+        started = time.perf_counter()
+        hits = index.search(
+            queries[i % len(queries)], 13, brand="Brand 7" if i % 2 else None,
+            max_price=150 if i % 3 else None, categories=["Categoria 5"] if i % 5 == 0 else None,
+        )
+        timings.append((time.perf_counter() - started) * 1000)
+        assert len(hits) <= 13
+    timings.sort()
+    p50, p95 = timings[len(timings) // 2], timings[int(len(timings) * 0.95)]
+    print(f"\nsemantic top-13 over {len(index)} products: p50 {p50:.1f} ms, p95 {p95:.1f} ms (build {build:.1f}s)")
+    assert p95 < TOPK_BUDGET_MS
@@ -0,0 +1,232 @@
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+from typing import Dict, List
+
+import mcp.types as types
+import pytest
+
+import cache_registry
+import main
+import sessions
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(sessions.time, "monotonic", clock)
+    return clock
+
+
+def _store(idle_seconds: float = 60.0, max_results: int = 2) -> sessions.SessionStore:
+    cache = cache_registry.CacheRegistry(2**20).register("sessions")
+    return sessions.SessionStore(cache, idle_seconds=idle_seconds, max_results=max_results)
+
+
+def test_session_is_reused_until_idle_expiry(clock):
+    store = _store()
+    first = store.get("s1", "gdo", lambda project: f"db:{project}")
+    assert first.db == "db:gdo"
+    clock.now += 59
+    assert store.get("s1", "gdo", lambda project: pytest.fail("resolved again")) is first
+    # Ogni richiesta rinnova la scadenza: 59s dopo l'ultima è ancora viva, 61s no.
+    clock.now += 59
+    assert store.get("s1", "gdo", lambda project: pytest.fail("resolved again")) is first
+    clock.now += 61
+    assert store.get("s1", "gdo", lambda project: f"db:{project}") is not first
+    assert store.stats == {"created": 2, "reused": 2, "expired": 1}
+
+
+def test_other_project_gets_a_new_context(clock):
+    store = _store()
+    first = store.get("s1", "gdo", lambda project: project)
+    second = store.get("s1", "electronics", lambda project: project)
+    assert second is not first and second.db == "electronics"
+
+
+def test_idle_sessions_are_swept_when_a_new_one_starts(clock):
+    store = _store()
+    store.get("old", "gdo", lambda project: project)
+    clock.now += 120
+    store.get("new", "gdo", lambda project: project)
+    assert store.snapshot()["active"] == 1 and store.stats["expired"] == 1
+
+
+def test_result_ids_unknown_and_rotated_out(clock):
+    store = _store(max_results=2)
+    context = store.get("s1", "gdo", lambda project: project)
+    first = context.add_result([{"id": 1, "name": "Latte"}, {"id": 2, "name": "Pane"}], store.max_results)
+    second = context.add_result([{"id": 3}], store.max_results)
+    assert context.result_ids(first) == [1, 2]
+    assert context.result_ids("r99") is None
+    # Oltre max_results il risultato più vecchio non è più referenziabile.
+    context.add_result([{"id": 4}], store.max_results)
+    assert context.result_ids(first) is None
+    assert context.result_ids(second) == [3]
+
+
+def _products_by_ids(arguments):
+    request = types.CallToolRequest(
+        method="tools/call", params=types.CallToolRequestParams(name="products_by_ids", arguments=arguments)
+    )
+    return asyncio.run(main._dispatch_tool_request(request)).root
+
+
+@pytest.fixture
+def session(monkeypatch, clock):
+    store = _store()
+    context = store.get("s1", "electronics", lambda project: object())
+    fetched = []
+
+    async def fake_products_by_ids(project, db, ids, columns):
+        fetched.append(list(ids))
+        return {str(i): {"id": str(i)} for i in ids}
+
+    monkeypatch.setattr(main, "SESSIONS", store)
+    monkeypatch.setattr(main, "_session_context", lambda: store.get("s1", "electronics", lambda project: object()))
+    monkeypatch.setattr(main, "_products_by_ids", fake_products_by_ids)
+    context.fetched = fetched
+    return context
+
+
+def test_products_by_ids_resolves_a_result_id(session):
+    result_id = session.add_result([{"id": 7}, {"id": 8}], 2)
+    result = _products_by_ids({"result_id": result_id})
+    assert not result.isError
+    assert [p["id"] for p in result.structuredContent["products"]] == ["7", "8"]
+    assert session.fetched == [[7, 8]]
+
+
+def test_products_by_ids_rejects_unknown_and_expired_result_ids(session, clock):
+    result = _products_by_ids({"result_id": "r42"})
+    assert result.isError and "Unknown or expired result_id" in result.content[0].text
+
+    result_id = session.add_result([{"id": 7}], 2)
+    clock.now += 120  # la sessione scade: il nuovo contesto non conosce il risultato
+    result = _products_by_ids({"result_id": result_id})
+    assert result.isError and "Unknown or expired result_id" in result.content[0].text
+    assert session.fetched == []
+
+
+def test_result_id_without_a_session_is_rejected(monkeypatch):
+    monkeypatch.setattr(main, "_session_context", lambda: None)
+    monkeypatch.setattr(main, "get_current_query_params", lambda: {"proj": "electronics"})
+    result = _products_by_ids({"result_id": "r1"})
+    assert result.isError and "Unknown or expired result_id" in result.content[0].text
+
+
+# Benchmark stateful contro stateless: stesso server (uvicorn, un worker), stesso catalogo
+# Parquet, client concorrenti che ripetono un turno di conversazione.
+BENCH_CLIENTS = int(os.getenv("SESSION_BENCH_CLIENTS", "10"))
+BENCH_TURNS = int(os.getenv("SESSION_BENCH_TURNS", "5"))
+# Chiamate al secondo stateful / stateless sotto cui il test fallisce (rumore di misura incluso).
+BENCH_MIN_RATIO = float(os.getenv("SESSION_BENCH_MIN_RATIO", "0.8"))
+SERVER_DIR = Path(__file__).resolve().parent.parent
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def _conversation(url: str, stateful: bool, latencies: List[float]) -> None:
+    from mcp import ClientSession
+    from mcp.client.streamable_http import streamablehttp_client
+
+    async with streamablehttp_client(url) as (read, write, _):
+        async with ClientSession(read, write) as client:
+            await client.initialize()
+            for turn in range(BENCH_TURNS):
+                started = time.perf_counter()
+                await client.list_tools()
+                await client.call_tool("min", {})
+                carousel = await client.call_tool("carousel", {"category": [f"Categoria {turn % 40}"], "limit": 8})
+                products = (carousel.structuredContent or {}).get("places") or []
+                result_id = (carousel.structuredContent or {}).get("result_id")
+                if stateful:
+                    assert result_id, "stateful carousel without result_id"
+                    page = await client.call_tool("products_by_ids", {"result_id": result_id})
+                else:
+                    page = await client.call_tool("products_by_ids", {"ids": [p["id"] for p in products]})
+                assert not page.isError
+                cart = [{"id": p["id"], "name": p["name"]} for p in products[:2]]
+                await client.call_tool("cross_sell_recommendations", {"cartItems": cart, "maxResults": 4})
+                latencies.append(time.perf_counter() - started)
+
+
+def _run_benchmark(catalog_dir: Path, stateful: bool) -> Dict[str, float]:
+    port = _free_port()
+    env = {k: v for k, v in os.environ.items() if k not in ("WEB_CONCURRENCY", "CAPTURE_DIR")}
+    env.update(
+        CATALOG_URI=f"parquet:{catalog_dir}",
+        MCP_STATEFUL="1" if stateful else "0",
+        SHARED_CACHE_PATH="off",
+        RATE_LIMIT_ENABLED="0",  # misura il server, non il limitatore
+        PYTHONDONTWRITEBYTECODE="1",
+    )
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=SERVER_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}/mcp?proj=electronics"
+    try:
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                urllib.request.urlopen(f"http://127.0.0.1:{port}/widgets/manifest", timeout=1)
+                break
+            except OSError:
+                assert server.poll() is None and time.monotonic() < deadline, "server did not start"
+                time.sleep(0.1)
+
+        async def clients(count: int) -> List[float]:
+            latencies: List[float] = []
+            await asyncio.gather(*(_conversation(url, stateful, latencies) for _ in range(count)))
+            return latencies
+
+        asyncio.run(clients(1))  # warm-up: indici e catalogo caricati prima della misura
+        started = time.perf_counter()
+        latencies = sorted(asyncio.run(clients(BENCH_CLIENTS)))
+        elapsed = time.perf_counter() - started
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+    calls = len(latencies) * 5
+    return {"calls_per_second": calls / elapsed, "p50_ms": latencies[len(latencies) // 2] * 1000}
+
+
+def test_stateful_throughput_against_stateless(tmp_path):
+    import duckdb
+
+    duckdb.execute(
+        f"""
+        COPY (
+            SELECT i AS id, 'Prodotto ' || i AS name, 'Brand ' || (i % 60) AS brand,
+                   'Categoria ' || (i % 40) AS categories, 1 + (i % 500) * 1.5 AS price, 4.0 AS rate,
+                   'Descrizione del prodotto ' || i AS description, 'https://img.example/' || i || '.jpg' AS image
+            FROM range(20000) t(i)
+        ) TO '{tmp_path / "products.parquet"}' (FORMAT parquet)
+        """
+    )
+    stateless = _run_benchmark(tmp_path, stateful=False)
+    stateful = _run_benchmark(tmp_path, stateful=True)
+    print(
+        f"\n{BENCH_CLIENTS} clients x {BENCH_TURNS} turns: "
+        f"stateless {stateless['calls_per_second']:.0f} calls/s (p50 {stateless['p50_ms']:.0f} ms/turn), "
+        f"stateful {stateful['calls_per_second']:.0f} calls/s (p50 {stateful['p50_ms']:.0f} ms/turn)"
+    )
+    assert stateful["calls_per_second"] >= stateless["calls_per_second"] * BENCH_MIN_RATIO
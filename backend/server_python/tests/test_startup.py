@@ -0,0 +1,74 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).resolve().parent.parent
+# Budget in secondi, alzabili su macchine lente (CI condivisa).
+IMPORT_BUDGET = float(os.getenv("IMPORT_BUDGET_SECONDS", "1.5"))
+FIRST_RESPONSE_BUDGET = float(os.getenv("FIRST_RESPONSE_BUDGET_SECONDS", "5"))
+HEAVY_MODULES = ("duckdb", "stripe", "pandas", "numpy")
+
+
+def _env() -> dict:
+    env = {k: v for k, v in os.environ.items() if k not in ("WEB_CONCURRENCY", "SHARED_CACHE_PATH")}
+    env["PYTHONDONTWRITEBYTECODE"] = "1"
+    return env
+
+
+def _import_time_us(log: str, module: str) -> int:
+    """Tempo cumulativo (µs) di `module` nell'output di `python -X importtime`."""
+    for line in log.splitlines():
+        parts = [p.strip() for p in line.removeprefix("import time:").split("|")]
+        if len(parts) == 3 and parts[2] == module:
+            return int(parts[1])
+    raise AssertionError(f"{module} not found in importtime output")
+
+
+def test_import_skips_heavy_modules_and_fits_budget():
+    check = f"import sys, main; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", check],
+        cwd=SERVER_DIR, env=_env(), capture_output=True, text=True, timeout=60,
+    )
+    assert result.returncode == 0, result.stderr[-2000:]
+    assert result.stdout.strip() == ""
+    seconds = _import_time_us(result.stderr, "main") / 1e6
+    print(f"import main: {seconds:.3f}s (budget {IMPORT_BUDGET}s)")
+    assert seconds < IMPORT_BUDGET
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def test_time_to_first_response():
+    port = _free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=SERVER_DIR, env=_env(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        elapsed = None
+        while time.perf_counter() - started < FIRST_RESPONSE_BUDGET * 2:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/widgets/manifest", timeout=1) as response:
+                    assert response.status == 200
+                elapsed = time.perf_counter() - started
+                break
+            except (urllib.error.URLError, ConnectionError):
+                assert server.poll() is None, "server exited during startup"
+                time.sleep(0.05)
+        assert elapsed is not None, "server did not answer"
+        print(f"time to first response: {elapsed:.3f}s (budget {FIRST_RESPONSE_BUDGET}s)")
+        assert elapsed < FIRST_RESPONSE_BUDGET
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
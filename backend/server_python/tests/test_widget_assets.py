@@ -0,0 +1,51 @@
+import asyncio
+import os
+import threading
+import time
+
+import mcp.types as types
+
+import main
+import widget_assets
+
+
+def test_get_does_no_io_once_indexed(tmp_path, monkeypatch):
+    (tmp_path / "carousel.html").write_text("<div>v1</div>")
+    assets = widget_assets.WidgetAssets(tmp_path, ["carousel"], poll_seconds=0.01)
+    assets.refresh(True)
+
+    def no_scandir(path):
+        raise AssertionError("scandir on the request path")
+
+    monkeypatch.setattr(os, "scandir", no_scandir)
+    time.sleep(0.02)
+    assert assets.due()
+    # Intervallo scaduto, ma get() serve l'indice corrente: il controllo lo fa il chiamante in un thread.
+    assert assets.get("carousel").html == "<div>v1</div>"
+
+
+def test_read_resource_refreshes_off_the_loop(tmp_path, monkeypatch):
+    (tmp_path / "carousel.html").write_text("<div>v1</div>")
+    assets = widget_assets.WidgetAssets(tmp_path, ["carousel"], poll_seconds=0.01)
+    assets.refresh(True)
+    (tmp_path / "carousel.html").write_text("<div>v2</div>")
+    monkeypatch.setattr(main, "WIDGET_ASSETS", assets)
+    scanned_in = []
+    scan = assets._scan_signature
+
+    def recording_scan():
+        scanned_in.append(threading.current_thread())
+        return scan()
+
+    monkeypatch.setattr(assets, "_scan_signature", recording_scan)
+
+    async def scenario() -> str:
+        await asyncio.sleep(0.02)
+        request = types.ReadResourceRequest(
+            method="resources/read", params=types.ReadResourceRequestParams(uri="ui://widget/carousel.html")
+        )
+        result = await main._handle_read_resource(request)
+        return result.root.contents[0].text
+
+    assert asyncio.run(scenario()) == "<div>v2</div>"
+    assert scanned_in and threading.main_thread() not in scanned_in
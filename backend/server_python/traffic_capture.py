@@ -0,0 +1,251 @@
+"""Cattura del traffico MCP reale, da rigiocare con `traffic_replay.py`.
+
+`CaptureMiddleware` osserva le POST su `/mcp` senza alterarle: legge il corpo
+JSON-RPC mentre l'app lo consuma e, a risposta finita, scrive un record per
+messaggio con istante, durata, stato HTTP, progetto, sessione, metodo, tool,
+argomenti ed esito (`isError` o errore JSON-RPC). Le sessioni MCP sono
+campionate intere (`sample_rate` sull'hash dell'id), così il replay ritrova
+sequenze coerenti.
+
+Prima della scrittura gli argomenti sono ripuliti: chiavi sensibili (token,
+email, telefono, indirizzo, carta...) sostituite, `checkout_id` e id di
+sessione pseudonimizzati con un hash stabile, chiavi API (Stripe, OpenAI,
+token Bearer), email e numeri lunghi nel testo mascherati, query string e
+frammenti tolti dagli URL. Gli header HTTP non vengono scritti. Il file è JSON lines,
+uno per worker (`capture-<pid>.jsonl`), scritto a blocchi fuori dall'event
+loop e fermato oltre `max_bytes`.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+from urllib.parse import parse_qs, urlsplit, urlunsplit
+
+# Chiavi il cui valore non va mai scritto.
+_SENSITIVE_KEY = re.compile(
+    r"pass|secret|token|api_?key|auth|cookie|email|e_mail|phone|telefono|cellulare|address|indirizzo|"
+    r"card|carta|iban|cvc|cvv|fiscal|codice_fiscale|birth|nascita",
+    re.IGNORECASE,
+)
+# Chiavi che identificano un cliente: hash stabile, utile al replay per raggruppare.
+_PSEUDONYM_KEYS = {"checkout_id", "customer", "customer_id", "user_id"}
+# Chiavi con id di catalogo: i numeri lunghi (EAN) restano intatti.
+_ID_KEYS = {"id", "ids", "result_id"}
+# Segreti riconoscibili dalla forma anche sotto chiavi innocue: chiavi Stripe, client secret
+# dei PaymentIntent, chiavi OpenAI, token Bearer.
+_SECRET = re.compile(
+    r"\b(?:sk|rk)_(?:live|test)_\w+|\bwhsec_\w+|\b(?:pi|seti)_\w+?_secret_\w+|\bsk-[\w-]{16,}|\bBearer\s+[\w.~+/=-]+",
+    re.IGNORECASE,
+)
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+(\.[\w-]+)+")
+# Telefoni, carte, IBAN numerici: 9+ cifre con eventuali separatori.
+_LONG_NUMBER = re.compile(r"\+?\d(?:[\s.-]?\d){8,}")
+_URL = re.compile(r"https?://\S+")
+# Righe accumulate prima di scrivere su file.
+_FLUSH_RECORDS = 64
+_FLUSH_SECONDS = 2.0
+# Coda della risposta tenuta tra un chunk e l'altro per riconoscere l'esito.
+_TAIL = 32
+
+
+def pseudonym(value: Any) -> str:
+    return "h:" + hashlib.sha256(str(value).encode()).hexdigest()[:12]
+
+
+def _strip_url(match: "re.Match[str] | str") -> str:
+    url = match.group(0) if isinstance(match, re.Match) else match
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, "", ""))
+
+
+def _redact_text(text: str) -> str:
+    text = _SECRET.sub("[secret]", text)
+    text = _URL.sub(_strip_url, text)
+    text = _EMAIL.sub("[email]", text)
+    return _LONG_NUMBER.sub("[number]", text)
+
+
+def redact(value: Any, key: str = "") -> Any:
+    """Copia di `value` senza segreti né dati personali (vedi docstring del modulo)."""
+    if key and _SENSITIVE_KEY.search(key):
+        return "[redacted]"
+    if key in _PSEUDONYM_KEYS and value not in (None, ""):
+        return pseudonym(value)
+    if isinstance(value, dict):
+        return {k: redact(v, str(k)) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v, key) for v in value]
+    if isinstance(value, str) and key not in _ID_KEYS:
+        return _strip_url(_SECRET.sub("[secret]", value)) if key == "url" else _redact_text(value)
+    return value
+
+
+class TrafficCapture:
+    def __init__(self, directory: Path, sample_rate: float = 1.0, max_bytes: int = 512 * 2**20):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._buffer: List[str] = []
+        self._last_flush = time.monotonic()
+        self._written = 0
+        self.stats: Dict[str, int] = {"records": 0, "skipped": 0, "dropped": 0}
+
+    @property
+    def path(self) -> Path:
+        return self.directory / f"capture-{os.getpid()}.jsonl"
+
+    def sampled(self, session: str | None) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        if session is None:
+            return random.random() < self.sample_rate
+        # Stessa decisione per tutte le richieste della sessione.
+        return int(hashlib.sha256(session.encode()).hexdigest()[:8], 16) / 2**32 < self.sample_rate
+
+    def record(self, records: List[Dict[str, Any]]) -> None:
+        """Accoda i record; li scrive a blocchi in un thread del pool."""
+        lines = [json.dumps(r, ensure_ascii=False, separators=(",", ":"), default=str) + "\n" for r in records]
+        with self._lock:
+            if self._written >= self.max_bytes:
+                self.stats["dropped"] += len(lines)
+                return
+            self._buffer.extend(lines)
+            self.stats["records"] += len(lines)
+            if len(self._buffer) < _FLUSH_RECORDS and time.monotonic() - self._last_flush < _FLUSH_SECONDS:
+                return
+            lines, self._buffer = self._buffer, []
+            self._last_flush = time.monotonic()
+        asyncio.get_running_loop().run_in_executor(None, self._write, lines)
+
+    def flush(self) -> None:
+        with self._lock:
+            lines, self._buffer = self._buffer, []
+        if lines:
+            self._write(lines)
+
+    def _write(self, lines: List[str]) -> None:
+        data = "".join(lines).encode("utf8")
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            with self._write_lock, open(self.path, "ab") as out:
+                out.write(data)
+        except OSError as exc:
+            print(f"Error writing traffic capture: {exc}")
+            return
+        with self._lock:
+            self._written += len(data)
+            if self._written >= self.max_bytes:
+                print(f"Traffic capture stopped: {self.path} reached {self.max_bytes / 2**20:.0f} MB")
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"file": str(self.path), "bytes": self._written, "sample_rate": self.sample_rate, **self.stats}
+
+
+def _messages(body: bytes) -> List[Dict[str, Any]]:
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        return []
+    items = payload if isinstance(payload, list) else [payload]
+    return [item for item in items if isinstance(item, dict) and item.get("method")]
+
+
+class CaptureMiddleware:
+    """Middleware ASGI: registra in `TrafficCapture` le richieste JSON-RPC delle POST su `/mcp`."""
+
+    def __init__(self, app: Any, capture: TrafficCapture, path_prefix: str = "/mcp"):
+        self._app = app
+        self._capture = capture
+        self._path_prefix = path_prefix
+
+    async def __call__(self, scope: dict, receive: Any, send: Any) -> None:
+        if (
+            scope.get("type") != "http"
+            or scope.get("method") != "POST"
+            or not scope.get("path", "").startswith(self._path_prefix)
+        ):
+            await self._app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        session = headers.get(b"mcp-session-id", b"").decode("latin-1") or None
+        if not self._capture.sampled(session):
+            self._capture.stats["skipped"] += 1
+            await self._app(scope, receive, send)
+            return
+
+        started_wall = time.time()
+        started = time.perf_counter()
+        body: List[bytes] = []
+        response: Dict[str, Any] = {"status": 0, "bytes": 0, "error": False, "tail": b"", "session": None}
+
+        async def tee_receive() -> Any:
+            message = await receive()
+            if message["type"] == "http.request":
+                body.append(message.get("body", b""))
+            return message
+
+        async def tee_send(message: Any) -> None:
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for name, value in message.get("headers") or []:
+                    if name.lower() == b"mcp-session-id":
+                        response["session"] = value.decode("latin-1")
+            elif message["type"] == "http.response.body":
+                chunk = message.get("body", b"")
+                response["bytes"] += len(chunk)
+                window = response["tail"] + chunk
+                if b'"isError":true' in window or b'"error":{' in window:
+                    response["error"] = True
+                response["tail"] = window[-_TAIL:]
+            await send(message)
+
+        try:
+            await self._app(scope, tee_receive, tee_send)
+        finally:
+            try:
+                self._record(scope, session or response["session"], b"".join(body), started_wall, started, response)
+            except Exception as exc:
+                print(f"Traffic capture failed: {exc!r}")
+
+    def _record(
+        self, scope: dict, session: str | None, body: bytes, started_wall: float, started: float, response: Dict[str, Any]
+    ) -> None:
+        messages = _messages(body)
+        if not messages:
+            return
+        query = parse_qs((scope.get("query_string") or b"").decode("latin-1"))
+        project = (query.get("proj") or [None])[0]
+        elapsed_ms = round((time.perf_counter() - started) * 1000, 2)
+        records = []
+        for message in messages:
+            params = message.get("params") if isinstance(message.get("params"), dict) else {}
+            record: Dict[str, Any] = {
+                "ts": round(started_wall, 4),
+                "ms": elapsed_ms,
+                "status": response["status"],
+                "proj": project,
+                "session": pseudonym(session) if session else None,
+                "method": message["method"],
+            }
+            if message["method"] == "tools/call":
+                record["tool"] = params.get("name")
+                record["args"] = redact(params.get("arguments") or {})
+            elif message["method"] == "resources/read":
+                record["uri"] = params.get("uri")
+            if "id" in message:
+                record["error"] = response["error"] or response["status"] >= 400
+                record["bytes"] = response["bytes"]
+            records.append(record)
+        self._capture.record(records)
@@ -0,0 +1,388 @@
+"""Replay del traffico catturato da `traffic_capture.py` contro un server locale.
+
+    python traffic_replay.py /tmp/mcp-capture/capture-*.jsonl --serve --speed 10
+    python traffic_replay.py capture.jsonl --serve --speed 0 \\
+        --variant default: --variant small:CACHE_MEMORY_BUDGET_MB=32,CATALOG_CACHE_SECONDS=30
+    python traffic_replay.py capture.jsonl --url http://localhost:8000/mcp --json-out run.json
+
+Ogni sessione catturata diventa una sessione client MCP che ripete le sue
+chiamate nell'ordine originale; le chiamate senza sessione (server stateless)
+partono indipendenti. `--speed 1` rispetta i tempi originali, `--speed 10` li
+comprime di 10 volte, `--speed 0` va alla massima velocità (limitata da
+`--concurrency`).
+
+Con `--serve` il server (`main.py`) parte in un processo dedicato con
+`MOCK_UPSTREAMS=1` (vedi upstream_mocks.py) e una cache condivisa nuova, così
+ogni esecuzione parte a freddo ed è confrontabile; `--env` e `--variant`
+cambiano le impostazioni da confrontare. Il report dà distribuzione delle
+latenze per tool (con quella originale accanto), errori e hit rate delle cache
+letti da `/metrics` prima e dopo il replay (`/metrics` richiede
+`PROFILER_SECRET`: con `--serve` ne viene generato uno se manca).
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import glob
+import json
+import logging
+import os
+import secrets
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Sequence, Tuple
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Metodi rigiocati: initialize e notifiche li genera il client MCP.
+REPLAYED_METHODS = ("tools/call", "tools/list", "resources/read")
+
+
+def load_records(patterns: Sequence[str], tools: Sequence[str] = (), limit: int | None = None) -> List[Dict[str, Any]]:
+    records: List[Dict[str, Any]] = []
+    for path in sorted({p for pattern in patterns for p in glob.glob(pattern)}):
+        with open(path, encoding="utf8") as source:
+            for line in source:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue  # riga troncata (worker terminato durante la scrittura)
+                if record.get("method") not in REPLAYED_METHODS:
+                    continue
+                if tools and record.get("tool") not in tools:
+                    continue
+                records.append(record)
+    records.sort(key=lambda r: r["ts"])
+    return records[:limit] if limit else records
+
+
+def percentile(values: List[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+
+def _distribution(values: List[float]) -> Dict[str, Any]:
+    def ms(value: float | None) -> float | None:
+        return None if value is None else round(value, 1)
+
+    return {
+        "count": len(values),
+        "p50": ms(percentile(values, 0.5)),
+        "p90": ms(percentile(values, 0.9)),
+        "p99": ms(percentile(values, 0.99)),
+        "max": ms(max(values) if values else None),
+    }
+
+
+def _with_project(url: str, project: str | None) -> str:
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    if project:
+        query["proj"] = project
+    return urlunsplit((parts.scheme, parts.netloc, parts.path, urlencode(query), ""))
+
+
+class Replayer:
+    def __init__(self, url: str, speed: float, concurrency: int, max_sessions: int, timeout: float):
+        self.url = url
+        self.speed = speed
+        self.timeout = timeout
+        self._calls = asyncio.Semaphore(concurrency)
+        self._sessions = asyncio.Semaphore(max_sessions)
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.lag: List[float] = []
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.tool_errors: Dict[str, int] = defaultdict(int)
+
+    async def run(self, records: List[Dict[str, Any]]) -> float:
+        groups: Dict[Tuple[str | None, str | None], List[Dict[str, Any]]] = defaultdict(list)
+        for record in records:
+            groups[(record.get("session"), record.get("proj"))].append(record)
+        loop = asyncio.get_running_loop()
+        origin = records[0]["ts"]
+        start = loop.time() + 0.2
+        started = time.perf_counter()
+        await asyncio.gather(*(self._group(session, project, rows, origin, start) for (session, project), rows in groups.items()))
+        return time.perf_counter() - started
+
+    def _due(self, record: Dict[str, Any], origin: float, start: float) -> float:
+        return start + (record["ts"] - origin) / self.speed if self.speed > 0 else start
+
+    async def _group(
+        self, session: str | None, project: str | None, rows: List[Dict[str, Any]], origin: float, start: float
+    ) -> None:
+        from mcp import ClientSession
+        from mcp.client.streamable_http import streamablehttp_client
+
+        loop = asyncio.get_running_loop()
+        await asyncio.sleep(max(self._due(rows[0], origin, start) - loop.time(), 0))
+        async with self._sessions:
+            try:
+                async with streamablehttp_client(_with_project(self.url, project)) as (read, write, _):
+                    async with ClientSession(read, write) as client:
+                        await client.initialize()
+                        if session is None:
+                            # Senza sessione le chiamate sono indipendenti: concorrenti come in origine.
+                            await asyncio.gather(*(self._play(client, row, origin, start) for row in rows))
+                        else:
+                            for row in rows:
+                                await self._play(client, row, origin, start)
+            except Exception as exc:
+                self.errors[f"session: {type(exc).__name__}"] += 1
+
+    async def _play(self, client: Any, record: Dict[str, Any], origin: float, start: float) -> None:
+        loop = asyncio.get_running_loop()
+        due = self._due(record, origin, start)
+        await asyncio.sleep(max(due - loop.time(), 0))
+        name = record.get("tool") or record["method"]
+        async with self._calls:
+            self.lag.append((loop.time() - due) * 1000)
+            started = time.perf_counter()
+            try:
+                if record["method"] == "tools/call":
+                    result = await asyncio.wait_for(client.call_tool(record["tool"], record.get("args") or {}), self.timeout)
+                    if result.isError:
+                        self.tool_errors[name] += 1
+                elif record["method"] == "tools/list":
+                    await asyncio.wait_for(client.list_tools(), self.timeout)
+                else:
+                    from pydantic import AnyUrl
+
+                    await asyncio.wait_for(client.read_resource(AnyUrl(record["uri"])), self.timeout)
+            except Exception as exc:
+                self.errors[f"{name}: {type(exc).__name__}"] += 1
+                return
+            self.latencies[name].append((time.perf_counter() - started) * 1000)
+
+
+def _metrics_url(url: str) -> str:
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, "/metrics", "", ""))
+
+
+def _metrics_headers(secret: str | None) -> Dict[str, str]:
+    return {"Authorization": f"Bearer {secret}"} if secret else {}
+
+
+def _fetch_metrics(url: str, secret: str | None) -> Dict[str, Any] | None:
+    import httpx
+
+    try:
+        response = httpx.get(_metrics_url(url), headers=_metrics_headers(secret), timeout=10)
+        response.raise_for_status()
+        return response.json()
+    except Exception as exc:
+        print(f"Cannot read {_metrics_url(url)}: {exc}")
+        return None
+
+
+def cache_hit_rates(before: Dict[str, Any] | None, after: Dict[str, Any] | None) -> Dict[str, Dict[str, Any]]:
+    """Hit, miss e sfratti di ogni cache durante il replay (differenza tra due /metrics)."""
+    if not before or not after:
+        return {}
+
+    def counters(metrics: Dict[str, Any]) -> Dict[str, Dict[str, int]]:
+        caches = {name: snap for name, snap in (metrics.get("memory_caches") or {}).get("caches", {}).items()}
+        # Hit e miss della cache condivisa dai suoi contatori (SQLite o memoria), sfratti dal registro.
+        caches["shared_cache"] = {**caches.get("shared_cache", {}), **(metrics.get("shared_cache") or {})}
+        sessions = metrics.get("sessions") or {}
+        caches["sessions"] = {**caches.get("sessions", {}), "hits": sessions.get("reused", 0), "misses": sessions.get("created", 0)}
+        return caches
+
+    start, end = counters(before), counters(after)
+    rates: Dict[str, Dict[str, Any]] = {}
+    for name, snap in end.items():
+        old = start.get(name, {})
+        hits = snap.get("hits", 0) - old.get("hits", 0)
+        misses = snap.get("misses", 0) - old.get("misses", 0)
+        if hits + misses == 0:
+            continue
+        rates[name] = {
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": round(hits / (hits + misses), 3),
+            "evictions": snap.get("evictions", 0) - old.get("evictions", 0),
+            "rejected": snap.get("rejected", 0) - old.get("rejected", 0),
+        }
+    return rates
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(env_overrides: Dict[str, str], log_path: Path, secret: str) -> Tuple[subprocess.Popen, str]:
+    """Avvia main.py con upstream finti e cache condivisa nuova; restituisce processo e URL MCP."""
+    import httpx
+
+    port = _free_port()
+    env = {k: v for k, v in os.environ.items() if k != "CAPTURE_DIR"}  # il replay non si ricattura
+    env.update(
+        {
+            "HOST": "127.0.0.1",
+            "PORT": str(port),
+            "MOCK_UPSTREAMS": "1",
+            # Con una chiave anche i percorsi LLM girano come in produzione (contro il mock).
+            "OPENAI_API_KEY": env.get("OPENAI_API_KEY") or "mock",
+            "SHARED_CACHE_PATH": str(log_path.with_suffix(".sqlite3")),
+        }
+    )
+    env.update(env_overrides)
+    env["PROFILER_SECRET"] = secret  # protegge /metrics
+    log = open(log_path, "w", encoding="utf8")
+    process = subprocess.Popen(
+        [sys.executable, "main.py"], cwd=Path(__file__).resolve().parent, env=env, stdout=log, stderr=subprocess.STDOUT
+    )
+    url = f"http://127.0.0.1:{port}/mcp"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}, see {log_path}")
+        try:
+            httpx.get(_metrics_url(url), headers=_metrics_headers(secret), timeout=1).raise_for_status()
+            return process, url
+        except Exception:
+            time.sleep(0.3)
+    process.terminate()
+    raise RuntimeError(f"Server not ready after 60s, see {log_path}")
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+def replay(records: List[Dict[str, Any]], url: str, args: argparse.Namespace) -> Dict[str, Any]:
+    before = _fetch_metrics(url, args.metrics_secret)
+    replayer = Replayer(url, args.speed, args.concurrency, args.max_sessions, args.timeout)
+    elapsed = asyncio.run(replayer.run(records))
+    after = _fetch_metrics(url, args.metrics_secret)
+    all_latencies = [ms for values in replayer.latencies.values() for ms in values]
+    original: Dict[str, List[float]] = defaultdict(list)
+    for record in records:
+        original[record.get("tool") or record["method"]].append(record.get("ms") or 0.0)
+    return {
+        "calls": len(all_latencies),
+        "seconds": round(elapsed, 2),
+        "calls_per_second": round(len(all_latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": _distribution(all_latencies),
+        "schedule_lag_ms": _distribution(replayer.lag),
+        "by_tool": {
+            name: {"replay": _distribution(values), "original": _distribution(original.get(name, []))}
+            for name, values in sorted(replayer.latencies.items())
+        },
+        "errors": dict(replayer.errors),
+        "tool_errors": {"replay": dict(replayer.tool_errors), "original": sum(1 for r in records if r.get("error"))},
+        "caches": cache_hit_rates(before, after),
+        "upstream_calls": (after or {}).get("upstream_mocks"),
+    }
+
+
+def print_report(name: str, report: Dict[str, Any]) -> None:
+    latency = report["latency_ms"]
+    print(
+        f"\n== {name}: {report['calls']} calls in {report['seconds']}s ({report['calls_per_second']} calls/s), "
+        f"p50 {latency['p50']} ms, p90 {latency['p90']} ms, p99 {latency['p99']} ms, "
+        f"schedule lag p90 {report['schedule_lag_ms']['p90']} ms"
+    )
+    print(f"{'tool':<28}{'calls':>7}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}   original p50/p99")
+    for tool, row in report["by_tool"].items():
+        r, o = row["replay"], row["original"]
+        print(f"{tool:<28}{r['count']:>7}{r['p50']!s:>9}{r['p90']!s:>9}{r['p99']!s:>9}{r['max']!s:>9}   {o['p50']}/{o['p99']}")
+    if report["caches"]:
+        print(f"{'cache':<28}{'hits':>7}{'misses':>9}{'hit rate':>10}{'evicted':>9}{'too big':>9}")
+        for cache, row in sorted(report["caches"].items()):
+            print(
+                f"{cache:<28}{row['hits']:>7}{row['misses']:>9}{row['hit_rate']:>10.1%}"
+                f"{row['evictions']:>9}{row['rejected']:>9}"
+            )
+    if report["errors"] or report["tool_errors"]["replay"]:
+        print(f"errors: {report['errors']}, tool errors: {report['tool_errors']}")
+
+
+def _parse_env(items: Sequence[str]) -> Dict[str, str]:
+    env: Dict[str, str] = {}
+    for item in items:
+        for pair in item.split(","):
+            key, sep, value = pair.partition("=")
+            if sep and key.strip():
+                env[key.strip()] = value
+    return env
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Replay captured MCP traffic and report latency and cache hit rates.")
+    parser.add_argument("inputs", nargs="+", help="Capture files or globs (capture-<pid>.jsonl)")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/mcp", help="MCP endpoint of a running server")
+    parser.add_argument("--serve", action="store_true", help="Start main.py with mocked upstreams and replay against it")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE[,KEY=VALUE]",
+                        help="Server settings for --serve")
+    parser.add_argument("--variant", action="append", default=[], metavar="NAME:KEY=VALUE[,KEY=VALUE]",
+                        help="With --serve, replay once per variant on a fresh server and compare")
+    parser.add_argument("--speed", type=float, default=1.0, help="1 = original pacing, 10 = 10x faster, 0 = no pacing")
+    parser.add_argument("--concurrency", type=int, default=64, help="Maximum calls in flight")
+    parser.add_argument("--max-sessions", type=int, default=256, help="Maximum client sessions open at once")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-call timeout in seconds")
+    parser.add_argument("--tool", action="append", default=[], help="Only replay these tools")
+    parser.add_argument("--limit", type=int, help="Only replay the first N calls")
+    parser.add_argument("--json-out", help="Write the reports as JSON here")
+    parser.add_argument("--metrics-secret", default=os.getenv("PROFILER_SECRET"),
+                        help="PROFILER_SECRET of the server, needed to read /metrics (default: $PROFILER_SECRET)")
+    args = parser.parse_args(argv)
+
+    if args.variant and not args.serve:
+        parser.error("--variant needs --serve")
+    if args.serve and not args.metrics_secret:
+        args.metrics_secret = secrets.token_urlsafe(32)
+    records = load_records(args.inputs, args.tool, args.limit)
+    if not records:
+        parser.error(f"no replayable calls in {args.inputs}")
+    span = records[-1]["ts"] - records[0]["ts"]
+    sessions = len({r.get("session") for r in records if r.get("session")})
+    print(f"Loaded {len(records)} calls over {span:.0f}s ({sessions} sessions)")
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    variants = [(name, _parse_env([env])) for name, _, env in (v.partition(":") for v in args.variant)]
+    if not variants:
+        variants = [("replay", {})]
+    base_env = _parse_env(args.env)
+    reports: Dict[str, Dict[str, Any]] = {}
+    workdir = Path(tempfile.mkdtemp(prefix="mcp-replay-"))
+    for name, env in variants:
+        if not args.serve:
+            reports[name] = replay(records, args.url, args)
+        else:
+            process, url = start_server({**base_env, **env}, workdir / f"{name}.log", args.metrics_secret)
+            try:
+                reports[name] = replay(records, url, args)
+            finally:
+                stop_server(process)
+        print_report(name, reports[name])
+    if len(reports) > 1:
+        print(f"\n{'variant':<20}{'calls/s':>9}{'p50':>9}{'p99':>9}{'errors':>8}")
+        for name, report in reports.items():
+            latency = report["latency_ms"]
+            errors = sum(report["errors"].values()) + sum(report["tool_errors"]["replay"].values())
+            print(f"{name:<20}{report['calls_per_second']!s:>9}{latency['p50']!s:>9}{latency['p99']!s:>9}{errors:>8}")
+    if args.serve:
+        print(f"Server logs in {workdir}")
+    if args.json_out:
+        Path(args.json_out).write_text(json.dumps(reports, indent=2), encoding="utf8")
+        print(f"Wrote {args.json_out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,118 @@
+"""Upstream finti per il replay del traffico (`MOCK_UPSTREAMS=1`).
+
+Sostituiscono OpenAI, TheMealDB, le pagine ricetta e Stripe con risposte
+deterministiche, plausibili per i parser di main.py, dopo una latenza fissa
+per upstream (`MOCK_UPSTREAM_LATENCY_MS`, es. `openai=800,stripe=300`).
+Così un replay misura il server (cache, pool, catalogo) e non la rete, senza
+costi né effetti collaterali. Le risposte dipendono solo dalla richiesta:
+due replay con impostazioni diverse ricevono gli stessi dati.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+from typing import Any, Dict
+
+import httpx
+
+DEFAULT_LATENCY_MS = {"openai": 800.0, "themealdb": 150.0, "recipe_page": 250.0, "stripe": 350.0}
+
+
+def parse_latencies(value: str | None) -> Dict[str, float]:
+    """`"openai=800,stripe=300"` -> latenze in ms, a partire da quelle di default."""
+    latencies = dict(DEFAULT_LATENCY_MS)
+    for part in (value or "").split(","):
+        name, _, ms = part.partition("=")
+        if name.strip() and ms.strip():
+            latencies[name.strip()] = float(ms)
+    return latencies
+
+
+def _openai_answer(body: Dict[str, Any]) -> Dict[str, Any]:
+    prompt = " ".join(str(m.get("content", "")) for m in body.get("messages", []) if isinstance(m, dict))
+    if "Dati:" in prompt:
+        try:
+            items = json.loads(prompt.split("Dati:", 1)[1]).get("items", [])
+        except ValueError:
+            items = []
+        content: Dict[str, Any] = {
+            "items": [
+                {"id": item.get("id"), "pro": f"Buon rapporto qualità/prezzo ({item.get('brand')})", "contro": "Disponibilità limitata"}
+                for item in items
+            ]
+        }
+    else:
+        text = prompt.split("Testo ricetta:", 1)[-1]
+        lines = [line.strip(" -•*\t") for line in text.splitlines() if line.strip(" -•*\t")]
+        content = {"title": lines[0] if lines else None, "ingredients": [{"name": line} for line in lines[1:13]]}
+    return {"choices": [{"message": {"role": "assistant", "content": json.dumps(content, ensure_ascii=False)}}]}
+
+
+def _mealdb_answer(query: str) -> Dict[str, Any]:
+    if not query.strip():
+        return {"meals": None}
+    meal: Dict[str, Any] = {
+        "idMeal": str(int(hashlib.sha256(query.lower().encode()).hexdigest()[:6], 16)),
+        "strMeal": query.strip().title(),
+        "strSource": None,
+        "strYoutube": None,
+    }
+    for index, (name, measure) in enumerate(
+        [("Pasta", "400 g"), ("Olio extravergine", "2 cucchiai"), ("Pomodori", "500 g"), ("Parmigiano", "50 g"), ("Sale", "q.b.")],
+        start=1,
+    ):
+        meal[f"strIngredient{index}"] = name
+        meal[f"strMeasure{index}"] = measure
+    return {"meals": [meal]}
+
+
+def _recipe_page(url: str) -> str:
+    title = re.sub(r"[-_/]+", " ", url.rstrip("/").rsplit("/", 1)[-1]).strip() or "Ricetta"
+    recipe = {
+        "@context": "https://schema.org",
+        "@type": "Recipe",
+        "name": title,
+        "recipeIngredient": ["400 g di pasta", "2 cucchiai di olio extravergine", "500 g di pomodori", "sale"],
+    }
+    return (
+        f"<html><head><title>{title}</title>"
+        f'<script type="application/ld+json">{json.dumps(recipe)}</script></head>'
+        f"<body><h1>{title}</h1></body></html>"
+    )
+
+
+class MockTransport(httpx.AsyncBaseTransport):
+    """Transport httpx che risponde al posto degli upstream reali."""
+
+    def __init__(self, latencies: Dict[str, float] | None = None):
+        self.latencies = latencies or dict(DEFAULT_LATENCY_MS)
+        self.stats: Dict[str, int] = {}
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        host = request.url.host
+        if host == "api.openai.com":
+            upstream = "openai"
+            await request.aread()
+            response = httpx.Response(200, json=_openai_answer(json.loads(request.content or b"{}")))
+        elif host.endswith("themealdb.com"):
+            upstream = "themealdb"
+            response = httpx.Response(200, json=_mealdb_answer(request.url.params.get("s", "")))
+        else:
+            upstream = "recipe_page"
+            response = httpx.Response(
+                200, headers={"content-type": "text/html; charset=utf-8"}, text=_recipe_page(str(request.url))
+            )
+        self.stats[upstream] = self.stats.get(upstream, 0) + 1
+        await asyncio.sleep(self.latencies.get(upstream, 0.0) / 1000)
+        return response
+
+
+def payment_intent(amount: int, currency: str, idempotency_key: str | None, latencies: Dict[str, float]) -> Dict[str, Any]:
+    """Come `PaymentIntent.create` confermato; sincrono, gira in un thread come quello vero."""
+    time.sleep(latencies.get("stripe", 0.0) / 1000)
+    material = f"{idempotency_key or time.time_ns()}|{amount}|{currency}"
+    return {"status": "succeeded", "payment_intent_id": "pi_mock_" + hashlib.sha256(material.encode()).hexdigest()[:24]}
@@ -0,0 +1,120 @@
+"""Indice dei bundle HTML dei widget in `frontend/assets`, con ricarica a caldo.
+
+La cartella viene indicizzata una volta (componente -> file, HTML, ETag) e poi
+ricontrollata al massimo ogni `poll_seconds` quando qualcuno chiede un widget.
+Il controllo (scandir, stat, lettura) gira in un thread, mai sull'event loop:
+se un `pnpm run build` ha scritto nuovi file, si costruisce un nuovo indice e
+lo si sostituisce in un solo assegnamento, così una richiesta vede sempre o
+tutto il vecchio indice o tutto il nuovo. Niente riavvio per aggiornare i widget.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, Iterable, Tuple
+
+
+@dataclass(frozen=True)
+class WidgetAsset:
+    component: str
+    path: Path
+    html: str
+    etag: str
+    modified: float
+
+
+class WidgetAssets:
+    def __init__(self, directory: Path, components: Iterable[str], poll_seconds: float = 2.0):
+        self.directory = directory
+        self.components = tuple(components)
+        self.poll_seconds = poll_seconds
+        self._assets: Dict[str, WidgetAsset] = {}
+        self._signature: Tuple[Any, ...] | None = None
+        self._checked_at = 0.0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _scan_signature(self) -> Tuple[Any, ...]:
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith(".html") and e.is_file()]
+        except FileNotFoundError:
+            return ()
+        return tuple(sorted((e.name, e.stat().st_mtime_ns, e.stat().st_size) for e in entries))
+
+    def _build(self, signature: Tuple[Any, ...]) -> Dict[str, WidgetAsset]:
+        mtimes = {name: mtime_ns for name, mtime_ns, _ in signature}
+        assets: Dict[str, WidgetAsset] = {}
+        for component in self.components:
+            # `<component>.html` se c'è, altrimenti la build con hash più recente.
+            name = f"{component}.html"
+            if name not in mtimes:
+                hashed = [n for n in mtimes if n.startswith(f"{component}-")]
+                if not hashed:
+                    continue
+                name = max(hashed, key=lambda n: (mtimes[n], n))
+            mtime_ns = mtimes[name]
+            path = self.directory / name
+            try:
+                html = path.read_text(encoding="utf8")
+            except OSError:
+                continue  # file rimosso durante la build: lo riprende il prossimo controllo
+            etag = '"' + hashlib.sha256(html.encode("utf8")).hexdigest()[:32] + '"'
+            assets[component] = WidgetAsset(component, path, html, etag, mtime_ns / 1e9)
+        return assets
+
+    def due(self) -> bool:
+        """True se è ora di ricontrollare la cartella (mai indicizzata o intervallo scaduto)."""
+        if self._signature is None:
+            return True
+        return self.poll_seconds > 0 and time.monotonic() - self._checked_at >= self.poll_seconds
+
+    def refresh(self, force: bool = False) -> bool:
+        """Ricontrolla la cartella; True se l'indice è stato sostituito."""
+        now = time.monotonic()
+        if not force and not self.due():
+            return False
+        with self._lock:
+            self._checked_at = now
+            signature = self._scan_signature()
+            if signature == self._signature:
+                return False
+            assets = self._build(signature)
+            changed = [c for c, a in assets.items() if c not in self._assets or self._assets[c].etag != a.etag]
+            self._assets = assets  # swap atomico
+            self._signature = signature
+            self._generation += 1
+        if self._generation > 1 and changed:
+            print(f"Reloaded widget assets: {', '.join(sorted(changed))}")
+        return True
+
+    def get(self, component: str) -> WidgetAsset:
+        """Asset dall'indice corrente, senza I/O se già indicizzato (dal loop: prima `refresh` in un thread)."""
+        if self._signature is None:
+            self.refresh()
+        asset = self._assets.get(component)
+        if asset is None:
+            raise FileNotFoundError(
+                f'Widget HTML for "{component}" not found in {self.directory}. '
+                "Run `pnpm run build` to generate the assets before starting the server."
+            )
+        return asset
+
+    def manifest(self) -> Dict[str, Any]:
+        self.refresh()
+        return {
+            "generation": self._generation,
+            "assets": {
+                component: {
+                    "file": asset.path.name,
+                    "etag": asset.etag,
+                    "bytes": len(asset.html.encode("utf8")),
+                    "modified": asset.modified,
+                }
+                for component, asset in sorted(self._assets.items())
+            },
+        }
@@ -73,8 +73,9 @@ function App() {
     let mergedItems = selectedCompareItems;
     try {
       if (typeof window !== "undefined" && window.openai?.callTool) {
+        // Solo gli id: nome, prezzo e descrizione li legge il server dal catalogo.
         const response = await window.openai.callTool("compare_enrich", {
-          items: selectedCompareItems,
+          ids: selectedCompareItems.map((item) => item.id),
         });
         const enriched = response?.structuredContent?.items ?? [];
         if (Array.isArray(enriched) && enriched.length > 0) {
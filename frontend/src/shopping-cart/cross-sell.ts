@@ -501,7 +501,12 @@ export function mergeCrossSellSuggestions(
   toolSuggestions: CrossSellItem[] | null,
   catalog: CrossSellItem[]
 ): CrossSellItem[] {
-  const fallback = getCrossSellSuggestions(cartItems, catalog);
+  // Il catalogo di ripiego è di accessori PC/TV: per gli altri carrelli (ad es. la spesa)
+  // valgono solo i suggerimenti del server.
+  const fallback =
+    getCartCategoryIntent(cartItems).categories.length > 0
+      ? getCrossSellSuggestions(cartItems, catalog)
+      : [];
   if (!toolSuggestions || toolSuggestions.length === 0) {
     return fallback;
   }
@@ -1,4 +1,4 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { createRoot } from "react-dom/client";
 import { AnimatePresence } from "framer-motion";
 import { useCart } from "../use-cart";
@@ -28,6 +28,8 @@ function App() {
   const [billingCity, setBillingCity] = useState("");
   const [billingPostalCode, setBillingPostalCode] = useState("");
   const [billingCountry, setBillingCountry] = useState("");
+  // Id del checkout stabile tra i retry dello stesso carrello: il server ne deriva la chiave di idempotenza.
+  const checkoutIdRef = useRef<{ cartKey: string; id: string } | null>(null);
   const animationStyles = `
     @keyframes fadeUp {
       from { opacity: 0; transform: translateY(10px); }
@@ -134,6 +136,9 @@ function App() {
     }
     setIsCheckingOut(true);
     setCheckoutError(null);
+    // Esito incerto (chiamata fallita, timeout Stripe): il retry riusa lo stesso checkout_id,
+    // così non crea un secondo addebito. Un rifiuto o un errore certo richiede un id nuovo.
+    let keepCheckoutId = true;
     try {
       const totalCents = Math.round(
         cartItems.reduce(
@@ -142,12 +147,28 @@ function App() {
         ) * 100
       );
       
+      const cartLines = cartItems.map((item) => ({
+        id: String(item.id),
+        quantity: item.quantity ?? 1,
+      }));
+      const cartKey = JSON.stringify(cartLines);
+      if (!checkoutIdRef.current || checkoutIdRef.current.cartKey !== cartKey) {
+        const id =
+          typeof crypto !== "undefined" && typeof crypto.randomUUID === "function"
+            ? crypto.randomUUID()
+            : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+        checkoutIdRef.current = { cartKey, id };
+      }
+
       const createResponse = await window.openai.callTool("create_payment_intent", {
         amount: totalCents,
         currency: "eur",
+        checkout_id: checkoutIdRef.current.id,
+        cart: cartLines,
       });
       
       const createStructured = extractStructuredContent(createResponse);
+      keepCheckoutId = createStructured?.retryable === true;
       const status =
         createStructured && typeof createStructured.status === "string"
           ? createStructured.status
@@ -192,6 +213,7 @@ function App() {
           deliveryDate: randomDeliveryDate(),
         });
         clearCart();
+        checkoutIdRef.current = null;
         setShowBillingModal(false);
         setCheckoutStatus("success");
       } else {
@@ -199,6 +221,9 @@ function App() {
         throw new Error("Pagamento non riuscito.");
       }
     } catch (error) {
+      if (!keepCheckoutId) {
+        checkoutIdRef.current = null;
+      }
       setCheckoutError(error instanceof Error ? error.message : "Errore durante il checkout.");
     } finally {
       setIsCheckingOut(false);